@@ -0,0 +1,292 @@
+# ai-service/benchmarks/fake_upstream.py
+"""
+Server giả lập OpenAI (chat, embeddings, Whisper) + Tavily để benchmark / load test không tốn tiền API.
+
+Chạy:
+    python -m benchmarks.fake_upstream --port 9999 --latency-ms 300 --error-rate 0.01
+
+Rồi trỏ service vào đây:
+    OPENAI_BASE_URL=http://127.0.0.1:9999/v1 TAVILY_BASE_URL=http://127.0.0.1:9999 uvicorn src.main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+EMBEDDING_DIMENSIONS = 1536
+
+@dataclass
+class FakeConfig:
+    # Latency (ms) mỗi loại request; latency thật = latency ± jitter
+    chat_latency_ms: float = float(os.getenv("FAKE_CHAT_LATENCY_MS", "400"))
+    embedding_latency_ms: float = float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "80"))
+    transcription_latency_ms: float = float(os.getenv("FAKE_TRANSCRIPTION_LATENCY_MS", "1500"))
+    search_latency_ms: float = float(os.getenv("FAKE_SEARCH_LATENCY_MS", "600"))
+    jitter: float = float(os.getenv("FAKE_JITTER", "0.2"))  # 0.2 = ±20%
+    token_interval_ms: float = float(os.getenv("FAKE_TOKEN_INTERVAL_MS", "15"))  # khoảng cách giữa 2 token khi stream
+    # Lỗi giả lập: tỉ lệ request trả 5xx và tỉ lệ trả 429 (kèm Retry-After)
+    error_rate: float = float(os.getenv("FAKE_ERROR_RATE", "0"))
+    error_status: int = int(os.getenv("FAKE_ERROR_STATUS", "500"))
+    rate_limit_rate: float = float(os.getenv("FAKE_RATE_LIMIT_RATE", "0"))
+    retry_after_seconds: float = float(os.getenv("FAKE_RETRY_AFTER_SECONDS", "1"))
+    seed: Optional[int] = None
+
+config = FakeConfig()
+_random = random.Random()
+request_counts: Counter = Counter()
+error_counts: Counter = Counter()
+
+app = FastAPI(title="Lingora fake upstream")
+
+ANSWER = (
+    "Thì hiện tại hoàn thành (Present Perfect) dùng để diễn tả hành động đã xảy ra trong quá khứ "
+    "nhưng còn liên quan tới hiện tại. Cấu trúc: S + have/has + V3. Ví dụ: I have lived here for five years."
+)
+TRANSCRIPT = "I think learning English is important because it opens many opportunities for work and travel."
+
+def _fake_vector(text: str, dimensions: int) -> list:
+    # Vector giả nhưng ổn định theo nội dung -> cùng text luôn ra cùng vector (cache/Chroma vẫn hoạt động đúng)
+    values = []
+    block = 0
+    while len(values) < dimensions:
+        digest = hashlib.sha256(f"{block}:{text}".encode("utf-8")).digest()
+        values.extend((byte - 128) / 128 for byte in digest)
+        block += 1
+    values = values[:dimensions]
+    norm = math.sqrt(sum(value * value for value in values)) or 1.0
+    return [value / norm for value in values]
+
+def _fill_schema(schema: dict, defs: Optional[dict] = None):
+    """Sinh JSON hợp lệ theo json_schema của with_structured_output (GradingResult, ModerationResult...)."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return _fill_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        return _fill_schema([option for option in schema["anyOf"] if option.get("type") != "null"][0], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _fill_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_fill_schema(schema.get("items", {}), defs)]
+    if kind == "boolean":
+        return False
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 6.5
+    return "ok"
+
+async def _delay(latency_ms: float):
+    jitter = latency_ms * config.jitter
+    await asyncio.sleep(max(0.0, latency_ms + _random.uniform(-jitter, jitter)) / 1000)
+
+def _injected_error(endpoint: str) -> Optional[JSONResponse]:
+    request_counts[endpoint] += 1
+    roll = _random.random()
+    if roll < config.rate_limit_rate:
+        error_counts[f"{endpoint}:429"] += 1
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (fake)", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"Retry-After": f"{config.retry_after_seconds:g}"},
+        )
+    if roll < config.rate_limit_rate + config.error_rate:
+        error_counts[f"{endpoint}:{config.error_status}"] += 1
+        return JSONResponse(
+            {"error": {"message": "Upstream error (fake)", "type": "server_error"}},
+            status_code=config.error_status,
+        )
+    return None
+
+def _usage(prompt: str, completion: str) -> dict:
+    prompt_tokens = max(1, len(prompt) // 4)
+    completion_tokens = max(1, len(completion) // 4)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": name, "object": "model"} for name in
+                                       ("gpt-4o-mini", "text-embedding-3-small", "whisper-1")]}
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    error = _injected_error("embeddings")
+    await _delay(config.embedding_latency_ms)
+    if error:
+        return error
+
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    dimensions = body.get("dimensions") or EMBEDDING_DIMENSIONS
+    return {
+        "object": "list",
+        "model": body["model"],
+        "data": [{"object": "embedding", "index": i, "embedding": _fake_vector(str(text), dimensions)}
+                 for i, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": 5 * len(inputs), "total_tokens": 5 * len(inputs)},
+    }
+
+def _chat_message(body: dict) -> dict:
+    messages = body["messages"]
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        return {"role": "assistant", "content": json.dumps(_fill_schema(response_format["json_schema"]["schema"]))}
+
+    tools = body.get("tools")
+    if tools and not any(message["role"] == "tool" for message in messages):
+        # Lượt đầu của Agent / structured output qua function calling -> gọi tool; có kết quả tool rồi thì trả lời
+        tool_choice = body.get("tool_choice")
+        if isinstance(tool_choice, dict):
+            function = next(tool["function"] for tool in tools
+                            if tool["function"]["name"] == tool_choice["function"]["name"])
+            arguments = _fill_schema(function.get("parameters", {}))
+        else:
+            function = tools[0]["function"]
+            last = messages[-1]["content"]
+            arguments = {"query": last if isinstance(last, str) else "english grammar"}
+        return {"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_{_random.randrange(1 << 30)}",
+            "type": "function",
+            "function": {"name": function["name"], "arguments": json.dumps(arguments, ensure_ascii=False)},
+        }]}
+
+    return {"role": "assistant", "content": ANSWER}
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = _injected_error("chat")
+    message = _chat_message(body)
+    prompt = json.dumps(body["messages"], ensure_ascii=False)
+    completion = message["content"] or json.dumps(message.get("tool_calls"))
+    finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+
+    if not body.get("stream"):
+        await _delay(config.chat_latency_ms)
+        if error:
+            return error
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(prompt, completion),
+        }
+
+    # Stream: time-to-first-token = chat_latency_ms, sau đó mỗi token cách nhau token_interval_ms
+    await _delay(config.chat_latency_ms)
+    if error:
+        return error
+
+    def chunk(delta: dict, finish: Optional[str] = None, usage: Optional[dict] = None) -> str:
+        data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body["model"], "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+        if usage is not None:
+            data["usage"] = usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def events():
+        if message.get("tool_calls"):
+            yield chunk({"role": "assistant", "tool_calls": [{"index": 0, **message["tool_calls"][0]}]})
+        else:
+            for word in message["content"].split(" "):
+                yield chunk({"content": word + " "})
+                await asyncio.sleep(config.token_interval_ms / 1000)
+        yield chunk({}, finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            data = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": body["model"], "choices": [], "usage": _usage(prompt, completion)}
+            yield f"data: {json.dumps(data)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    await request.body()
+    error = _injected_error("transcriptions")
+    await _delay(config.transcription_latency_ms)
+    return error or {"text": TRANSCRIPT}
+
+@app.get("/audio/{name}")
+async def audio_file(name: str):
+    # File audio mẫu cho /score/speaking (service tải audio_url trước khi gửi Whisper)
+    request_counts["audio"] += 1
+    return Response(b"ID3" + bytes(32 * 1024), media_type="audio/mpeg")
+
+@app.get("/")
+async def tavily_root():
+    return {"status": "ok"}
+
+@app.post("/search")
+async def tavily_search(request: Request):
+    body = await request.json()
+    error = _injected_error("search")
+    await _delay(config.search_latency_ms)
+    if error:
+        return error
+    query = body.get("query", "")
+    return {
+        "query": query,
+        "results": [
+            {"title": f"Result {i + 1} for {query}", "url": f"https://example.com/{i + 1}",
+             "content": f"Giải thích về '{query}' từ nguồn web giả lập số {i + 1}.", "score": 0.9 - i * 0.1}
+            for i in range(int(body.get("max_results") or 3))
+        ],
+        "response_time": config.search_latency_ms / 1000,
+    }
+
+@app.get("/fake/stats")
+async def fake_stats():
+    """Số request upstream đã nhận -> load test dùng để biết cache tiết kiệm được bao nhiêu lần gọi API."""
+    return {"requests": dict(request_counts), "errors": dict(error_counts), "config": asdict(config)}
+
+@app.post("/fake/reset")
+async def fake_reset():
+    request_counts.clear()
+    error_counts.clear()
+    return {"ok": True}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI + Tavily upstream cho benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--latency-ms", type=float, default=None,
+                        help="Đặt cùng 1 latency cho mọi loại request (ghi đè FAKE_*_LATENCY_MS)")
+    parser.add_argument("--jitter", type=float, default=config.jitter)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--error-status", type=int, default=config.error_status)
+    parser.add_argument("--rate-limit-rate", type=float, default=config.rate_limit_rate)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.latency_ms is not None:
+        config.chat_latency_ms = config.embedding_latency_ms = args.latency_ms
+        config.transcription_latency_ms = config.search_latency_ms = args.latency_ms
+    config.jitter = args.jitter
+    config.error_rate = args.error_rate
+    config.error_status = args.error_status
+    config.rate_limit_rate = args.rate_limit_rate
+    config.seed = args.seed
+    if args.seed is not None:
+        _random.seed(args.seed)
+
+    import uvicorn
+    print(f"🎭 Fake upstream tại http://{args.host}:{args.port} - {asdict(config)}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# ai-service/benchmarks/load_test.py
+"""
+Load test cho AI service: bắn /chat, /chat/stream, /score/*, /moderate, /generate-title ở mức concurrency cố định,
+đo p50/p95/p99 + requests/s từng endpoint và ghi ra file JSON để so sánh giữa các lần chạy.
+
+Ví dụ:
+    python -m benchmarks.load_test --concurrency 20 --duration 60
+    python -m benchmarks.load_test --requests 500 --mix chat=5,moderate=3,score_writing=1 \
+        --compare benchmarks/results/baseline.json --max-regression 0.15
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import httpx
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+QUESTIONS = [
+    "Thì hiện tại hoàn thành dùng khi nào?",
+    "Phân biệt 'since' và 'for'",
+    "Khi nào dùng 'a' và 'an'?",
+    "Câu điều kiện loại 2 có cấu trúc thế nào?",
+    "Collocations với 'make' và 'do'",
+    "Phrasal verbs với 'get'",
+    "Câu bị động ở thì quá khứ đơn",
+    "Từ đồng nghĩa với 'important'",
+]
+WRITING_ANSWER = (
+    "In my opinion, technology has changed the way people learn languages. Students can practise every day "
+    "with mobile apps and watch videos from native speakers. However, they still need a teacher to correct mistakes."
+)
+MODERATION_TEXTS = [
+    "Mọi người cho mình hỏi cách học từ vựng hiệu quả với ạ?",
+    "Bài viết này hay quá, cảm ơn bạn đã chia sẻ kinh nghiệm luyện IELTS!",
+    "I disagree with this explanation, the example in the second paragraph is wrong.",
+    "Có ai muốn lập nhóm luyện speaking buổi tối không?",
+]
+
+@dataclass
+class Sample:
+    scenario: str
+    seconds: float
+    status: int
+    ok: bool
+    first_byte_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    build: Callable[[int], dict]  # số thứ tự request -> body
+    stream: bool = False
+
+@dataclass
+class RunContext:
+    audio_url: str
+    repeat_ratio: float
+    rng: random.Random = field(default_factory=random.Random)
+
+    def question(self, n: int) -> str:
+        # repeat_ratio: tỉ lệ request hỏi lại đúng câu có sẵn (đo đường cache hit), còn lại thêm hậu tố để né cache
+        base = QUESTIONS[n % len(QUESTIONS)]
+        if self.rng.random() < self.repeat_ratio:
+            return base
+        return f"{base} (#{n})"
+
+def build_scenarios(ctx: RunContext) -> Dict[str, Scenario]:
+    return {scenario.name: scenario for scenario in [
+        Scenario("chat", "POST", "/chat", lambda n: {
+            "question": ctx.question(n), "type": "auto", "session_id": f"bench-{n % 50}",
+        }),
+        Scenario("chat_stream", "POST", "/chat/stream", lambda n: {
+            "question": ctx.question(n), "type": "auto", "session_id": f"bench-{n % 50}",
+        }, stream=True),
+        Scenario("generate_title", "POST", "/generate-title", lambda n: {"question": ctx.question(n)}),
+        Scenario("moderate", "POST", "/moderate", lambda n: {
+            "text": MODERATION_TEXTS[n % len(MODERATION_TEXTS)]
+            + ("" if ctx.rng.random() < ctx.repeat_ratio else f" ({n})"),
+        }),
+        Scenario("score_writing", "POST", "/score/writing", lambda n: {
+            "question": "Some people think technology makes learning easier. Discuss.",
+            "answer": f"{WRITING_ANSWER} ({n})",
+        }),
+        Scenario("score_speaking", "POST", "/score/speaking", lambda n: {
+            "question": "Describe your hometown.", "audio_url": ctx.audio_url,
+        }),
+        Scenario("score_section", "POST", "/score/section", lambda n: {"items": [
+            {"id": "w1", "type": "writing", "question": "Describe a book you like.", "answer": f"{WRITING_ANSWER} ({n})"},
+            {"id": "w2", "type": "writing", "question": "Do you like travelling?", "answer": f"{WRITING_ANSWER} [{n}]"},
+            {"id": "s1", "type": "speaking", "question": "Describe your hometown.", "audio_url": ctx.audio_url},
+        ]}),
+    ]}
+
+DEFAULT_MIX = "chat=4,chat_stream=2,generate_title=1,moderate=3,score_writing=1,score_speaking=1,score_section=1"
+
+def parse_mix(mix: str, scenarios: Dict[str, Scenario]) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in scenarios:
+            raise SystemExit(f"Unknown scenario '{name}'. Available: {', '.join(scenarios)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+async def send(client: httpx.AsyncClient, scenario: Scenario, n: int) -> Sample:
+    body = scenario.build(n)
+    started = time.perf_counter()
+    first_byte = None
+    try:
+        if scenario.stream:
+            async with client.stream(scenario.method, scenario.path, json=body) as response:
+                async for chunk in response.aiter_bytes():
+                    # Tính time-to-first-token từ sự kiện token đầu tiên, không phải header
+                    if first_byte is None and b"event: token" in chunk:
+                        first_byte = time.perf_counter() - started
+                status = response.status_code
+        else:
+            response = await client.request(scenario.method, scenario.path, json=body)
+            status = response.status_code
+    except httpx.HTTPError as e:
+        return Sample(scenario.name, time.perf_counter() - started, 0, False, error=type(e).__name__)
+
+    return Sample(scenario.name, time.perf_counter() - started, status, 200 <= status < 300, first_byte)
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentile có nội suy tuyến tính (giống numpy.percentile mặc định)."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def latency_summary(seconds: List[float]) -> dict:
+    values = sorted(seconds)
+    if not values:
+        return {}
+    return {
+        "mean": round(sum(values) / len(values) * 1000, 2),
+        "p50": round(percentile(values, 0.50) * 1000, 2),
+        "p95": round(percentile(values, 0.95) * 1000, 2),
+        "p99": round(percentile(values, 0.99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+def summarize(samples: List[Sample], elapsed: float) -> dict:
+    scenarios = {}
+    for name in sorted({sample.scenario for sample in samples}):
+        group = [sample for sample in samples if sample.scenario == name]
+        ok = [sample for sample in group if sample.ok]
+        statuses: Dict[str, int] = {}
+        for sample in group:
+            if not sample.ok:
+                key = sample.error or str(sample.status)
+                statuses[key] = statuses.get(key, 0) + 1
+        scenarios[name] = {
+            "requests": len(group),
+            "errors": len(group) - len(ok),
+            "error_rate": round((len(group) - len(ok)) / len(group), 4),
+            "error_statuses": statuses,
+            "rps": round(len(ok) / elapsed, 2),
+            "latency_ms": latency_summary([sample.seconds for sample in ok]),
+        }
+        first_bytes = [sample.first_byte_seconds for sample in ok if sample.first_byte_seconds is not None]
+        if first_bytes:
+            scenarios[name]["first_token_ms"] = latency_summary(first_bytes)
+
+    ok = [sample for sample in samples if sample.ok]
+    return {
+        "overall": {
+            "requests": len(samples),
+            "errors": len(samples) - len(ok),
+            "error_rate": round((len(samples) - len(ok)) / max(1, len(samples)), 4),
+            "elapsed_seconds": round(elapsed, 2),
+            "rps": round(len(ok) / elapsed, 2),
+            "latency_ms": latency_summary([sample.seconds for sample in ok]),
+        },
+        "scenarios": scenarios,
+    }
+
+async def run_load(client: httpx.AsyncClient, scenarios: Dict[str, Scenario], weights: Dict[str, float],
+                   concurrency: int, total: Optional[int], duration: Optional[float], rng: random.Random,
+                   start: int = 0) -> List[Sample]:
+    """Closed-loop: `concurrency` worker, mỗi worker gửi request tiếp theo ngay khi request trước xong."""
+    samples: List[Sample] = []
+    counter = itertools.count(start)
+    names = list(weights)
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            n = next(counter)
+            if total is not None and n >= start + total:
+                return
+            name = rng.choices(names, weights=[weights[name] for name in names])[0]
+            samples.append(await send(client, scenarios[name], n))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+async def fetch_json(client: httpx.AsyncClient, url: str) -> Optional[dict]:
+    try:
+        response = await client.get(url)
+        return response.json() if response.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(current: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """In bảng so sánh p50/p95/p99/rps với lần chạy trước; trả False nếu p95 chậm hơn quá max_regression."""
+    passed = True
+    print(f"\n📊 So với {baseline['meta'].get('git_commit') or '?'} ({baseline['meta'].get('started_at')})")
+    print(f"{'scenario':<16}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>10}")
+    rows = [("overall", current["overall"], baseline["overall"])] + [
+        (name, stats, baseline["scenarios"][name])
+        for name, stats in current["scenarios"].items() if name in baseline["scenarios"]
+    ]
+    for name, now, before in rows:
+        for metric in ("p50", "p95", "p99", "rps"):
+            old = before["rps"] if metric == "rps" else before["latency_ms"].get(metric)
+            new = now["rps"] if metric == "rps" else now["latency_ms"].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = metric == "p95" and max_regression is not None and change > max_regression
+            passed = passed and not regressed
+            print(f"{name:<16}{metric:<8}{old:>12.1f}{new:>12.1f}{change:>+9.1%}{' ❌' if regressed else ''}")
+    return passed
+
+async def main_async(args) -> int:
+    rng = random.Random(args.seed)
+    ctx = RunContext(audio_url=args.audio_url, repeat_ratio=args.repeat_ratio, rng=rng)
+    scenarios = build_scenarios(ctx)
+    weights = parse_mix(args.mix, scenarios)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        health = await fetch_json(client, "/readyz")
+        if health is None or not health.get("ready"):
+            print(f"⚠️  {args.base_url}/readyz chưa ready: {health}")
+
+        if args.warmup:
+            print(f"🔥 Warm-up {args.warmup} request (không tính vào kết quả)...")
+            await run_load(client, scenarios, weights, args.concurrency, args.warmup, None, rng)
+
+        upstream_before = await fetch_json(client, f"{args.upstream_url}/fake/stats") if args.upstream_url else None
+        print(f"🚀 Chạy {args.requests or f'{args.duration}s'} với concurrency={args.concurrency}, mix={weights}")
+        started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        started = time.perf_counter()
+        # start=warmup: số thứ tự (và câu hỏi) không trùng với lúc warm-up -> không ăn cache của warm-up
+        samples = await run_load(client, scenarios, weights, args.concurrency, args.requests,
+                                 None if args.requests else args.duration, rng, start=args.warmup)
+        elapsed = time.perf_counter() - started
+        upstream_after = await fetch_json(client, f"{args.upstream_url}/fake/stats") if args.upstream_url else None
+
+    report = {
+        "meta": {
+            "started_at": started_at,
+            "git_commit": git_commit(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "duration": None if args.requests else args.duration,
+            "warmup": args.warmup,
+            "repeat_ratio": args.repeat_ratio,
+            "mix": weights,
+            "seed": args.seed,
+            "label": args.label,
+        },
+        **summarize(samples, elapsed),
+    }
+    if upstream_before and upstream_after:
+        # Số lần gọi OpenAI/Tavily (giả) trong lúc đo -> cache / batching tiết kiệm bao nhiêu;
+        # lỗi upstream được inject mà service vẫn trả 200 = retry đã che được
+        for key in ("requests", "errors"):
+            before = upstream_before[key]
+            report[f"upstream_{key}"] = {name: count - before.get(name, 0)
+                                         for name, count in upstream_after[key].items()
+                                         if count - before.get(name, 0)}
+        report["upstream_config"] = upstream_after.get("config")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}{'-' + args.label if args.label else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    overall = report["overall"]
+    print(f"\n{'scenario':<16}{'req':>6}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for name, stats in [("overall", overall), *report["scenarios"].items()]:
+        latency = stats["latency_ms"]
+        print(f"{name:<16}{stats['requests']:>6}{stats['errors']:>6}{stats['rps']:>8.1f}"
+              f"{latency.get('p50', 0):>9.0f}{latency.get('p95', 0):>9.0f}{latency.get('p99', 0):>9.0f}")
+    if "upstream_requests" in report:
+        print(f"🔁 Upstream: {report['upstream_requests']}, lỗi inject: {report['upstream_errors']}")
+    print(f"💾 Kết quả: {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.max_regression):
+            print(f"❌ p95 chậm hơn baseline quá {args.max_regression:.0%}")
+            return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test cho Lingora AI service")
+    parser.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--upstream-url", default=os.getenv("BENCH_UPSTREAM_URL", "http://127.0.0.1:9999"),
+                        help="Fake upstream (benchmarks.fake_upstream) để đếm số lần gọi OpenAI/Tavily; '' để tắt")
+    parser.add_argument("--audio-url", default=None, help="audio_url cho /score/speaking (mặc định: file mẫu của fake upstream)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=None, help="Tổng số request (mặc định chạy theo --duration)")
+    parser.add_argument("--duration", type=float, default=30, help="Số giây chạy nếu không đặt --requests")
+    parser.add_argument("--warmup", type=int, default=10, help="Số request chạy trước, không tính vào kết quả")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Tỉ trọng scenario, vd: chat=4,moderate=3")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0,
+                        help="Tỉ lệ request lặp lại câu hỏi có sẵn (đo đường cache hit)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default=None, help="Gắn nhãn cho lần chạy (vd: baseline, mmap-index)")
+    parser.add_argument("--output", default=None, help="File JSON kết quả (mặc định benchmarks/results/<thời gian>.json)")
+    parser.add_argument("--compare", default=None, help="File JSON của lần chạy trước để so sánh")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit 1 nếu p95 chậm hơn baseline quá tỉ lệ này (vd 0.15)")
+    args = parser.parse_args()
+    args.audio_url = args.audio_url or f"{args.upstream_url or 'http://127.0.0.1:9999'}/audio/sample.mp3"
+    raise SystemExit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
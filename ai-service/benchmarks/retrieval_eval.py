@@ -0,0 +1,302 @@
+# ai-service/benchmarks/retrieval_eval.py
+"""
+Đánh giá retrieval (chất lượng vs latency) trên bộ câu hỏi có nhãn cho 2 sách Ngữ pháp / Từ vựng.
+Quét các cấu hình chunk_size x chunk_overlap x k x mode, mỗi cấu hình build index riêng trong RAM
+(Chroma in-memory + BM25), không đụng vào chroma_db_store đang chạy.
+
+Ví dụ:
+    python -m benchmarks.retrieval_eval --chunk-sizes 500,800,1000 --overlaps 0,100,200 --k 2,3,4,6
+
+Mỗi cấu hình báo: recall@k, MRR, số token context (trước / sau bước dựng context của src/context.py),
+latency retrieval (p50/p95).
+Embedding của chunk được cache trên đĩa (state/retrieval_eval/embeddings.sqlite3) theo nội dung,
+nên chạy lại / thêm cấu hình chỉ embed các chunk chưa gặp.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+import chromadb
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from src.clients import get_embeddings
+from src.config.env import settings
+from src.embedding_cache import DiskEmbeddingStore, normalize_text
+from src.context import ContextAssembler
+from src.embedding_pipeline import EmbeddingItem, EmbeddingPipeline
+from src.ingest import make_text_splitter
+from src.lexical_index import BM25Index, fuse_rrf, is_confident
+from src.pdf_extract import aiter_pdf_pages
+from src.retrieval import search_collections
+from benchmarks.load_test import latency_summary
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "retrieval_questions.jsonl")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+CACHE_PATH = os.path.join(settings.STATE_DIR, "retrieval_eval", "embeddings.sqlite3")
+BOOKS = {"grammar": "english_grammar_in_use.pdf", "vocab": "english_vocabulary_in_use.pdf"}
+MODES = ("vector", "hybrid", "mmr", "lexical")
+
+# vector: Chroma similarity search (tra 1 sách khi không có BM25)
+# hybrid: giống _retrieve_collection_docs trong rag.py: BM25 chắc chắn -> dùng luôn, không thì RRF(vector, BM25)
+# mmr:    giống _search_books: lọc ngưỡng + MMR (src/retrieval.py)
+# lexical: chỉ BM25, không cần embedding
+
+@dataclass
+class Question:
+    id: str
+    book: str
+    question: str
+    phrases: List[str] = field(default_factory=list)
+    pages: List[str] = field(default_factory=list)  # page_label của trang chứa câu trả lời (nếu đã gán nhãn)
+
+    def matches(self, doc: Document) -> List[str]:
+        """Các nhãn (cụm từ / trang) mà chunk này chứa -> chunk liên quan nếu khác rỗng."""
+        text = normalize_text(doc.page_content)
+        found = [f"phrase:{phrase}" for phrase in self.phrases if normalize_text(phrase) in text]
+        page = str(doc.metadata.get("page_label", doc.metadata.get("page")))
+        found.extend(f"page:{label}" for label in self.pages if label == page)
+        return found
+
+    @property
+    def labels(self) -> int:
+        return len(self.phrases) + len(self.pages)
+
+def load_questions(path: str, books: Sequence[str]) -> List[Question]:
+    with open(path, encoding="utf-8") as f:
+        questions = [Question(**json.loads(line)) for line in f if line.strip()]
+    return [question for question in questions if question.book in books and question.labels]
+
+async def load_pages(file_name: str) -> List[Document]:
+    file_path = os.path.join(settings.DATA_PATH, file_name)
+    if not os.path.exists(file_path):
+        raise SystemExit(f"❌ Không tìm thấy {file_path} (chạy python -m scripts.download_data trước)")
+    return [page async for page in aiter_pdf_pages(file_path, settings.PDF_EXTRACT_WORKERS, settings.PDF_EXTRACT_PAGES_PER_TASK)]
+
+def _text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+async def embed_texts(texts: List[str], pipeline: EmbeddingPipeline) -> Dict[str, np.ndarray]:
+    """Embed theo nội dung qua EmbeddingPipeline (batch + retry + checkpoint đĩa dùng lại giữa các lần chạy)."""
+    vectors: Dict[str, np.ndarray] = {}
+    unique = {_text_key(text): text for text in texts}
+
+    async def items():
+        for key, text in unique.items():
+            yield EmbeddingItem(key=key, text=text)
+
+    def collect(batch, batch_vectors):
+        for item, vector in zip(batch, batch_vectors):
+            vectors[item.key] = np.asarray(vector, dtype=np.float32)
+
+    await pipeline.run(items(), on_batch=collect)
+    return vectors
+
+@dataclass
+class BookIndex:
+    store: Chroma
+    lexical: BM25Index
+    chunks: int
+    assembler: ContextAssembler
+
+def build_index(client, name: str, chunks: List[Document], vectors: Dict[str, np.ndarray]) -> BookIndex:
+    store = Chroma(client=client, collection_name=name)
+    batch = 1000
+    for start in range(0, len(chunks), batch):
+        part = chunks[start:start + batch]
+        store._collection.upsert(
+            ids=[f"{name}-{start + i}" for i in range(len(part))],
+            embeddings=[vectors[_text_key(chunk.page_content)].tolist() for chunk in part],
+            documents=[chunk.page_content for chunk in part],
+            metadatas=[chunk.metadata or None for chunk in part],
+        )
+    assembler = ContextAssembler(
+        max_tokens=settings.CONTEXT_MAX_TOKENS,
+        min_overlap_chars=settings.CONTEXT_MIN_OVERLAP_CHARS,
+        boilerplate_min_pages=settings.CONTEXT_BOILERPLATE_MIN_PAGES,
+    )
+    assembler.learn_boilerplate((chunk.page_content, chunk.metadata) for chunk in chunks)
+    return BookIndex(store=store, lexical=BM25Index.build(chunks), chunks=len(chunks), assembler=assembler)
+
+async def retrieve(mode: str, index: BookIndex, book: str, question: str, query_vector: List[float], k: int) -> List[Document]:
+    if mode == "lexical":
+        return [doc for doc, _ in index.lexical.search(question, k)]
+    if mode == "vector":
+        return await index.store.asimilarity_search_by_vector(query_vector, k=k)
+    if mode == "mmr":
+        return await search_collections(
+            {book: index.store},
+            query_vector,
+            k=k,
+            fetch_k=max(settings.MULTI_RETRIEVAL_FETCH_K, 2 * k),
+            score_threshold=settings.MULTI_RETRIEVAL_SCORE_THRESHOLD,
+            lambda_mult=settings.MULTI_RETRIEVAL_MMR_LAMBDA,
+        )
+    # hybrid
+    lexical_hits = index.lexical.search(question, k)
+    lexical_docs = [doc for doc, _ in lexical_hits]
+    if is_confident(index.lexical, question, lexical_hits):
+        return lexical_docs
+    docs = await index.store.asimilarity_search_by_vector(query_vector, k=k)
+    return fuse_rrf([docs, lexical_docs], k) if lexical_docs else docs
+
+def score_question(question: Question, docs: List[Document]) -> Tuple[float, float]:
+    """(recall@k = tỉ lệ nhãn xuất hiện trong top-k, reciprocal rank của chunk liên quan đầu tiên)."""
+    covered = set()
+    reciprocal_rank = 0.0
+    for rank, doc in enumerate(docs, start=1):
+        found = question.matches(doc)
+        if found and not reciprocal_rank:
+            reciprocal_rank = 1.0 / rank
+        covered.update(found)
+    return len(covered) / question.labels, reciprocal_rank
+
+async def evaluate(index_by_book: Dict[str, BookIndex], questions: List[Question], query_vectors: Dict[str, np.ndarray],
+                   mode: str, k: int, repeats: int) -> dict:
+    recalls, reciprocal_ranks, tokens, assembled_tokens, latencies = [], [], [], [], []
+    for question in questions:
+        index = index_by_book[question.book]
+        vector = query_vectors[_text_key(question.question)].tolist()
+        docs: List[Document] = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            docs = await retrieve(mode, index, question.book, question.question, vector, k)
+            latencies.append(time.perf_counter() - started)
+        recall, reciprocal_rank = score_question(question, docs)
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+        assembled = index.assembler.assemble(docs)
+        tokens.append(assembled.raw_tokens)
+        assembled_tokens.append(assembled.tokens)
+
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "hit_rate": round(float(np.mean([rr > 0 for rr in reciprocal_ranks])), 4),
+        "context_tokens": {"mean": round(float(np.mean(tokens)), 1), "max": int(max(tokens))},
+        # Sau khi gộp overlap / bỏ header-footer / cắt theo CONTEXT_MAX_TOKENS (đúng số token gửi lên LLM)
+        "assembled_tokens": {"mean": round(float(np.mean(assembled_tokens)), 1), "max": int(max(assembled_tokens))},
+        # Không tính thời gian embed câu hỏi (giống nhau ở mọi cấu hình, trừ lexical không cần embed)
+        "latency_ms": latency_summary(latencies),
+    }
+
+def mark_pareto(rows: List[dict]):
+    """Cấu hình không bị cấu hình nào khác 'ăn' ở cả recall, MRR, token và p95 -> đáng cân nhắc."""
+    def key(row):
+        return (row["recall_at_k"], row["mrr"], -row["assembled_tokens"]["mean"], -row["latency_ms"].get("p95", 0))
+
+    for row in rows:
+        mine = key(row)
+        row["pareto"] = not any(
+            all(a >= b for a, b in zip(key(other), mine)) and key(other) != mine for other in rows
+        )
+
+def parse_ints(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part.strip()]
+
+async def main_async(args) -> int:
+    books = [book.strip() for book in args.books.split(",")]
+    modes = [mode.strip() for mode in args.modes.split(",")]
+    unknown = [mode for mode in modes if mode not in MODES]
+    if unknown:
+        raise SystemExit(f"Unknown mode(s) {unknown}. Available: {', '.join(MODES)}")
+
+    questions = load_questions(args.questions, books)
+    print(f"🧪 {len(questions)} câu hỏi có nhãn ({', '.join(books)})")
+
+    embeddings = get_embeddings(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS)
+    cache = DiskEmbeddingStore(args.cache)
+    pipeline = EmbeddingPipeline(
+        embeddings,
+        model_name=settings.EMBEDDING_MODEL_ID,
+        checkpoint=cache,
+        batch_size=settings.INGEST_EMBED_BATCH_SIZE,
+        max_concurrency=settings.INGEST_EMBED_MAX_CONCURRENCY,
+        max_retries=settings.INGEST_EMBED_MAX_RETRIES,
+    )
+    query_vectors = await embed_texts([question.question for question in questions], pipeline)
+    pages = {book: await load_pages(BOOKS[book]) for book in books}
+
+    client = chromadb.EphemeralClient()
+    rows = []
+    for chunk_size in parse_ints(args.chunk_sizes):
+        for chunk_overlap in parse_ints(args.overlaps):
+            if chunk_overlap >= chunk_size:
+                continue
+            splitter = make_text_splitter(chunk_size, chunk_overlap)
+            chunks = {book: splitter.split_documents(pages[book]) for book in books}
+            print(f"\n✂️  chunk_size={chunk_size} overlap={chunk_overlap}: "
+                  + ", ".join(f"{book} {len(docs)} chunks" for book, docs in chunks.items()))
+
+            started = time.perf_counter()
+            vectors = await embed_texts([doc.page_content for docs in chunks.values() for doc in docs], pipeline)
+            index_by_book = {
+                book: build_index(client, f"eval-{book}-{chunk_size}-{chunk_overlap}", docs, vectors)
+                for book, docs in chunks.items()
+            }
+            build_seconds = time.perf_counter() - started
+
+            for k in parse_ints(args.k):
+                for mode in modes:
+                    result = await evaluate(index_by_book, questions, query_vectors, mode, k, args.repeats)
+                    rows.append({"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "k": k, "mode": mode,
+                                 "chunks": {book: index.chunks for book, index in index_by_book.items()},
+                                 "build_seconds": round(build_seconds, 2), **result})
+                    print(f"   k={k:<2} {mode:<8} recall@k={result['recall_at_k']:.3f} mrr={result['mrr']:.3f} "
+                          f"tokens={result['context_tokens']['mean']:.0f}->{result['assembled_tokens']['mean']:.0f} p50={result['latency_ms']['p50']:.1f}ms")
+
+            for book in index_by_book:
+                client.delete_collection(f"eval-{book}-{chunk_size}-{chunk_overlap}")
+    cache.close()
+
+    mark_pareto(rows)
+    current = {"chunk_size": settings.CHUNK_SIZE, "chunk_overlap": settings.CHUNK_OVERLAP, "k": settings.RETRIEVAL_K}
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "embedding_model": settings.EMBEDDING_MODEL_ID,
+            "questions": len(questions),
+            "books": books,
+            "repeats": args.repeats,
+            "current_settings": current,
+        },
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'size':>6}{'ovl':>6}{'k':>4}  {'mode':<8}{'recall':>8}{'mrr':>7}{'tokens':>8}{'sent':>8}{'p50':>8}{'p95':>8}")
+    for row in sorted(rows, key=lambda row: (-row["recall_at_k"], row["context_tokens"]["mean"])):
+        is_current = all(row[key] == value for key, value in current.items())
+        print(f"{row['chunk_size']:>6}{row['chunk_overlap']:>6}{row['k']:>4}  {row['mode']:<8}"
+              f"{row['recall_at_k']:>8.3f}{row['mrr']:>7.3f}{row['context_tokens']['mean']:>8.0f}"
+              f"{row['assembled_tokens']['mean']:>8.0f}"
+              f"{row['latency_ms']['p50']:>8.1f}{row['latency_ms']['p95']:>8.1f}"
+              f"{'  ⭐' if row['pareto'] else ''}{'  (hiện tại)' if is_current else ''}")
+    print("⭐ = Pareto (không cấu hình nào tốt hơn ở cả recall, MRR, token lẫn p95)")
+    print(f"💾 Kết quả: {output}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Quét chunk_size / overlap / k / mode cho retrieval")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="File .jsonl: id, book, question, phrases[], pages[]")
+    parser.add_argument("--books", default="grammar,vocab")
+    parser.add_argument("--chunk-sizes", default=f"500,800,{settings.CHUNK_SIZE}")
+    parser.add_argument("--overlaps", default=f"0,100,{settings.CHUNK_OVERLAP}")
+    parser.add_argument("--k", default=f"2,3,{settings.RETRIEVAL_K},6")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--repeats", type=int, default=3, help="Số lần chạy mỗi câu hỏi để đo latency ổn định hơn")
+    parser.add_argument("--cache", default=CACHE_PATH, help="SQLite cache embedding của chunk/câu hỏi")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
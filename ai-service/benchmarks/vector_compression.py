@@ -0,0 +1,239 @@
+# ai-service/benchmarks/vector_compression.py
+"""
+So sánh cách lưu vector nhỏ gọn với store hiện tại (float32, đủ số chiều như trong chroma_db_store):
+số chiều (EMBEDDING_DIMENSIONS) x dtype bản nén (VECTOR_INDEX_DTYPE) x số ứng viên rescore (VECTOR_RESCORE_FACTOR).
+
+Ví dụ:
+    python -m benchmarks.vector_compression --dims full,1024,512,256 --dtypes float32,float16,int8 --rescore 1,4
+
+Mỗi cấu hình được ghi thành index mmap thật (src/vector_index.py) trong thư mục tạm rồi search qua đúng
+code lúc serve, báo:
+- memory: số byte vector mọi query đều quét (phần cần nằm trong RAM) và tổng dung lượng trên đĩa;
+- image: với VECTOR_BACKEND=mmap, image production chỉ chứa index mmap (không chứa ChromaDB),
+  nên báo disk của index so với ChromaDB (tỉ lệ image nhỏ đi);
+- recall@k so với top-k của store hiện tại (cùng query, search chính xác float32 đủ số chiều);
+- label recall@k trên bộ câu hỏi có nhãn (benchmarks/retrieval_questions.jsonl);
+- latency search (không tính embed câu hỏi).
+
+Số chiều nhỏ hơn được mô phỏng bằng cách giữ d chiều đầu rồi chuẩn hoá lại: với text-embedding-3-*,
+kết quả này tương đương gọi API với `dimensions=d`, nên không cần embed lại cả sách để đo.
+Muốn dùng thật thì đặt EMBEDDING_DIMENSIONS rồi chạy lại `python -m src.ingest`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from src.clients import get_embeddings
+from src.config.env import settings
+from src.embedding_cache import DiskEmbeddingStore
+from src.embedding_pipeline import EmbeddingPipeline
+from src.vector_index import COMPACT_DTYPES, MmapVectorIndex, normalize, read_collection, write_index
+from benchmarks.load_test import latency_summary
+from benchmarks.retrieval_eval import CACHE_PATH, QUESTIONS_PATH, RESULTS_DIR, _text_key, embed_texts, load_questions, score_question
+
+COLLECTIONS = {"grammar": "grammar_collection", "vocab": "vocab_collection"}
+
+def truncate(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    """Giữ `dimensions` chiều đầu rồi chuẩn hoá lại (giống tham số `dimensions` của text-embedding-3-*)."""
+    return normalize(np.asarray(matrix)[..., :dimensions])
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> List[int]:
+    scores = matrix @ query
+    return [int(i) for i in np.argsort(-scores, kind="stable")[:k]]
+
+def parse_dims(value: str, full: int) -> List[int]:
+    dims = []
+    for part in value.split(","):
+        part = part.strip()
+        if part:
+            dims.append(full if part == "full" else min(int(part), full))
+    return sorted(set(dims), reverse=True)
+
+def parse_factors(value: str) -> List[int]:
+    return [max(1, int(part)) for part in value.split(",") if part.strip()]
+
+def store_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def chroma_store_bytes() -> int:
+    """Dung lượng riêng của ChromaDB (không tính index mmap / BM25 / manifest nằm cùng thư mục)."""
+    if not os.path.exists(settings.CHROMA_DB_DIR):
+        return 0
+    ours = {os.path.abspath(path) for path in (settings.VECTOR_INDEX_DIR, settings.LEXICAL_INDEX_DIR, settings.INGEST_MANIFEST_DIR)}
+    return sum(
+        store_bytes(path) if os.path.isdir(path) else os.path.getsize(path)
+        for path in (os.path.join(settings.CHROMA_DB_DIR, name) for name in os.listdir(settings.CHROMA_DB_DIR))
+        if os.path.abspath(path) not in ours
+    )
+
+async def main_async(args) -> int:
+    books = [book.strip() for book in args.books.split(",")]
+    dtypes = [dtype.strip() for dtype in args.dtypes.split(",")]
+    unknown = [dtype for dtype in dtypes if dtype not in COMPACT_DTYPES]
+    if unknown:
+        raise SystemExit(f"Unknown dtype(s) {unknown}. Available: {', '.join(COMPACT_DTYPES)}")
+    workdir = tempfile.mkdtemp(prefix="vector-compression-")
+    try:
+        return await run(args, books, dtypes, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+async def run(args, books: List[str], dtypes: List[str], workdir: str) -> int:
+    # Store hiện tại = vector float32 gốc trong ChromaDB
+    baselines: Dict[str, MmapVectorIndex] = {}
+    for book in books:
+        ids, texts, metadatas, matrix = read_collection(COLLECTIONS[book])
+        if not ids:
+            raise SystemExit(f"❌ Collection {COLLECTIONS[book]} trống (chạy python -m src.ingest trước)")
+        path = os.path.join(workdir, f"{book}-baseline")
+        write_index(path, book, ids, texts, metadatas, matrix, settings.EMBEDDING_MODEL_ID, "float32")
+        baselines[book] = MmapVectorIndex(book, path)
+    full = min(index.dimensions for index in baselines.values())
+
+    # Query: câu hỏi có nhãn (embed qua cache đĩa, chỉ lần đầu tốn tiền) + vector của vài chunk ngẫu nhiên có nhiễu
+    questions = load_questions(args.questions, books)
+    embeddings = get_embeddings(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS)
+    cache = DiskEmbeddingStore(args.cache)
+    pipeline = EmbeddingPipeline(
+        embeddings,
+        model_name=settings.EMBEDDING_MODEL_ID,
+        checkpoint=cache,
+        batch_size=settings.INGEST_EMBED_BATCH_SIZE,
+        max_concurrency=settings.INGEST_EMBED_MAX_CONCURRENCY,
+        max_retries=settings.INGEST_EMBED_MAX_RETRIES,
+    )
+    question_vectors = await embed_texts([question.question for question in questions], pipeline)
+    cache.close()
+
+    rng = np.random.default_rng(args.seed)
+    queries: Dict[str, List[tuple]] = {book: [] for book in books}  # book -> [(vector đủ chiều, Question | None)]
+    for question in questions:
+        vector = question_vectors[_text_key(question.question)]
+        if len(vector) != baselines[question.book].dimensions:
+            raise SystemExit(f"❌ Câu hỏi embed ra {len(vector)} chiều, index có {baselines[question.book].dimensions} "
+                             f"chiều (EMBEDDING_DIMENSIONS khác lúc ingest?)")
+        queries[question.book].append((normalize(vector), question))
+    for book, index in baselines.items():
+        for i in rng.choice(index.count, size=min(args.chunk_queries, index.count), replace=False):
+            vector = np.asarray(index.vectors[i]) + rng.normal(0, args.noise, index.dimensions).astype(np.float32)
+            queries[book].append((normalize(vector), None))
+    total_queries = sum(len(items) for items in queries.values())
+    print(f"🧪 {len(questions)} câu hỏi có nhãn + {total_queries - len(questions)} query từ chunk ({', '.join(books)}), "
+          f"store hiện tại: {full} chiều, {', '.join(f'{book} {index.count} chunks' for book, index in baselines.items())}")
+
+    truth = {
+        book: [exact_top_k(np.asarray(baselines[book].vectors), vector, args.k) for vector, _ in queries[book]]
+        for book in books
+    }
+    baseline_scan = sum(index.count * index.dimensions * 4 for index in baselines.values())
+    chroma_bytes = chroma_store_bytes()
+
+    rows = []
+    for dims in parse_dims(args.dims, full):
+        for dtype in dtypes:
+            indexes: Dict[str, MmapVectorIndex] = {}
+            for book, baseline in baselines.items():
+                path = os.path.join(workdir, f"{book}-{dims}-{dtype}")
+                matrix = truncate(baseline.vectors, dims)
+                texts = [baseline.text(i) for i in range(baseline.count)]
+                write_index(path, baseline.name, baseline.ids, texts, baseline.metadatas, matrix, baseline.embedding_model, dtype)
+                indexes[book] = MmapVectorIndex(book, path)
+
+            for factor in (parse_factors(args.rescore) if dtype != "float32" else [1]):
+                row = evaluate(indexes, queries, truth, dims, args.k, factor, args.repeats)
+                scan = sum(index.scan_nbytes for index in indexes.values())
+                disk = sum(index.nbytes for index in indexes.values())
+                row.update({
+                    "dimensions": dims,
+                    "dtype": dtype,
+                    "rescore_factor": factor if dtype != "float32" else None,
+                    "scan_bytes": scan,
+                    "disk_bytes": disk,
+                    "memory_saved": round(1 - scan / baseline_scan, 4),
+                    "image_saved": round(1 - disk / chroma_bytes, 4) if chroma_bytes else None,
+                })
+                rows.append(row)
+                print(f"   {dims:>5}d {dtype:<8} x{factor:<2} recall@{args.k}={row['recall_at_k']:.3f} "
+                      f"label={row['label_recall']:.3f} scan={scan / 1024:.0f}KB p50={row['latency_ms']['p50']:.2f}ms")
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "embedding_model": settings.EMBEDDING_MODEL_ID,
+            "books": books,
+            "k": args.k,
+            "questions": len(questions),
+            "chunk_queries": total_queries - len(questions),
+            "baseline": {"dimensions": full, "dtype": "float32", "scan_bytes": baseline_scan, "chroma_bytes": chroma_bytes},
+            "current_settings": {"dimensions": settings.EMBEDDING_DIMENSIONS or full, "dtype": settings.VECTOR_INDEX_DTYPE,
+                                 "rescore_factor": settings.VECTOR_RESCORE_FACTOR},
+        },
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"vectors-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"\nStore hiện tại: {full} chiều float32 = {baseline_scan / 1024 / 1024:.2f} MB vector"
+          + (f", ChromaDB trên đĩa {chroma_bytes / 1024 / 1024:.1f} MB" if chroma_bytes else ""))
+    print(f"{'dims':>6}  {'dtype':<8}{'rescore':>8}{'scan MB':>9}{'saved':>8}{'disk MB':>9}{'image':>8}"
+          f"{'recall':>8}{'label':>7}{'p50':>8}{'p95':>8}")
+    for row in sorted(rows, key=lambda row: (-row["recall_at_k"], row["scan_bytes"])):
+        factor = f"x{row['rescore_factor']}" if row["rescore_factor"] else "-"
+        image = f"{row['image_saved']:.0%}" if row["image_saved"] is not None else "-"
+        print(f"{row['dimensions']:>6}  {row['dtype']:<8}{factor:>8}{row['scan_bytes'] / 1024 / 1024:>9.2f}"
+              f"{row['memory_saved']:>8.1%}{row['disk_bytes'] / 1024 / 1024:>9.2f}{image:>8}{row['recall_at_k']:>8.3f}"
+              f"{row['label_recall']:>7.3f}{row['latency_ms']['p50']:>8.2f}{row['latency_ms']['p95']:>8.2f}")
+    print(f"recall = tỉ lệ top-{args.k} của store hiện tại còn giữ được; label = recall@{args.k} theo nhãn câu hỏi; "
+          "scan = byte vector mọi query đều quét; disk = cả index trên đĩa (gồm vector float32 để rescore chính xác); "
+          "image = phần image tiết kiệm được so với ship ChromaDB (image production chỉ chứa index mmap)")
+    print(f"💾 Kết quả: {output}")
+    return 0
+
+def evaluate(indexes: Dict[str, MmapVectorIndex], queries: Dict[str, List[tuple]], truth: Dict[str, List[List[int]]],
+             dims: int, k: int, factor: int, repeats: int) -> dict:
+    overlaps, label_recalls, latencies = [], [], []
+    for book, items in queries.items():
+        index = indexes[book]
+        for (vector, question), expected in zip(items, truth[book]):
+            query = truncate(vector, dims)
+            found: Optional[np.ndarray] = None
+            for _ in range(repeats):
+                started = time.perf_counter()
+                found, _ = index.search(query, k, rescore_factor=factor)
+                latencies.append(time.perf_counter() - started)
+            overlaps.append(len(set(expected) & {int(i) for i in found}) / len(expected))
+            if question is not None:
+                label_recalls.append(score_question(question, [index.document(int(i)) for i in found])[0])
+    return {
+        "recall_at_k": round(float(np.mean(overlaps)), 4),
+        "label_recall": round(float(np.mean(label_recalls)), 4) if label_recalls else 0.0,
+        "latency_ms": latency_summary(latencies),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh số chiều / dtype / rescore của vector index với store hiện tại")
+    parser.add_argument("--books", default="grammar,vocab")
+    parser.add_argument("--dims", default="full,1024,512,256", help="full = số chiều của store hiện tại")
+    parser.add_argument("--dtypes", default=",".join(COMPACT_DTYPES))
+    parser.add_argument("--rescore", default=f"1,{settings.VECTOR_RESCORE_FACTOR}", help="k * factor ứng viên được rescore (1 = không rescore)")
+    parser.add_argument("--k", type=int, default=settings.RETRIEVAL_K)
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--chunk-queries", type=int, default=200, help="Số query lấy từ vector chunk (cộng nhiễu) mỗi sách")
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cache", default=CACHE_PATH, help="SQLite cache embedding câu hỏi (dùng chung với retrieval_eval)")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main_async(args)))
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,18 @@ ls -laR "$CHROMA_DB_DIR" || echo "❌ Cannot list directory"
 if [ -d "$CHROMA_DB_DIR" ] && [ "$(ls -A $CHROMA_DB_DIR)" ]; then
     echo "✅ ChromaDB đã tồn tại (Baked in Image or Mounted Volume with Data)."
     echo "⏩ Skipping ingestion."
+
+    # Volume nạp bằng bản cũ (chưa có index mmap) -> export từ ChromaDB, không cần đọc lại PDF
+    if [ "${VECTOR_BACKEND:-mmap}" = "mmap" ] && [ ! -d "${VECTOR_INDEX_DIR:-$CHROMA_DB_DIR/vectors}" ]; then
+        echo "🗂️  Chưa có vector index mmap. Đang export từ ChromaDB..."
+        python3 -m src.vector_index || echo "⚠️  Export lỗi, service sẽ dùng ChromaDB."
+    fi
+
+    # Image build với VECTOR_BACKEND=mmap chỉ chứa index mmap, không có ChromaDB
+    if [ "${VECTOR_BACKEND:-mmap}" != "mmap" ] && [ ! -f "$CHROMA_DB_DIR/chroma.sqlite3" ]; then
+        echo "⚠️  VECTOR_BACKEND=$VECTOR_BACKEND nhưng không có ChromaDB trong $CHROMA_DB_DIR (image build với VECTOR_BACKEND=mmap?)."
+        echo "   Build lại với --build-arg VECTOR_BACKEND=chroma hoặc mount volume đã nạp."
+    fi
 else
     echo "⚠️  ChromaDB chưa có hoặc rỗng. Bắt đầu quy trình nạp dữ liệu (Ingestion Flow)..."
     
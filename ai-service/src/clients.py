@@ -0,0 +1,428 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from src.config.env import settings
+from src.metrics import counter_lines, metrics_callback, register_collector
+
+# Lỗi tạm thời của upstream -> retry (trong giới hạn retry budget)
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Chỉ lỗi lúc chưa gửi được request (chưa kết nối / chưa lấy được kết nối từ pool) mới gửi lại an toàn.
+# ReadTimeout, RemoteProtocolError... có thể xảy ra khi upstream đã nhận body: POST /chat/completions,
+# /audio/transcriptions không idempotent -> gửi lại là bị tính tiền 2 lần.
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_MULTIPART_MODEL = re.compile(rb'name="model"\r\n\r\n([^\r]+)\r\n')
+
+class CircuitOpenError(httpx.TransportError):
+    """Upstream đang lỗi liên tục -> trả lỗi ngay, không xếp hàng chờ timeout."""
+
+class RateLimiter:
+    """
+    Token bucket theo phút cho 1 model: số request (RPM) và số token ước lượng (TPM).
+    reserve() trả về số giây cần chờ; bucket được phép âm để các request sau xếp hàng công bằng.
+    Dùng lock thường (không phải asyncio) vì client sync và async dùng chung.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float = 0):
+        self.limits = [(limit, limit / 60.0) for limit in (requests_per_minute, tokens_per_minute)]
+        self.levels = [limit for limit, _ in self.limits]
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int = 0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self.updated_at = now - self.updated_at, now
+            delay = 0.0
+            for i, ((limit, rate), cost) in enumerate(zip(self.limits, (1, tokens))):
+                if limit <= 0:
+                    continue  # 0 = không giới hạn
+                level = min(limit, self.levels[i] + elapsed * rate) - min(cost, limit)
+                self.levels[i] = level
+                if level < 0:
+                    delay = max(delay, -level / rate)
+            return delay
+
+class RetryBudget:
+    """
+    Giới hạn tổng số retry của cả process: mỗi request thành công nạp `ratio` token, mỗi retry tiêu 1 token
+    (+ nạp nền `min_per_second`). Khi upstream sập, retry không nhân số request lên gấp nhiều lần.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+class CircuitBreaker:
+    """closed -> (lỗi liên tiếp >= ngưỡng) -> open -> (sau reset_seconds) -> half_open: cho 1 request thử."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                # open, hoặc half_open đang có 1 request thử -> các request khác bị chặn
+                raise CircuitOpenError(f"Circuit '{self.name}' is {self.state}")
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    print(f"🔌 Circuit '{self.name}' mở ({self.failures} lỗi liên tiếp)")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+def _parse_model_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """"gpt-4o-mini=500:200000,whisper-1=50" -> {"gpt-4o-mini": (500, 200000), "whisper-1": (50, 0)}"""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = entry.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (float(rpm or 0), float(tpm or 0))
+    return limits
+
+class UpstreamPolicy:
+    """Rate limit theo model + retry có jitter + circuit breaker cho 1 upstream (openai, tavily)."""
+
+    def __init__(self, name: str, default_limits: Tuple[float, float], model_limits: Dict[str, Tuple[float, float]]):
+        self.name = name
+        self.default_limits = default_limits
+        self.model_limits = model_limits
+        self.limiters: Dict[str, RateLimiter] = {}
+        self.breaker = CircuitBreaker(name, settings.CIRCUIT_FAILURE_THRESHOLD, settings.CIRCUIT_RESET_SECONDS)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def _limiter(self, model: str) -> RateLimiter:
+        with self._lock:
+            limiter = self.limiters.get(model)
+            if limiter is None:
+                limiter = RateLimiter(*self.model_limits.get(model, self.default_limits))
+                self.limiters[model] = limiter
+            return limiter
+
+    def admit(self, request: httpx.Request) -> float:
+        """Số giây phải chờ trước khi gửi (theo RPM/TPM của model trong request)."""
+        model, tokens = self.name, 0
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            # Whisper: model nằm trong 1 field của form
+            match = _MULTIPART_MODEL.search(request.content)
+            model = match.group(1).decode() if match else model
+        elif content_type.startswith("application/json"):
+            # Ước lượng ~4 byte 1 token (đủ để không vượt TPM, không cần tokenizer)
+            tokens = len(request.content) // 4
+            try:
+                body = json.loads(request.content)
+                model = body.get("model") or model
+                tokens += int(body.get("max_tokens") or body.get("max_completion_tokens") or 0)
+            except (ValueError, AttributeError):
+                pass
+        return self._limiter(model).reserve(tokens)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter: các request bị 429 cùng lúc không retry cùng lúc
+        delay = random.uniform(0, min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * (2 ** attempt)))
+        return max(delay, retry_after or 0.0)
+
+    def on_response(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """None = trả response cho caller; số giây = chờ rồi gửi lại."""
+        status = response.status_code
+        # 429 = upstream vẫn sống, chỉ đang chặn tốc độ -> không tính là lỗi của circuit
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        if status not in RETRYABLE_STATUS:
+            retry_budget.deposit()
+            return None
+        if attempt >= settings.UPSTREAM_MAX_RETRIES or not retry_budget.try_spend():
+            return None
+
+        self.retries += 1
+        try:
+            retry_after = float(response.headers.get("retry-after", ""))
+        except ValueError:
+            retry_after = None
+        return self._backoff(attempt, retry_after)
+
+    def on_error(self, error: Exception, attempt: int) -> Optional[float]:
+        if isinstance(error, CircuitOpenError):
+            return None
+        self.breaker.record_failure()
+        if not isinstance(error, RETRYABLE_ERRORS):
+            return None
+        if attempt >= settings.UPSTREAM_MAX_RETRIES or not retry_budget.try_spend():
+            return None
+        self.retries += 1
+        return self._backoff(attempt, None)
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.state,
+            "circuit_trips": self.breaker.trips,
+            "retries": self.retries,
+            "models": sorted(self.limiters),
+        }
+
+class LoopLocalTransport(httpx.AsyncBaseTransport):
+    """
+    Pool kết nối async gắn với event loop đang chạy, nên tạo riêng cho từng loop
+    (ingest gọi asyncio.run nhiều lần; kết nối của loop đã đóng không dùng lại được).
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncBaseTransport]):
+        self.factory = factory
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncBaseTransport]" = weakref.WeakKeyDictionary()
+
+    def _current(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        transport = self._transports.get(loop)
+        if transport is None:
+            transport = self.factory()
+            self._transports[loop] = transport
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self):
+        transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+class PolicyTransport(httpx.AsyncBaseTransport):
+    """Transport async: pool keep-alive dùng chung + UpstreamPolicy bọc quanh mỗi request."""
+
+    def __init__(self, policy: UpstreamPolicy, transport: httpx.AsyncBaseTransport):
+        self.policy = policy
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        attempt = 0
+        while True:
+            # Mỗi lần gửi (kể cả retry sau 429) đều phải qua RPM/TPM limiter
+            delay = self.policy.admit(request)
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                self.policy.breaker.before_request()
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                delay = self.policy.on_error(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.policy.on_response(response, attempt)
+                if delay is None:
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+class SyncPolicyTransport(httpx.BaseTransport):
+    """Bản sync (LangChain vẫn dùng client sync ở vài chỗ, vd: Chroma gọi embed_query)."""
+
+    def __init__(self, policy: UpstreamPolicy, transport: httpx.BaseTransport):
+        self.policy = policy
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        attempt = 0
+        while True:
+            delay = self.policy.admit(request)
+            if delay:
+                time.sleep(delay)
+            try:
+                self.policy.breaker.before_request()
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                delay = self.policy.on_error(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = self.policy.on_response(response, attempt)
+                if delay is None:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+def _timeout(read_timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(read_timeout, connect=settings.HTTP_CONNECT_TIMEOUT)
+
+retry_budget = RetryBudget(settings.RETRY_BUDGET_RATIO, settings.RETRY_BUDGET_MIN_PER_SECOND)
+
+policies = {
+    "openai": UpstreamPolicy(
+        "openai",
+        (settings.OPENAI_DEFAULT_RPM, settings.OPENAI_DEFAULT_TPM),
+        _parse_model_limits(settings.OPENAI_MODEL_LIMITS),
+    ),
+    "tavily": UpstreamPolicy("tavily", (settings.TAVILY_RPM, 0), {}),
+}
+
+# 1 pool kết nối cho mỗi upstream, dùng chung cho mọi model / module (không bắt tay TLS lại mỗi request)
+openai_http = httpx.AsyncClient(
+    transport=PolicyTransport(policies["openai"], LoopLocalTransport(lambda: httpx.AsyncHTTPTransport(limits=_limits()))),
+    timeout=_timeout(settings.OPENAI_TIMEOUT),
+)
+openai_http_sync = httpx.Client(
+    transport=SyncPolicyTransport(policies["openai"], httpx.HTTPTransport(limits=_limits())),
+    timeout=_timeout(settings.OPENAI_TIMEOUT),
+)
+tavily_http = httpx.AsyncClient(
+    base_url=settings.TAVILY_BASE_URL,
+    transport=PolicyTransport(policies["tavily"], LoopLocalTransport(lambda: httpx.AsyncHTTPTransport(limits=_limits()))),
+    timeout=_timeout(settings.TAVILY_TIMEOUT),
+)
+
+# Tải file / gọi callback tới host bất kỳ: chỉ dùng chung pool, không rate limit / retry
+outbound_http = httpx.AsyncClient(
+    transport=LoopLocalTransport(lambda: httpx.AsyncHTTPTransport(limits=httpx.Limits(
+        max_connections=settings.AUDIO_FETCH_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.AUDIO_FETCH_MAX_CONNECTIONS,
+    ))),
+    timeout=httpx.Timeout(settings.AUDIO_FETCH_READ_TIMEOUT, connect=settings.AUDIO_FETCH_CONNECT_TIMEOUT),
+    follow_redirects=True,
+)
+
+_chat_models: Dict[Tuple[str, float], ChatOpenAI] = {}
+_embeddings: Dict[Tuple[str, int], OpenAIEmbeddings] = {}
+_openai_client: Optional[AsyncOpenAI] = None
+
+# Retry do transport quản lý (có budget) -> tắt retry riêng của SDK để không nhân đôi
+def get_chat_model(model: str, temperature: float = 0) -> ChatOpenAI:
+    key = (model, temperature)
+    if key not in _chat_models:
+        _chat_models[key] = ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=openai_http_sync,
+            http_async_client=openai_http,
+            max_retries=0,
+            stream_usage=True,  # để đếm được token cả khi stream
+            callbacks=[metrics_callback],
+        )
+    return _chat_models[key]
+
+def get_embeddings(model: str, dimensions: int = 0) -> OpenAIEmbeddings:
+    key = (model, dimensions)
+    if key not in _embeddings:
+        _embeddings[key] = OpenAIEmbeddings(
+            model=model,
+            dimensions=dimensions or None,  # None -> không gửi `dimensions`, dùng số chiều mặc định
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=openai_http_sync,
+            http_async_client=openai_http,
+            max_retries=0,
+        )
+    return _embeddings[key]
+
+def get_openai_client() -> AsyncOpenAI:
+    """Client OpenAI gốc (Whisper...)."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            http_client=openai_http,
+            max_retries=0,
+        )
+    return _openai_client
+
+async def tavily_search(query: str, max_results: int = 3) -> dict:
+    """Gọi Tavily /search qua pool dùng chung (langchain_tavily mở session aiohttp mới mỗi lần gọi)."""
+    response = await tavily_http.post(
+        "/search",
+        json={"query": query, "max_results": max_results},
+        headers={"Authorization": f"Bearer {settings.TAVILY_API_KEY}"},
+    )
+    response.raise_for_status()
+    return response.json()
+
+def client_stats() -> dict:
+    return {
+        "upstreams": {name: policy.stats() for name, policy in policies.items()},
+        "retry_budget": {"tokens": round(retry_budget.tokens, 2), "exhausted": retry_budget.exhausted},
+    }
+
+def _collect_metrics():
+    yield from counter_lines("lingora_upstream_retries_total", "Retries sent to each upstream", {
+        (("upstream", name),): policy.retries for name, policy in policies.items()
+    })
+    yield from counter_lines("lingora_upstream_circuit_trips_total", "Times each circuit breaker opened", {
+        (("upstream", name),): policy.breaker.trips for name, policy in policies.items()
+    })
+
+register_collector(_collect_metrics)
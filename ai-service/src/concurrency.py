@@ -0,0 +1,68 @@
+import asyncio
+import weakref
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Dict, TypeVar
+from src.config.env import settings
+
+# Số slot tối đa cho từng upstream. Request vượt quá sẽ xếp hàng (không bị từ chối),
+# nhờ vậy 1 process giữ được hàng trăm request mà không "bắn" quá tải lên OpenAI/Tavily.
+UPSTREAM_LIMITS = {
+    "openai_chat": settings.OPENAI_CHAT_MAX_CONCURRENCY,
+    "openai_embedding": settings.OPENAI_EMBEDDING_MAX_CONCURRENCY,
+    "openai_audio": settings.OPENAI_AUDIO_MAX_CONCURRENCY,
+    "tavily": settings.TAVILY_MAX_CONCURRENCY,
+    "agent": settings.AGENT_MAX_CONCURRENCY,
+}
+
+T = TypeVar("T")
+_END = object()
+
+# asyncio.Semaphore gắn với event loop, nên tạo lazily theo từng loop
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+def get_semaphore(upstream: str) -> asyncio.Semaphore:
+    if upstream not in UPSTREAM_LIMITS:
+        raise KeyError(f"Unknown upstream: {upstream}")
+
+    loop_semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    semaphore = loop_semaphores.get(upstream)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, UPSTREAM_LIMITS[upstream]))
+        loop_semaphores[upstream] = semaphore
+    return semaphore
+
+@asynccontextmanager
+async def upstream_slot(upstream: str):
+    """
+    Giữ 1 slot của upstream trong suốt lời gọi.
+    Ví dụ: async with upstream_slot("openai_chat"): await llm.ainvoke(...)
+    """
+    async with get_semaphore(upstream):
+        yield
+
+async def stream_in_slot(upstream: str, source: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    Đọc `source` (vd llm.astream(...)) trong 1 slot của upstream ở task riêng và đẩy qua hàng đợi.
+    Slot chỉ bị giữ trong lúc upstream còn sinh dữ liệu, không phụ thuộc tốc độ đọc của client SSE;
+    consumer dừng giữa chừng (client ngắt kết nối, aclose, bị huỷ) thì task đọc bị huỷ và slot được nhả ngay.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async with upstream_slot(upstream), aclosing(source):
+                async for item in source:
+                    queue.put_nowait(item)
+        finally:
+            queue.put_nowait(_END)
+
+    task = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not _END:
+            yield item
+        await task  # ném lại lỗi của upstream (nếu có)
+    finally:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # đánh dấu đã lấy lỗi để asyncio không log "exception was never retrieved"
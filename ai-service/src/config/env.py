@@ -29,4 +29,166 @@ class Settings:
     # Đường dẫn tới folder data chứa PDF
     DATA_PATH = get_path("DATA_PATH", "data")
 
+    # Thư mục chứa state lúc chạy (SQLite, cache trên đĩa...)
+    STATE_DIR = get_path("STATE_DIR", "state")
+
+    # Giới hạn số request đồng thời tới từng upstream (mỗi process)
+    OPENAI_CHAT_MAX_CONCURRENCY = int(os.getenv("OPENAI_CHAT_MAX_CONCURRENCY", "64"))
+    OPENAI_EMBEDDING_MAX_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDING_MAX_CONCURRENCY", "32"))
+    OPENAI_AUDIO_MAX_CONCURRENCY = int(os.getenv("OPENAI_AUDIO_MAX_CONCURRENCY", "8"))
+    TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", "8"))
+    AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "32"))
+
+    # Semantic cache cho /chat: câu hỏi gần nghĩa (cùng type) dùng lại câu trả lời
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+    SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+
+    # Giới hạn số prompt trong LLM cache (khớp chính xác chuỗi prompt)
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+
+    # Lịch sử chat: "memory" (mỗi process) hoặc "sqlite" (dùng chung giữa các worker trên 1 máy)
+    HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")
+    HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))
+    HISTORY_TTL_SECONDS = float(os.getenv("HISTORY_TTL_SECONDS", "86400"))
+    HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+    HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(64 * 1024 * 1024)))
+    HISTORY_DB_PATH = get_path("HISTORY_DB_PATH", os.path.join(STATE_DIR, "chat_history.sqlite3"))
+
+    # Cache embedding của câu hỏi (LRU trong process + SQLite tuỳ chọn)
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+    # Số chiều embedding (tham số `dimensions` của text-embedding-3-*): 0 = mặc định của model (1536)
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+    # Model + số chiều: khoá của cache embedding, manifest ingest, vector index (đổi số chiều -> nạp lại)
+    EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL}@{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "5000"))
+    EMBEDDING_CACHE_DISK_ENABLED = os.getenv("EMBEDDING_CACHE_DISK_ENABLED", "false").lower() == "true"
+    EMBEDDING_CACHE_DB_PATH = get_path("EMBEDDING_CACHE_DB_PATH", os.path.join(STATE_DIR, "embedding_cache.sqlite3"))
+
+    # Cache kết quả theo nội dung cho /moderate, /generate-title, /score/writing
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "5000"))
+    RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "604800"))
+    RESULT_CACHE_DISK_ENABLED = os.getenv("RESULT_CACHE_DISK_ENABLED", "false").lower() == "true"
+    RESULT_CACHE_DB_PATH = get_path("RESULT_CACHE_DB_PATH", os.path.join(STATE_DIR, "result_cache.sqlite3"))
+
+    # Tải audio cho /score/speaking (Whisper giới hạn 25MB)
+    AUDIO_FETCH_CONNECT_TIMEOUT = float(os.getenv("AUDIO_FETCH_CONNECT_TIMEOUT", "5"))
+    AUDIO_FETCH_READ_TIMEOUT = float(os.getenv("AUDIO_FETCH_READ_TIMEOUT", "30"))
+    AUDIO_FETCH_MAX_CONNECTIONS = int(os.getenv("AUDIO_FETCH_MAX_CONNECTIONS", "20"))
+    AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(25 * 1024 * 1024)))
+    AUDIO_SPOOL_MAX_MEMORY_BYTES = int(os.getenv("AUDIO_SPOOL_MAX_MEMORY_BYTES", str(5 * 1024 * 1024)))
+
+    # Router cục bộ cho /chat không có type
+    ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.45"))
+    ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.05"))
+
+    # Số chunk lấy về khi tra 1 sách (sách Ngữ pháp / Từ vựng riêng lẻ)
+    RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+
+    # Retrieval đồng thời cả 2 sách (gộp, lọc ngưỡng, MMR)
+    MULTI_RETRIEVAL_K = int(os.getenv("MULTI_RETRIEVAL_K", "6"))
+    MULTI_RETRIEVAL_FETCH_K = int(os.getenv("MULTI_RETRIEVAL_FETCH_K", "12"))
+    MULTI_RETRIEVAL_SCORE_THRESHOLD = float(os.getenv("MULTI_RETRIEVAL_SCORE_THRESHOLD", "0.2"))
+    MULTI_RETRIEVAL_MMR_LAMBDA = float(os.getenv("MULTI_RETRIEVAL_MMR_LAMBDA", "0.7"))
+
+    # Lexical index (BM25) build lúc ingest, nằm cạnh ChromaDB
+    LEXICAL_ENABLED = os.getenv("LEXICAL_ENABLED", "true").lower() == "true"
+    LEXICAL_INDEX_DIR = get_path("LEXICAL_INDEX_DIR", os.path.join(CHROMA_DB_DIR, "lexical"))
+    LEXICAL_CONFIDENT_SCORE = float(os.getenv("LEXICAL_CONFIDENT_SCORE", "0.6"))
+    LEXICAL_CONFIDENT_RATIO = float(os.getenv("LEXICAL_CONFIDENT_RATIO", "1.5"))
+    LEXICAL_MIN_QUERY_TERMS = int(os.getenv("LEXICAL_MIN_QUERY_TERMS", "2"))
+    # BM25 match chắc chắn -> fast-path sách đó thay cho router / Agent (sau bước semantic cache)
+    LEXICAL_ROUTING_ENABLED = os.getenv("LEXICAL_ROUTING_ENABLED", "true").lower() == "true"
+
+    # Vector search lúc serve: mmap = index NumPy export từ Chroma lúc ingest (các worker dùng chung page cache),
+    # chroma = query thẳng ChromaDB. Collection nào chưa có index mmap thì tự dùng ChromaDB.
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "mmap").lower()
+    VECTOR_INDEX_DIR = get_path("VECTOR_INDEX_DIR", os.path.join(CHROMA_DB_DIR, "vectors"))
+    # Bản nén của vector để quét lượt đầu: float32 (không nén) | float16 | int8.
+    # Top k * VECTOR_RESCORE_FACTOR ứng viên được tính lại score chính xác bằng vector float32.
+    VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "int8").lower()
+    VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+
+    # Dựng context cho LLM (src/context.py): gộp chunk trùng overlap, bỏ header/footer, giới hạn token
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1200"))
+    CONTEXT_MIN_PASSAGE_TOKENS = int(os.getenv("CONTEXT_MIN_PASSAGE_TOKENS", "60"))
+    CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "40"))
+    CONTEXT_BOILERPLATE_MIN_PAGES = int(os.getenv("CONTEXT_BOILERPLATE_MIN_PAGES", "8"))
+
+    # Cắt chunk lúc ingest (đổi giá trị -> manifest không khớp -> nạp lại toàn bộ chunk)
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+    # Ingest incremental: manifest (hash từng chunk) nằm cạnh ChromaDB
+    INGEST_MANIFEST_DIR = get_path("INGEST_MANIFEST_DIR", os.path.join(CHROMA_DB_DIR, "manifests"))
+
+    # Pipeline embedding lúc ingest: batch, song song có giới hạn, retry khi bị rate limit, checkpoint để resume
+    INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "128"))
+    INGEST_EMBED_MAX_CONCURRENCY = int(os.getenv("INGEST_EMBED_MAX_CONCURRENCY", "4"))
+    INGEST_EMBED_MAX_RETRIES = int(os.getenv("INGEST_EMBED_MAX_RETRIES", "6"))
+    INGEST_CHECKPOINT_DIR = get_path("INGEST_CHECKPOINT_DIR", os.path.join(STATE_DIR, "ingest_checkpoints"))
+
+    # Đọc PDF song song: 0 = dùng hết số core của máy
+    PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+    PDF_EXTRACT_PAGES_PER_TASK = int(os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "8"))
+
+    # /moderate/batch: gộp nhiều text ngắn vào 1 lần gọi LLM
+    MODERATION_BATCH_MAX_ITEMS = int(os.getenv("MODERATION_BATCH_MAX_ITEMS", "100"))
+    MODERATION_PACK_SIZE = int(os.getenv("MODERATION_PACK_SIZE", "10"))
+    MODERATION_PACK_MAX_CHARS = int(os.getenv("MODERATION_PACK_MAX_CHARS", "4000"))
+    MODERATION_PACK_MAX_ITEM_CHARS = int(os.getenv("MODERATION_PACK_MAX_ITEM_CHARS", "800"))
+
+    # Tầng lọc cục bộ trước LLM: text không có từ cấm, đủ ngắn (số từ + số ký tự) và chỉ gồm từ trong allowlist
+    # (chào hỏi, cảm ơn, số, emoji) -> safe luôn; còn lại hỏi LLM
+    MODERATION_PREFILTER_ENABLED = os.getenv("MODERATION_PREFILTER_ENABLED", "true").lower() == "true"
+    MODERATION_FAST_SAFE_MAX_WORDS = int(os.getenv("MODERATION_FAST_SAFE_MAX_WORDS", "3"))
+    MODERATION_FAST_SAFE_MAX_CHARS = int(os.getenv("MODERATION_FAST_SAFE_MAX_CHARS", "30"))
+
+    # Job chạy nền cho /score/speaking/jobs (lưu SQLite, restart không mất job)
+    JOB_DB_PATH = get_path("JOB_DB_PATH", os.path.join(STATE_DIR, "jobs.sqlite3"))
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "500"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "180"))
+    JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+    JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+    JOB_CALLBACK_MAX_ATTEMPTS = int(os.getenv("JOB_CALLBACK_MAX_ATTEMPTS", "3"))
+
+    # /score/section: chấm nhiều câu của 1 section cùng lúc
+    GRADING_SECTION_MAX_ITEMS = int(os.getenv("GRADING_SECTION_MAX_ITEMS", "50"))
+    GRADING_SECTION_MAX_CONCURRENCY = int(os.getenv("GRADING_SECTION_MAX_CONCURRENCY", "8"))
+
+    # Client registry (src/clients.py): pool kết nối, rate limit theo model, retry budget, circuit breaker
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+    TAVILY_BASE_URL = os.getenv("TAVILY_BASE_URL") or "https://api.tavily.com"
+    OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT", "20"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+    # RPM:TPM mặc định cho mọi model, ghi đè từng model: "gpt-4o-mini=500:200000,whisper-1=50" (0 = không giới hạn)
+    OPENAI_DEFAULT_RPM = float(os.getenv("OPENAI_DEFAULT_RPM", "500"))
+    OPENAI_DEFAULT_TPM = float(os.getenv("OPENAI_DEFAULT_TPM", "200000"))
+    OPENAI_MODEL_LIMITS = os.getenv("OPENAI_MODEL_LIMITS", "text-embedding-3-small=3000:1000000,whisper-1=50:0")
+    TAVILY_RPM = float(os.getenv("TAVILY_RPM", "100"))
+    UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "20"))
+    RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+    RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+    # Warm-up lúc khởi động (src/startup.py), /readyz chờ bước này xong.
+    # false: module nặng import lúc request đầu (trong thread) và /readyz luôn 503
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "60"))
+
+    # /metrics + trace lấy mẫu (in 1 dòng JSON các stage của request) thay cho log verbose của Agent
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
 settings = Settings()
\ No newline at end of file
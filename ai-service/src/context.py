@@ -0,0 +1,236 @@
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from langchain_core.documents import Document
+from src.config.env import settings
+from src.metrics import counter_lines, register_collector
+
+_PAGE_NUMBER_RE = re.compile(r"^\W*(?:page|trang)?\s*\d{1,4}\W*$", re.IGNORECASE)
+_DIGITS_RE = re.compile(r"\d+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+_count_tokens: Optional[Callable[[str], int]] = None
+_count_tokens_lock = threading.Lock()
+
+def count_tokens(text: str) -> int:
+    """Đếm token theo bảng mã của GPT-4.1/4o (tiktoken); không có tiktoken / bảng mã -> ~4 ký tự 1 token."""
+    global _count_tokens
+    if _count_tokens is None:
+        with _count_tokens_lock:
+            if _count_tokens is None:
+                try:
+                    import tiktoken
+
+                    encoding = tiktoken.get_encoding("o200k_base")
+                    _count_tokens = lambda value: len(encoding.encode(value, disallowed_special=()))
+                except Exception:
+                    _count_tokens = lambda value: max(1, len(value) // 4) if value else 0
+    return _count_tokens(text)
+
+def _line_key(line: str) -> str:
+    # "Unit 12  Present perfect" và "Unit 13 Present perfect" -> cùng 1 key (header lặp trên mọi trang)
+    return _DIGITS_RE.sub("#", " ".join(line.split()).casefold())
+
+def _overlap(left: str, right: str, min_chars: int, max_chars: int) -> int:
+    """Độ dài đoạn cuối của `left` trùng với đoạn đầu của `right` (chunk_overlap lúc ingest), 0 nếu không có."""
+    probe = right[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    position = left.find(probe, max(0, len(left) - max_chars))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+def _adjacent(left: dict, right: dict) -> bool:
+    # Overlap chỉ có giữa các chunk cắt từ cùng 1 trang (hoặc 2 trang liền nhau) của cùng 1 file
+    if left.get("source") != right.get("source"):
+        return False
+    try:
+        return abs(int(left.get("page")) - int(right.get("page"))) <= 1
+    except (TypeError, ValueError):
+        return left.get("page") == right.get("page")
+
+@dataclass
+class AssembledContext:
+    text: str
+    tokens: int
+    raw_tokens: int
+    passages: int  # số đoạn sau khi gộp
+    dropped: int  # số đoạn bị bỏ vì hết budget
+    sources: List[dict] = field(default_factory=list)
+
+@dataclass
+class _Passage:
+    text: str
+    metadata: dict
+
+class ContextAssembler:
+    """
+    Bước nằm giữa retrieval và LLM: dựng khối context gọn nhất từ các chunk đã xếp hạng.
+    1. Bỏ dòng boilerplate (header/footer lặp lại trên nhiều trang, số trang).
+    2. Gộp các chunk liền nhau (phần chunk_overlap trùng lặp chỉ giữ 1 lần), bỏ dòng đã xuất hiện.
+    3. Cắt theo budget token: lấy đoạn theo thứ hạng, đoạn cuối bị cắt ở ranh giới dòng/câu.
+    """
+
+    def __init__(self, max_tokens: int, min_overlap_chars: int, boilerplate_min_pages: int):
+        self.max_tokens = max_tokens
+        self.min_overlap_chars = min_overlap_chars
+        self.boilerplate_min_pages = boilerplate_min_pages
+        self.boilerplate: Set[str] = set()
+        self._stats: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def learn_boilerplate(self, chunks: Iterable[Tuple[str, dict]]):
+        """
+        Dòng ngắn xuất hiện trên >= boilerplate_min_pages trang khác nhau của cùng 1 sách là header/footer
+        (tên sách, bản quyền, "Unit #"...). Học 1 lần lúc khởi động từ các chunk đã có (BM25 index).
+        """
+        pages: Dict[str, Set[Tuple[str, object]]] = defaultdict(set)
+        for text, metadata in chunks:
+            page = (metadata.get("source"), metadata.get("page"))
+            for line in text.splitlines():
+                key = _line_key(line)
+                if key and len(key) <= 80:
+                    pages[key].add(page)
+        self.boilerplate = {key for key, seen in pages.items() if len(seen) >= self.boilerplate_min_pages}
+
+    def _clean(self, text: str) -> str:
+        lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped or _PAGE_NUMBER_RE.match(stripped) or _line_key(stripped) in self.boilerplate:
+                continue
+            lines.append(stripped)
+        return "\n".join(lines)
+
+    def _merge(self, docs: List[Document]) -> List[_Passage]:
+        max_overlap = max(settings.CHUNK_OVERLAP * 2, self.min_overlap_chars)
+        passages: List[_Passage] = []
+        seen_lines: Set[str] = set()
+        for doc in docs:
+            text = self._clean(doc.page_content)
+            if not text:
+                continue
+
+            merged = False
+            for passage in passages:
+                if text in passage.text:
+                    merged = True  # chunk con của đoạn đã có
+                    break
+                if not _adjacent(passage.metadata, doc.metadata):
+                    continue
+                # Chunk kế tiếp (hoặc liền trước) trên cùng trang/sách: nối lại, phần trùng chỉ giữ 1 lần
+                tail = _overlap(passage.text, text, self.min_overlap_chars, max_overlap)
+                if tail:
+                    passage.text += text[tail:]
+                    merged = True
+                    break
+                head = _overlap(text, passage.text, self.min_overlap_chars, max_overlap)
+                if head:
+                    passage.text = text + passage.text[head:]
+                    merged = True
+                    break
+            if merged:
+                continue
+
+            # Dòng đã có trong đoạn trước (trùng nhưng không nằm ở ranh giới chunk) -> bỏ
+            lines = [line for line in text.split("\n") if _line_key(line) not in seen_lines or len(line) < 30]
+            if not lines:
+                continue
+            seen_lines.update(_line_key(line) for line in lines)
+            passages.append(_Passage("\n".join(lines), dict(doc.metadata)))
+        return passages
+
+    def _fit(self, text: str, budget: int) -> str:
+        """Cắt đoạn cuối cho vừa budget, ở ranh giới dòng rồi tới câu (không cắt giữa câu)."""
+        kept: List[str] = []
+        used = 0
+        for line in text.split("\n"):
+            pieces = [line] if count_tokens(line) + used <= budget else _SENTENCE_END_RE.split(line)
+            for piece in pieces:
+                cost = count_tokens(piece) + 1
+                if used + cost > budget:
+                    return "\n".join(kept)
+                kept.append(piece)
+                used += cost
+        return "\n".join(kept)
+
+    def assemble(self, docs: List[Document], max_tokens: Optional[int] = None) -> AssembledContext:
+        budget = max_tokens or self.max_tokens
+        # So với cách cũ: nối thẳng các chunk bằng "\n\n"
+        raw_tokens = count_tokens("\n\n".join(doc.page_content for doc in docs)) if docs else 0
+        passages = self._merge(docs)
+
+        parts: List[str] = []
+        sources: List[dict] = []
+        used = 0
+        dropped = 0
+        for passage in passages:
+            remaining = budget - used
+            cost = count_tokens(passage.text)
+            if cost > remaining:
+                # Đoạn cuối chỉ lấy 1 phần nếu còn đủ chỗ cho vài câu, không thì bỏ
+                text = self._fit(passage.text, remaining) if remaining >= settings.CONTEXT_MIN_PASSAGE_TOKENS else ""
+                if not text:
+                    dropped += 1
+                    continue
+                cost = count_tokens(text)
+            else:
+                text = passage.text
+            parts.append(text)
+            sources.append({key: passage.metadata[key] for key in ("source", "page", "collection") if key in passage.metadata})
+            used += cost
+
+        text = "\n\n".join(parts)
+        tokens = count_tokens(text) if text else 0
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["raw_tokens"] += raw_tokens
+            self._stats["tokens"] += tokens
+            self._stats["dropped_passages"] += dropped
+        return AssembledContext(text, tokens, raw_tokens, len(parts), dropped, sources)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        raw = stats.get("raw_tokens", 0)
+        stats["saved_ratio"] = round(1 - stats.get("tokens", 0) / raw, 4) if raw else 0.0
+        stats["boilerplate_lines"] = len(self.boilerplate)
+        return stats
+
+context_assembler = ContextAssembler(
+    max_tokens=settings.CONTEXT_MAX_TOKENS,
+    min_overlap_chars=settings.CONTEXT_MIN_OVERLAP_CHARS,
+    boilerplate_min_pages=settings.CONTEXT_BOILERPLATE_MIN_PAGES,
+)
+
+# Phần cố định của prompt fast-path: luôn đứng đầu và giống hệt nhau ở mọi request
+# -> OpenAI cache được prefix (system + lịch sử), chỉ phần tài liệu + câu hỏi ở cuối là thay đổi
+RAG_SYSTEM_PROMPT = """Bạn là LingoraBot - Trợ lý ảo dạy Tiếng Anh.
+
+Tin nhắn cuối cùng của học viên gồm TÀI LIỆU THAM KHẢO (trích từ sách hoặc tài liệu liên quan, có thể trống) và CÂU HỎI.
+
+Nhiệm vụ:
+- Trả lời CÂU HỎI của học viên một cách ngắn gọn, dễ hiểu.
+- Nếu tài liệu không đủ, dùng kiến thức của bạn để giải thích, nhưng KHÔNG nói rằng tài liệu thiếu."""
+
+def build_user_turn(question: str, context: str) -> str:
+    if not context:
+        return f"CÂU HỎI: {question}"
+    return f"TÀI LIỆU THAM KHẢO:\n----------\n{context}\n----------\n\nCÂU HỎI: {question}"
+
+def _collect_metrics():
+    stats = context_assembler.stats()
+    yield from counter_lines("lingora_context_tokens_total", "Context tokens before and after assembly", {
+        (("stage", "retrieved"),): stats.get("raw_tokens", 0),
+        (("stage", "assembled"),): stats.get("tokens", 0),
+    })
+    yield from counter_lines("lingora_context_dropped_passages_total", "Passages dropped by the token budget", {
+        (): stats.get("dropped_passages", 0),
+    })
+
+register_collector(_collect_metrics)
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.lru_cache import LRUCache
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá để 2 câu chỉ khác hoa/thường hoặc khoảng trắng dùng chung 1 embedding."""
+    return " ".join(unicodedata.normalize("NFC", text).casefold().split())
+
+class DiskEmbeddingStore:
+    """
+    Lưu embedding xuống SQLite (float32 BLOB), sống sót qua restart và dùng chung giữa các worker.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._conn().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def set(self, key: str, vector: np.ndarray):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            (key, vector.astype(np.float32).tobytes()),
+        )
+
+    def set_many(self, items: Dict[str, np.ndarray]):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes()) for key, vector in items.items()],
+            )
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc 1 Embeddings (OpenAIEmbeddings) bằng cache 2 tầng: LRU trong process + SQLite tuỳ chọn.
+    Key = sha256(model + text đã chuẩn hoá), nên đổi model không bao giờ trả nhầm vector cũ.
+    """
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        max_entries: int,
+        disk_store: Optional[DiskEmbeddingStore] = None,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.memory = LRUCache(max_entries)
+        self.disk_store = disk_store
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        vector = self.memory.get(key)
+        if vector is not None:
+            return vector
+
+        if self.disk_store is not None:
+            vector = self.disk_store.get(key)
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.memory.set(key, vector)
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key: str, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        self.memory.set(key, vector)
+        if self.disk_store is not None:
+            self.disk_store.set(key, vector)
+        return vector
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        found: Dict[int, np.ndarray] = {}
+        missing: Dict[str, List[int]] = {}  # key -> các vị trí cần embed (gộp text trùng)
+        for i, key in enumerate(keys):
+            if key in missing:
+                missing[key].append(i)
+                continue
+            vector = self._lookup(key)
+            if vector is not None:
+                found[i] = vector
+            else:
+                missing.setdefault(key, []).append(i)
+        return found, missing
+
+    def _merge(self, texts, found, missing, embeddings) -> List[List[float]]:
+        for (key, positions), embedding in zip(missing.items(), embeddings):
+            vector = self._store(key, embedding)
+            for i in positions:
+                found[i] = vector
+        return [found[i].tolist() for i in range(len(texts))]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self._store(key, self.underlying.embed_query(text))
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self._store(key, await self.underlying.aembed_query(text))
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._split(texts)
+        embeddings = self.underlying.embed_documents([texts[p[0]] for p in missing.values()]) if missing else []
+        return self._merge(texts, found, missing, embeddings)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._split(texts)
+        embeddings = await self.underlying.aembed_documents([texts[p[0]] for p in missing.values()]) if missing else []
+        return self._merge(texts, found, missing, embeddings)
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        hits = memory["hits"] + self.disk_hits
+        total = hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": memory["entries"],
+            "max_entries": memory["max_entries"],
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "disk_enabled": self.disk_store is not None,
+        }
@@ -0,0 +1,219 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Callable, Dict, List, Optional
+import numpy as np
+import openai
+from langchain_core.embeddings import Embeddings
+from src.embedding_cache import DiskEmbeddingStore
+
+# Lỗi tạm thời -> retry; lỗi khác (sai key, input quá dài...) -> dừng luôn
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+@dataclass
+class EmbeddingItem:
+    key: str  # hash nội dung, dùng làm key checkpoint
+    text: str
+    payload: Any = None  # dữ liệu đi kèm cho on_batch (vd: chunk_id + Document)
+
+OnBatch = Callable[[List[EmbeddingItem], List[np.ndarray]], None]
+
+def _token_counter(model_name: str) -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.encoding_for_model(model_name)
+        return lambda text: len(encoding.encode(text))
+    except Exception:
+        # Không có tiktoken / không tải được bảng mã -> ước lượng ~4 ký tự 1 token
+        return lambda text: max(1, len(text) // 4)
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+class AdaptiveLimiter:
+    """
+    Giới hạn số batch gọi OpenAI cùng lúc theo kiểu AIMD:
+    bị 429 -> giảm 1 nửa, chạy ổn liên tục -> tăng dần lại tới mức tối đa.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    async def on_success(self):
+        async with self._cond:
+            self._successes += 1
+            if self.limit < self.max_concurrency and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    async def on_throttle(self):
+        async with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+
+@dataclass
+class PipelineStats:
+    batches: int = 0
+    chunks: int = 0
+    resumed: int = 0  # lấy lại từ checkpoint, không phải gọi OpenAI
+    tokens: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+class EmbeddingPipeline:
+    """
+    Embed danh sách chunk theo batch, chạy song song có giới hạn, backoff khi bị rate limit.
+    Mỗi batch xong được ghi ngay vào checkpoint (SQLite) -> chạy lại sau khi crash chỉ embed phần còn thiếu.
+    Nhận chunk dạng luồng (async iterator), nên embed được ngay trong lúc PDF vẫn đang được đọc.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        checkpoint: DiskEmbeddingStore,
+        batch_size: int,
+        max_concurrency: int,
+        max_retries: int,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.checkpoint = checkpoint
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.count_tokens = _token_counter(model_name)
+
+    def checkpoint_key(self, key: str) -> str:
+        return f"{self.model_name}:{key}"
+
+    async def _embed_batch(self, texts: List[str], stats: PipelineStats) -> List[np.ndarray]:
+        for attempt in range(self.max_retries + 1):
+            async with self.limiter.slot():
+                try:
+                    vectors = await self.embeddings.aembed_documents(texts)
+                except RETRYABLE_ERRORS as e:
+                    error = e
+                else:
+                    await self.limiter.on_success()
+                    return [np.asarray(vector, dtype=np.float32) for vector in vectors]
+
+            if isinstance(error, openai.RateLimitError):
+                await self.limiter.on_throttle()
+            if attempt == self.max_retries:
+                raise error
+
+            stats.retries += 1
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+            delay = _retry_after(error) or random.uniform(backoff / 2, backoff)
+            print(f"   ⏳ {type(error).__name__}, thử lại sau {delay:.1f}s "
+                  f"(lần {attempt + 1}/{self.max_retries}, song song={self.limiter.limit})")
+            await asyncio.sleep(delay)
+
+    async def _collect(self, batch: List[EmbeddingItem], task: "asyncio.Task", on_batch: OnBatch, stats: PipelineStats):
+        vectors = await task
+        self.checkpoint.set_many({self.checkpoint_key(item.key): vector for item, vector in zip(batch, vectors)})
+        on_batch(batch, vectors)
+
+        stats.batches += 1
+        stats.chunks += len(batch)
+        stats.tokens += sum(self.count_tokens(item.text) for item in batch)
+        stats.seconds = time.perf_counter() - self._started
+        print(f"   - Batch {stats.batches}: {stats.chunks} đoạn | "
+              f"{stats.chunks_per_second:.1f} chunks/s | {stats.tokens_per_second:.0f} tokens/s")
+
+    async def run(self, items: AsyncIterable[EmbeddingItem], on_batch: OnBatch) -> PipelineStats:
+        """
+        items: luồng chunk cần embed (có thể đang được đọc/cắt dần từ PDF).
+        on_batch(items, vectors) được gọi mỗi khi 1 batch sẵn sàng, kể cả batch lấy lại từ checkpoint.
+        Chỉ giữ tối đa 2 * max_concurrency batch đang chờ -> bộ nhớ chỉ phụ thuộc batch size.
+        """
+        stats = PipelineStats()
+        self._started = time.perf_counter()
+        in_flight: Dict["asyncio.Task", List[EmbeddingItem]] = {}
+        window = 2 * self.limiter.max_concurrency
+
+        async def drain():
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                await self._collect(in_flight.pop(task), task, on_batch, stats)
+
+        def submit(batch: List[EmbeddingItem]):
+            vectors = [self.checkpoint.get(self.checkpoint_key(item.key)) for item in batch]
+            resumed = [(item, vector) for item, vector in zip(batch, vectors) if vector is not None]
+            if resumed:
+                stats.resumed += len(resumed)
+                on_batch([item for item, _ in resumed], [vector for _, vector in resumed])
+
+            missing = [item for item, vector in zip(batch, vectors) if vector is None]
+            if missing:
+                task = asyncio.create_task(self._embed_batch([item.text for item in missing], stats))
+                in_flight[task] = missing
+
+        try:
+            batch: List[EmbeddingItem] = []
+            async for item in items:
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+                submit(batch)
+                batch = []
+                # Batch nào xong thì ghi checkpoint ngay, không đợi đầy hàng đợi
+                for task in [task for task in in_flight if task.done()]:
+                    await self._collect(in_flight.pop(task), task, on_batch, stats)
+                while len(in_flight) >= window:
+                    await drain()
+            if batch:
+                submit(batch)
+            while in_flight:
+                await drain()
+        except BaseException:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+            raise
+
+        stats.seconds = time.perf_counter() - self._started
+        return stats
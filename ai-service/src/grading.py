@@ -1,59 +1,98 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
-from langchain_openai import ChatOpenAI
+from typing import BinaryIO, Optional, List, Tuple
 from langchain_core.prompts import ChatPromptTemplate
 from src.config.env import settings
-import requests
+from src.grading_models import SectionItem
+from src.clients import get_chat_model, get_openai_client, outbound_http
+from src.concurrency import upstream_slot
+from src.metrics import track
+from src.result_cache import make_key, result_cache
+from urllib.parse import urlparse
+import asyncio
+import io
 import os
-from openai import OpenAI
+import tempfile
 
-# Initialize OpenAI Client for Audio (Whisper)
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# OpenAI Client for Audio (Whisper) - dùng chung pool kết nối / rate limit từ src/clients.py
+client = get_openai_client()
 
-# Initialize LLM for Grading
-llm = ChatOpenAI(
-    model="gpt-4.1-nano", # Use GPT-4.1-nano for better grading accuracy and cheaper
-    openai_api_key=settings.OPENAI_API_KEY,
-    temperature=0.3
-)
+# LLM for Grading
+llm = get_chat_model("gpt-4.1-nano", temperature=0.3) # Use GPT-4.1-nano for better grading accuracy and cheaper
 
 class GradingResult(BaseModel):
     score: float = Field(description="Score from 0 to 10")
     feedback: str = Field(description="Detailed feedback on strengths and weaknesses")
     corrected_version: Optional[str] = Field(description="Better version of the answer if applicable")
 
-def transcribe_audio(audio_url: str) -> str:
+AUDIO_EXTENSIONS = {"flac", "m4a", "mp3", "mp4", "mpeg", "mpga", "oga", "ogg", "wav", "webm"}
+CONTENT_TYPE_EXTENSIONS = {
+    "audio/mpeg": "mp3", "audio/mp3": "mp3", "audio/mp4": "m4a", "audio/x-m4a": "m4a", "audio/wav": "wav",
+    "audio/x-wav": "wav", "audio/webm": "webm", "audio/ogg": "ogg", "audio/flac": "flac",
+}
+
+def _audio_filename(audio_url: str, content_type: str) -> str:
+    # Whisper đoán định dạng theo đuôi file -> lấy từ URL, không có thì theo Content-Type
+    extension = os.path.splitext(urlparse(audio_url).path)[1].lstrip(".").lower()
+    if extension not in AUDIO_EXTENSIONS:
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(";")[0].strip().lower(), "mp3")
+    return f"audio.{extension}"
+
+async def _download_audio(audio_url: str) -> Tuple[str, BinaryIO]:
+    """
+    Stream audio vào buffer riêng của từng request: giữ trong RAM, quá AUDIO_SPOOL_MAX_MEMORY_BYTES
+    thì chuyển sang file tạm ẩn danh; dừng ngay khi vượt AUDIO_MAX_BYTES.
+    (Không dùng SpooledTemporaryFile vì httpx gọi fileno() khi upload -> luôn bị ghi ra đĩa.)
+    """
+    buffer: BinaryIO = io.BytesIO()
+    try:
+        async with outbound_http.stream("GET", audio_url) as response:
+            response.raise_for_status()
+            if int(response.headers.get("content-length") or 0) > settings.AUDIO_MAX_BYTES:
+                raise ValueError(f"Audio file is larger than {settings.AUDIO_MAX_BYTES} bytes")
+
+            size = 0
+            async for chunk in response.aiter_bytes(64 * 1024):
+                size += len(chunk)
+                if size > settings.AUDIO_MAX_BYTES:
+                    raise ValueError(f"Audio file is larger than {settings.AUDIO_MAX_BYTES} bytes")
+                if isinstance(buffer, io.BytesIO) and size > settings.AUDIO_SPOOL_MAX_MEMORY_BYTES:
+                    spilled = tempfile.TemporaryFile()
+                    spilled.write(buffer.getbuffer())
+                    buffer.close()
+                    buffer = spilled
+                buffer.write(chunk)
+
+            filename = _audio_filename(audio_url, response.headers.get("content-type", ""))
+        buffer.seek(0)
+        return filename, buffer
+    except BaseException:
+        buffer.close()
+        raise
+
+async def transcribe_audio(audio_url: str) -> str:
     """
     Downloads audio from URL and transcribes it using OpenAI Whisper.
     """
     try:
-        # 1. Download audio to a temporary file
-        response = requests.get(audio_url)
-        if response.status_code != 200:
-            raise Exception("Failed to download audio file")
-        
-        filename = "temp_audio.mp3" # Support flexible formats in real prod
-        with open(filename, "wb") as f:
-            f.write(response.content)
-
-        # 2. Transcribe
-        with open(filename, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1", 
-                file=audio_file
-            )
-        
-        # 3. Cleanup
-        os.remove(filename)
+        # 1. Download audio vào buffer riêng (không dùng file cố định -> các request không ghi đè nhau)
+        with track("audio_download"):
+            filename, audio_file = await _download_audio(audio_url)
+
+        # 2. Transcribe thẳng từ buffer
+        with audio_file:
+            async with upstream_slot("openai_audio"):
+                with track("whisper_transcription"):
+                    transcription = await client.audio.transcriptions.create(
+                        model="whisper-1", 
+                        file=(filename, audio_file)
+                    )
 
         return transcription.text
     except Exception as e:
         print(f"Error transcribing audio: {e}")
-        if os.path.exists("temp_audio.mp3"):
-            os.remove("temp_audio.mp3")
         return ""
 
-def grade_writing(question: str, answer: str) -> GradingResult:
+async def grade_writing(question: str, answer: str, raise_errors: bool = False) -> GradingResult:
     prompt = ChatPromptTemplate.from_template("""
     You are an IELTS/TOEIC Examiner. Grade the following WRITING answer.
     
@@ -68,18 +107,29 @@ def grade_writing(question: str, answer: str) -> GradingResult:
     Output JSON format: {{ "score": <number>, "feedback": "<text>", "corrected_version": "<text>" }}
     """)
     
+    # Nộp lại cùng bài (retry) -> trả đúng điểm cũ, không chấm lại
+    cache_key = make_key("score/writing", llm.model_name, {"question": question, "answer": answer})
+    cached = result_cache.get("score/writing", cache_key)
+    if cached is not None:
+        return GradingResult(**cached)
+
     try:
         chain = prompt | llm
         # We can implement structured output parsing properly, but for now getting raw text and assuming JSON or using with_structured_output is better.
         # Let's use with_structured_output for robust JSON
         structured_llm = llm.with_structured_output(GradingResult)
         result = prompt | structured_llm
-        return result.invoke({"question": question, "answer": answer})
+        async with upstream_slot("openai_chat"):
+            grading = await result.ainvoke({"question": question, "answer": answer})
+        result_cache.set(cache_key, grading.model_dump())
+        return grading
     except Exception as e:
         print(f"Error grading writing: {e}")
+        if raise_errors:
+            raise
         return GradingResult(score=0, feedback="Error during AI grading", corrected_version=None)
 
-def grade_speaking(question: str, transcript: str) -> GradingResult:
+async def grade_speaking(question: str, transcript: str, raise_errors: bool = False) -> GradingResult:
     prompt = ChatPromptTemplate.from_template("""
     You are an IELTS/TOEIC Examiner. Grade the following SPEAKING answer (Transcript provided).
     
@@ -97,7 +147,73 @@ def grade_speaking(question: str, transcript: str) -> GradingResult:
     try:
         structured_llm = llm.with_structured_output(GradingResult)
         chain = prompt | structured_llm
-        return chain.invoke({"question": question, "transcript": transcript})
+        async with upstream_slot("openai_chat"):
+            return await chain.ainvoke({"question": question, "transcript": transcript})
     except Exception as e:
         print(f"Error grading speaking: {e}")
+        if raise_errors:
+            raise
         return GradingResult(score=0, feedback="Error during AI grading", corrected_version=None)
+
+async def score_speaking(question: str, audio_url: str) -> dict:
+    """Transcribe + chấm điểm, dùng chung cho /score/speaking (đồng bộ) và job chạy nền."""
+    transcript = await transcribe_audio(audio_url)
+    if not transcript:
+        raise ValueError("Failed to transcribe audio")
+
+    # Lỗi LLM phải nổi lên: job chạy nền retry, endpoint đồng bộ trả 5xx (không trả điểm 0 như 1 kết quả thật)
+    result = await grade_speaking(question, transcript, raise_errors=True)
+    return {
+        "score": result.score,
+        "feedback": result.feedback,
+        "corrected_version": result.corrected_version,
+        "transcript": transcript
+    }
+
+class SectionItemResult(BaseModel):
+    id: str
+    type: str
+    result: GradingResult
+    transcript: Optional[str] = None
+
+class SectionItemError(BaseModel):
+    id: str
+    type: str
+    error: str
+
+async def grade_section(items: List[SectionItem]) -> dict:
+    """
+    Chấm cả 1 section trong 1 lần: mọi câu chạy song song (có giới hạn), nên thời gian ≈ câu chậm nhất.
+    Transcribe (Whisper) và chấm (LLM) có 2 giới hạn riêng -> câu speaking transcribe
+    trong lúc các câu writing đang được chấm. Câu lỗi không làm hỏng cả section.
+    """
+    transcribe_slots = asyncio.Semaphore(max(1, settings.GRADING_SECTION_MAX_CONCURRENCY))
+    grade_slots = asyncio.Semaphore(max(1, settings.GRADING_SECTION_MAX_CONCURRENCY))
+
+    async def grade_item(item: SectionItem) -> SectionItemResult:
+        if item.type == "writing":
+            if not (item.answer or "").strip():
+                raise ValueError("Missing answer")
+            async with grade_slots:
+                result = await grade_writing(item.question, item.answer, raise_errors=True)
+            return SectionItemResult(id=item.id, type=item.type, result=result)
+
+        if not item.audio_url:
+            raise ValueError("Missing audio_url")
+        async with transcribe_slots:
+            transcript = await transcribe_audio(item.audio_url)
+        if not transcript:
+            raise ValueError("Failed to transcribe audio")
+        async with grade_slots:
+            result = await grade_speaking(item.question, transcript, raise_errors=True)
+        return SectionItemResult(id=item.id, type=item.type, result=result, transcript=transcript)
+
+    outcomes = await asyncio.gather(*(grade_item(item) for item in items), return_exceptions=True)
+
+    results, errors = [], []
+    for item, outcome in zip(items, outcomes):
+        if isinstance(outcome, Exception):
+            errors.append(SectionItemError(id=item.id, type=item.type, error=str(outcome) or type(outcome).__name__))
+        else:
+            results.append(outcome)
+    return {"results": results, "errors": errors}
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from typing import Literal, Optional
+
+# Tách khỏi src/grading.py (module đó tạo client OpenAI lúc import) để main.py dùng làm schema request
+class SectionItem(BaseModel):
+    id: str
+    type: Literal["writing", "speaking"]
+    question: str
+    answer: Optional[str] = None  # writing
+    audio_url: Optional[str] = None  # speaking
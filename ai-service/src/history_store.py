@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Deque, List, Tuple
+from src.config.env import settings
+
+Turn = Tuple[str, str]  # (question, answer)
+
+class HistoryStore(ABC):
+    """
+    Lưu lịch sử chat theo session_id. Mỗi session chỉ giữ max_turns lượt gần nhất.
+    """
+
+    def __init__(self, max_turns: int, ttl_seconds: float):
+        self.max_turns = max(1, max_turns)
+        self.ttl_seconds = ttl_seconds
+
+    @abstractmethod
+    def get(self, session_id: str) -> List[Turn]:
+        ...
+
+    @abstractmethod
+    def append(self, session_id: str, question: str, answer: str):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+class _Session:
+    __slots__ = ("turns", "size", "touched_at")
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Tuple[str, str, int]] = deque(maxlen=max_turns)
+        self.size = 0
+        self.touched_at = time.time()
+
+class InMemoryHistoryStore(HistoryStore):
+    """
+    Lưu trong RAM của process. Session dùng gần nhất nằm cuối OrderedDict (LRU),
+    bị loại khi quá TTL, quá số session hoặc quá giới hạn bộ nhớ (tính theo byte UTF-8).
+    """
+
+    def __init__(self, max_turns: int, ttl_seconds: float, max_sessions: int, max_bytes: int):
+        super().__init__(max_turns, ttl_seconds)
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> List[Turn]:
+        with self._lock:
+            self._purge_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            session.touched_at = time.time()
+            self._sessions.move_to_end(session_id)
+            return [(q, a) for q, a, _ in session.turns]
+
+    def append(self, session_id: str, question: str, answer: str):
+        size = len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = _Session(self.max_turns)
+                self._sessions[session_id] = session
+            else:
+                self._sessions.move_to_end(session_id)
+
+            # deque(maxlen) tự bỏ lượt cũ nhất -> trừ dung lượng của lượt đó trước
+            if len(session.turns) == session.turns.maxlen:
+                dropped = session.turns[0][2]
+                session.size -= dropped
+                self._total_bytes -= dropped
+
+            session.turns.append((question, answer, size))
+            session.size += size
+            session.touched_at = time.time()
+            self._total_bytes += size
+
+            self._purge_expired()
+            while self._sessions and (
+                len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes
+            ):
+                self._evict_oldest()
+
+    def _purge_expired(self):
+        deadline = time.time() - self.ttl_seconds
+        # Thứ tự LRU cũng là thứ tự touched_at -> chỉ cần xét từ đầu
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.touched_at > deadline:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        _, session = self._sessions.popitem(last=False)
+        self._total_bytes -= session.size
+        self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Lưu trong file SQLite (WAL) để nhiều worker uvicorn trên cùng 1 máy dùng chung lịch sử.
+    Append và trim chỉ đụng tới các dòng của 1 session qua primary key (session_id, seq).
+    """
+
+    PURGE_EVERY = 500  # Sau bao nhiêu lần append thì dọn các lượt hết hạn
+
+    def __init__(self, db_path: str, max_turns: int, ttl_seconds: float):
+        super().__init__(max_turns, ttl_seconds)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._appends = 0
+
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_created_at ON chat_turns (created_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3.Connection không nên dùng chung giữa các thread -> mỗi thread 1 connection
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> List[Turn]:
+        rows = self._conn().execute(
+            """
+            SELECT question, answer FROM chat_turns
+            WHERE session_id = ? AND created_at > ?
+            ORDER BY seq DESC LIMIT ?
+            """,
+            (session_id, time.time() - self.ttl_seconds, self.max_turns),
+        ).fetchall()
+        return [(q, a) for q, a in reversed(rows)]
+
+    def append(self, session_id: str, question: str, answer: str):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (last_seq,) = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM chat_turns WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            seq = last_seq + 1
+            conn.execute(
+                "INSERT INTO chat_turns (session_id, seq, question, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, seq, question, answer, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM chat_turns WHERE session_id = ? AND seq <= ?",
+                (session_id, seq - self.max_turns),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._appends += 1
+        if self._appends % self.PURGE_EVERY == 0:
+            conn.execute(
+                "DELETE FROM chat_turns WHERE created_at <= ?",
+                (time.time() - self.ttl_seconds,),
+            )
+
+    def stats(self) -> dict:
+        sessions, turns = self._conn().execute(
+            "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM chat_turns"
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "turns": turns,
+            "db_path": self.db_path,
+        }
+
+def create_history_store() -> HistoryStore:
+    backend = settings.HISTORY_BACKEND.lower()
+
+    if backend == "sqlite":
+        return SQLiteHistoryStore(
+            db_path=settings.HISTORY_DB_PATH,
+            max_turns=settings.HISTORY_MAX_TURNS,
+            ttl_seconds=settings.HISTORY_TTL_SECONDS,
+        )
+
+    if backend == "memory":
+        return InMemoryHistoryStore(
+            max_turns=settings.HISTORY_MAX_TURNS,
+            ttl_seconds=settings.HISTORY_TTL_SECONDS,
+            max_sessions=settings.HISTORY_MAX_SESSIONS,
+            max_bytes=settings.HISTORY_MAX_BYTES,
+        )
+
+    raise ValueError(f"Unknown HISTORY_BACKEND: {settings.HISTORY_BACKEND}")
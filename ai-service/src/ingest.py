@@ -1,16 +1,24 @@
+import asyncio
 import os
-import shutil
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
+import numpy as np
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from src.config.env import settings
+from src.clients import get_embeddings
+from src.lexical_index import BM25Index, index_path, build_from_chroma
+from src.embedding_cache import DiskEmbeddingStore
+from src.embedding_pipeline import EmbeddingItem, EmbeddingPipeline
+from src.ingest_manifest import IngestManifest, content_hash, file_sha256, make_chunk_id
+from src.pdf_extract import aiter_pdf_pages
+from src.vector_index import export_collection, is_up_to_date, iter_collection
 
 # --- CẤU HÌNH ---
 FILES_TO_PROCESS = {
     "english_grammar_in_use.pdf": "grammar_collection",
     "english_vocabulary_in_use.pdf": "vocab_collection"
 }
+CHUNK_SIZE = settings.CHUNK_SIZE
+CHUNK_OVERLAP = settings.CHUNK_OVERLAP
 
 def ensure_pdf_exists(file_name: str) -> bool:
     """Kiểm tra và tải PDF nếu chưa có"""
@@ -36,6 +44,21 @@ def ensure_pdf_exists(file_name: str) -> bool:
         print(f"❌ Lỗi khi tải {file_name}: {e}")
         return False
 
+def make_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> RecursiveCharacterTextSplitter:
+    # Dùng chung cho ingest và benchmarks/retrieval_eval.py (thử các cấu hình chunk khác nhau)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def _open_store(collection_name: str, embeddings) -> Chroma:
+    return Chroma(
+        persist_directory=settings.CHROMA_DB_DIR,
+        collection_name=collection_name,
+        embedding_function=embeddings
+    )
+
 def process_pdf(file_name, collection_name):
     # Kiểm tra và tải PDF nếu cần
     if not ensure_pdf_exists(file_name):
@@ -46,37 +69,155 @@ def process_pdf(file_name, collection_name):
     
     print(f"\n🔄 Đang xử lý: {file_name} -> Collection: {collection_name}")
 
-    # 1. Load PDF
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
-    print(f"   - Đã đọc xong {len(documents)} trang.")
+    # 0. So với manifest lần nạp trước: PDF + cấu hình không đổi -> không cần làm gì
+    source_sha256 = file_sha256(file_path)
+    manifest = IngestManifest.load(collection_name)
+    # Lỗi tạm thời được transport retry trước (trong retry budget), còn lỗi thì EmbeddingPipeline backoff tiếp
+    embeddings = get_embeddings(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS)
+    vector_store = _open_store(collection_name, embeddings)
 
-    # 2. Cắt nhỏ văn bản (Chunking)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    chunks = text_splitter.split_documents(documents)
-    print(f"   - Đã chia thành {len(chunks)} đoạn nhỏ.")
-
-    # 3. Tạo Embeddings (DÙNG OPENAI)
-    print("   - Đang tạo embeddings với OpenAI...")
-    embeddings = OpenAIEmbeddings(
-        openai_api_key=settings.OPENAI_API_KEY,
-        model="text-embedding-3-small"  # Hoặc "text-embedding-ada-002" (rẻ hơn) hoặc "text-embedding-3-large" (tốt hơn)
-    )
+    if manifest is not None and manifest.embedding_model != settings.EMBEDDING_MODEL_ID:
+        # Vector của model cũ không dùng chung được với model mới -> nạp lại toàn bộ
+        print(f"   - Đổi embedding model ({manifest.embedding_model} -> {settings.EMBEDDING_MODEL_ID}), xoá collection cũ.")
+        vector_store.delete_collection()
+        vector_store = _open_store(collection_name, embeddings)
+        manifest = None
 
-    # 4. Lưu vào ChromaDB
-    vector_store = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=settings.CHROMA_DB_DIR,
-        collection_name=collection_name
+    if (
+        manifest is not None
+        and manifest.is_up_to_date(source_sha256, settings.EMBEDDING_MODEL_ID, CHUNK_SIZE, CHUNK_OVERLAP)
+        and vector_store._collection.count() == len(manifest.chunks)
+    ):
+        print(f"   - Không có thay đổi ({len(manifest.chunks)} đoạn), bỏ qua.")
+        if not os.path.exists(index_path(collection_name)):
+            build_from_chroma(collection_name)
+        if not is_up_to_date(collection_name, len(manifest.chunks)):
+            export_collection(collection_name)
+        return
+
+    # 1-3. Đọc PDF song song nhiều process; trang nào xong thì cắt chunk, so hash và đẩy sang embed ngay
+    #      (không giữ text / vector cả cuốn sách trong RAM, chỉ giữ hash từng chunk)
+    text_splitter = make_text_splitter()
+    # So với nội dung đang có trong Chroma (không phụ thuộc hash trong manifest cũ), đọc theo từng trang.
+    # Collection cũ nạp bằng from_documents (ID ngẫu nhiên, không có manifest) cũng rơi vào nhánh xoá ở dưới
+    stored_hashes = {}  # chunk_id -> hash nội dung đang lưu
+    for batch in iter_collection(vector_store._collection, include=["documents"], batch_size=settings.INGEST_EMBED_BATCH_SIZE):
+        stored_hashes.update((chunk_id, content_hash(text or "")) for chunk_id, text in zip(batch["ids"], batch["documents"]))
+    stored_ids = set(stored_hashes)
+    sources = {chunk_hash: chunk_id for chunk_id, chunk_hash in stored_hashes.items()}  # hash -> ID đang giữ vector
+    hashes = {}
+    pending_moves = []  # chunk chỉ đổi ID (nội dung cũ): lấy vector cũ theo batch rồi cho qua checkpoint
+    moved = 0
+    lexical = BM25Index()
+    page_count = 0
+
+    checkpoint_path = os.path.join(settings.INGEST_CHECKPOINT_DIR, f"{collection_name}.sqlite3")
+    checkpoint = DiskEmbeddingStore(checkpoint_path)
+    pipeline = EmbeddingPipeline(
+        embeddings,
+        model_name=settings.EMBEDDING_MODEL_ID,
+        checkpoint=checkpoint,
+        batch_size=settings.INGEST_EMBED_BATCH_SIZE,
+        max_concurrency=settings.INGEST_EMBED_MAX_CONCURRENCY,
+        max_retries=settings.INGEST_EMBED_MAX_RETRIES
     )
+
+    def save_stored_vectors(chunk_ids):
+        """Vector đang lưu của các ID -> checkpoint (key = hash nội dung cũ), pipeline lấy lại không cần gọi OpenAI."""
+        missing = [chunk_id for chunk_id in chunk_ids if checkpoint.get(pipeline.checkpoint_key(stored_hashes[chunk_id])) is None]
+        if not missing:
+            return
+        data = vector_store._collection.get(ids=missing, include=["embeddings"])
+        checkpoint.set_many({
+            pipeline.checkpoint_key(stored_hashes[chunk_id]): np.asarray(vector, dtype=np.float32)
+            for chunk_id, vector in zip(data["ids"], data["embeddings"])
+        })
+
+    def flush_moves():
+        save_stored_vectors([sources[item.key] for item in pending_moves])
+        items = list(pending_moves)
+        pending_moves.clear()
+        return items
+
+    async def changed_chunks():
+        nonlocal page_count, moved
+        pages = aiter_pdf_pages(file_path, settings.PDF_EXTRACT_WORKERS, settings.PDF_EXTRACT_PAGES_PER_TASK)
+        async for page in pages:
+            page_count += 1
+            for position, chunk in enumerate(text_splitter.split_documents([page])):
+                chunk_id = make_chunk_id(file_name, chunk.metadata["page"], position)
+                hashes[chunk_id] = content_hash(chunk.page_content)
+                lexical.add(chunk.page_content, chunk.metadata)
+                if stored_hashes.get(chunk_id) == hashes[chunk_id]:
+                    continue
+                item = EmbeddingItem(key=hashes[chunk_id], text=chunk.page_content, payload=(chunk_id, chunk))
+                if hashes[chunk_id] in sources:
+                    # Trang bị dời (chèn/bớt trang phía trước): nội dung cũ, chỉ đổi ID + metadata
+                    moved += 1
+                    pending_moves.append(item)
+                    if len(pending_moves) >= settings.INGEST_EMBED_BATCH_SIZE:
+                        for moved_item in flush_moves():
+                            yield moved_item
+                    continue
+                yield item
+        for moved_item in flush_moves():
+            yield moved_item
+
+    # 4. Chỉ embed + upsert các chunk mới/đã sửa (DÙNG OPENAI)
+    def upsert(items, vectors):
+        # ID sắp bị ghi nội dung khác: cất vector cũ vào checkpoint trước, vì nội dung đó có thể
+        # xuất hiện lại ở ID khác phía sau (chunk bị dời trang) -> vẫn không phải embed lại
+        save_stored_vectors([
+            item.payload[0] for item in items
+            if item.payload[0] in stored_hashes and stored_hashes[item.payload[0]] != item.key
+        ])
+        # Vector đã có sẵn -> ghi thẳng vào collection, không để Chroma embed lại
+        vector_store._collection.upsert(
+            ids=[item.payload[0] for item in items],
+            embeddings=[vector.tolist() for vector in vectors],
+            documents=[item.text for item in items],
+            metadatas=[item.payload[1].metadata or None for item in items]
+        )
+
+    stats = asyncio.run(pipeline.run(changed_chunks(), on_batch=upsert))
+    changed = stats.chunks + stats.resumed - moved
+    print(f"   - Đã đọc {page_count} trang, {len(hashes)} đoạn: {changed} đoạn mới/đã sửa, "
+          f"{moved} đoạn chỉ đổi vị trí (dùng lại vector), {len(hashes) - changed - moved} đoạn giữ nguyên.")
+    if stats.chunks:
+        print(f"   - Embed {stats.chunks} đoạn ({stats.resumed - moved} từ checkpoint) trong {stats.seconds:.1f}s: "
+              f"{stats.chunks_per_second:.1f} chunks/s, {stats.tokens_per_second:.0f} tokens/s, {stats.retries} lần retry.")
+
+    # Xoá các chunk không còn trong PDF
+    vanished = sorted(stored_ids - set(hashes))
+    if vanished:
+        vector_store.delete(ids=vanished)
+        print(f"   - Đã xoá {len(vanished)} đoạn không còn trong PDF.")
+
+    IngestManifest(
+        collection=collection_name,
+        source=file_name,
+        source_sha256=source_sha256,
+        embedding_model=settings.EMBEDDING_MODEL_ID,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        chunks=hashes,
+    ).save()
+
+    # Manifest đã ghi -> checkpoint không còn cần nữa
+    checkpoint.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(checkpoint_path + suffix):
+            os.remove(checkpoint_path + suffix)
     
     print(f"✅ Đã lưu thành công vào ChromaDB tại: {settings.CHROMA_DB_DIR}")
 
+    # 5. Build lexical index (BM25) trên cùng các chunk để tra từ khoá không cần embedding
+    lexical.finalize().save(index_path(collection_name))
+    print(f"✅ Đã lưu lexical index tại: {index_path(collection_name)}")
+
+    # 6. Export vector + nội dung chunk sang index mmap cho lúc serve (src/vector_index.py)
+    export_collection(collection_name)
+
 def main():
     print("🚀 BẮT ĐẦU QUÁ TRÌNH NẠP DỮ LIỆU...")
     
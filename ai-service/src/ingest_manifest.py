@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+from src.config.env import settings
+
+MANIFEST_VERSION = 2  # 2: content_hash chỉ theo nội dung chunk
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def content_hash(text: str) -> str:
+    """
+    Hash chỉ theo nội dung chunk (không theo trang / vị trí): chèn hoặc bớt 1 trang làm số trang phía sau
+    lệch đi, nhưng chunk có nội dung y hệt vẫn dùng lại được vector đã có (và checkpoint embed cùng key).
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def make_chunk_id(file_name: str, page: int, position: int) -> str:
+    """
+    ID trong Chroma = tên file + số trang + thứ tự chunk trong trang (để metadata trang luôn đúng).
+    Chunk đổi ID nhưng nội dung không đổi thì chỉ copy vector sang ID mới, không embed lại.
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return f"{stem}-p{page}-c{position}"
+
+@dataclass
+class IngestManifest:
+    """Những gì đã nạp vào 1 collection: hash file nguồn, cấu hình chunking và hash của từng chunk theo ID."""
+
+    collection: str
+    source: str = ""
+    source_sha256: str = ""
+    embedding_model: str = ""
+    chunk_size: int = 0
+    chunk_overlap: int = 0
+    chunks: Dict[str, str] = field(default_factory=dict)  # chunk_id -> content_hash
+    updated_at: float = 0.0
+    version: int = MANIFEST_VERSION
+
+    def is_up_to_date(self, source_sha256: str, embedding_model: str, chunk_size: int, chunk_overlap: int) -> bool:
+        return (
+            self.version == MANIFEST_VERSION
+            and self.source_sha256 == source_sha256
+            and self.embedding_model == embedding_model
+            and self.chunk_size == chunk_size
+            and self.chunk_overlap == chunk_overlap
+        )
+
+    def save(self):
+        path = manifest_path(self.collection)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.updated_at = time.time()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, collection: str) -> Optional["IngestManifest"]:
+        path = manifest_path(collection)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(**data)
+
+def manifest_path(collection: str) -> str:
+    return os.path.join(settings.INGEST_MANIFEST_DIR, f"{collection}.json")
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+import httpx
+from src.clients import outbound_http
+from src.config.env import settings
+
+Handler = Callable[[dict], Awaitable[dict]]
+
+class SQLiteJobStore:
+    """
+    Lưu job chấm bài vào SQLite (WAL) để restart không mất job đang chờ / đang chạy.
+    Job "running" có lease: process chạy nó chết thì hết lease sẽ được đưa lại vào hàng đợi.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                callback_url TEXT,
+                callback_status TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                next_attempt_at REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "next_attempt_at" not in columns:
+            # DB tạo bởi bản cũ
+            conn.execute("ALTER TABLE jobs ADD COLUMN next_attempt_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, kind: str, payload: dict, callback_url: Optional[str] = None) -> dict:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, payload, callback_url, created_at, updated_at) "
+            "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), callback_url, now, now),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def claim(self, job_id: str, lease_seconds: float) -> Optional[dict]:
+        """Chuyển queued -> running (atomic), nên 1 job chỉ được 1 worker / 1 process chạy."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (now + lease_seconds, now, job_id),
+        )
+        return self.get(job_id) if cursor.rowcount == 1 else None
+
+    def finish(self, job_id: str, result: dict):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str, retry_at: Optional[float] = None):
+        """retry_at = None -> hỏng hẳn; có giá trị -> quay lại queued, chỉ được chạy lại từ thời điểm đó."""
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+            ("failed" if retry_at is None else "queued", error, retry_at, time.time(), job_id),
+        )
+
+    def set_callback_status(self, job_id: str, status: str):
+        self._conn().execute(
+            "UPDATE jobs SET callback_status = ?, updated_at = ? WHERE id = ?",
+            (status, time.time(), job_id),
+        )
+
+    def recover(self, retention_seconds: float) -> List[str]:
+        """Đưa job hết lease về queued, xoá job đã xong quá hạn lưu; trả về các job đang chờ đã tới lượt chạy."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', lease_until = NULL, updated_at = ? "
+            "WHERE status = 'running' AND lease_until < ?",
+            (now, now),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (now - retention_seconds,),
+        )
+        # Job đang chờ backoff sau lần lỗi trước chưa tới giờ -> để lượt quét sau
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' AND (next_attempt_at IS NULL OR next_attempt_at <= ?) "
+            "ORDER BY created_at",
+            (now,),
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def count(self, status: str) -> int:
+        (count,) = self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()
+        return count
+
+class JobQueueFull(Exception):
+    pass
+
+class JobQueue:
+    """
+    Hàng đợi job chạy nền trong process: N worker lấy job id từ asyncio.Queue, trạng thái nằm trong SQLite.
+    Xong (hoặc hỏng hẳn) thì POST kết quả về callback_url nếu có, trong task riêng: callback chậm / lỗi
+    không giữ worker chấm bài. Mọi lời gọi SQLite chạy trong thread (asyncio.to_thread), không chặn event loop.
+    """
+
+    def __init__(self, store: SQLiteJobStore, handlers: Dict[str, Handler], workers: int, max_pending: int):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._enqueued: set = set()
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: set = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+        recovered = await self._recover()
+        if recovered:
+            print(f"♻️  Khôi phục {recovered} job chấm bài đang dở")
+
+    async def stop(self):
+        tasks = self._tasks + list(self._callbacks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._callbacks.clear()
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._enqueued:
+            self._enqueued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def _recover(self) -> int:
+        job_ids = await asyncio.to_thread(self.store.recover, settings.JOB_RETENTION_SECONDS)
+        for job_id in job_ids:
+            self._enqueue(job_id)
+        return len(job_ids)
+
+    async def submit(self, kind: str, payload: dict, callback_url: Optional[str] = None) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        if len(self._enqueued) >= self.max_pending:
+            raise JobQueueFull(f"Too many pending jobs ({self.max_pending})")
+
+        job = await asyncio.to_thread(self.store.create, kind, payload, callback_url)
+        self._enqueue(job["id"])
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _sweeper(self):
+        # Job của process khác bị chết giữa chừng (hết lease) -> nhận về chạy tiếp
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 2)
+            try:
+                await self._recover()
+            except Exception as e:
+                print(f"Error recovering jobs: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._enqueued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.claim, job_id, settings.JOB_LEASE_SECONDS)
+        if job is None:
+            return  # process/worker khác đã nhận job này
+
+        try:
+            result = await asyncio.wait_for(self.handlers[job["kind"]](job["payload"]), settings.JOB_LEASE_SECONDS)
+        except Exception as e:
+            retry = job["attempts"] < settings.JOB_MAX_ATTEMPTS
+            delay = 2 ** job["attempts"]
+            await asyncio.to_thread(
+                self.store.fail, job_id, str(e) or type(e).__name__, retry_at=time.time() + delay if retry else None
+            )
+            if retry:
+                # Lỗi tạm thời (tải audio / Whisper / LLM) -> chạy lại sau ít giây
+                asyncio.get_running_loop().call_later(delay, self._enqueue, job_id)
+                return
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, result)
+
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job.get("callback_url"):
+            # Gửi callback trong task riêng -> worker nhận job tiếp theo ngay
+            task = asyncio.create_task(self._notify(job))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _notify(self, job: dict):
+        body = {"job_id": job["id"], **{key: job[key] for key in ("kind", "status", "result", "error")}}
+        for attempt in range(settings.JOB_CALLBACK_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(2 ** (attempt - 1))
+            try:
+                response = await outbound_http.post(job["callback_url"], json=body, timeout=settings.JOB_CALLBACK_TIMEOUT)
+                if response.status_code < 500:
+                    await asyncio.to_thread(self.store.set_callback_status, job["id"], f"delivered:{response.status_code}")
+                    return
+            except httpx.HTTPError as e:
+                print(f"Error calling back job {job['id']}: {e}")
+        await asyncio.to_thread(self.store.set_callback_status, job["id"], "failed")
+
+    def _counts(self) -> dict:
+        return {status: self.store.count(status) for status in ("queued", "running", "done", "failed")}
+
+    async def stats(self) -> dict:
+        counts = await asyncio.to_thread(self._counts)
+        return {
+            "workers": self.workers,
+            "pending_in_process": len(self._enqueued),
+            "callbacks_in_flight": len(self._callbacks),
+            **counts,
+        }
+
+async def _speaking_job(payload: dict) -> dict:
+    from src.startup import warmup
+    # Import trong thread (hoặc chờ warm-up import xong), không chặn event loop
+    grading = await warmup.import_module("grading")
+    return await grading.score_speaking(payload["question"], payload["audio_url"])
+
+job_queue = JobQueue(
+    SQLiteJobStore(settings.JOB_DB_PATH),
+    handlers={"speaking": _speaking_job},
+    workers=settings.JOB_WORKERS,
+    max_pending=settings.JOB_MAX_PENDING,
+)
@@ -0,0 +1,189 @@
+import gzip
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+from src.config.env import settings
+
+TOKEN_RE = re.compile(r"\w+(?:'\w+)?", re.UNICODE)
+
+STOPWORDS = {
+    # English
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "at", "by", "for", "with",
+    "from", "as", "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these",
+    "those", "i", "you", "he", "she", "we", "they", "do", "does", "did", "what", "which", "who",
+    "how", "when", "where", "why", "not", "no", "can", "so", "than", "then", "there",
+    # Tiếng Việt (từ hỏi / hư từ thường gặp trong câu hỏi của học viên)
+    "là", "gì", "nào", "khi", "cách", "dùng", "của", "và", "có", "không", "cho", "mình", "hỏi",
+    "nghĩa", "thế", "như", "được", "với", "trong", "một", "các", "những", "này", "đó", "sao",
+}
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFC", text).casefold()
+    return [token for token in TOKEN_RE.findall(text) if token not in STOPWORDS and not token.isdigit()]
+
+class BM25Index:
+    """
+    Inverted index BM25 gọn nhẹ cho 1 collection, build lúc ingest và lưu thành 1 file .json.gz.
+    Dùng cho các câu hỏi tra cứu đúng thuật ngữ (idiom, phrasal verb, tên thì...).
+    """
+
+    VERSION = 1
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Tuple[str, dict]] = []
+        self.doc_lens: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._idf: Dict[str, float] = {}
+        self._avgdl = 0.0
+
+    def add(self, text: str, metadata: Optional[dict] = None):
+        doc_id = len(self.docs)
+        counts = Counter(tokenize(text))
+        self.docs.append((text, dict(metadata or {})))
+        self.doc_lens.append(sum(counts.values()))
+        for term, tf in counts.items():
+            self.postings[term].append((doc_id, tf))
+
+    def finalize(self) -> "BM25Index":
+        n = len(self.docs)
+        self._avgdl = (sum(self.doc_lens) / n) if n else 0.0
+        self._idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        return self
+
+    @classmethod
+    def build(cls, documents: Iterable[Document], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        for doc in documents:
+            index.add(doc.page_content, doc.metadata)
+        return index.finalize()
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """
+        Trả về top-k (Document, score chuẩn hoá 0..1). Score được chia cho điểm của 1 chunk dài trung bình
+        chứa mỗi từ khoá 1 lần (= tổng idf), nên so sánh được giữa các câu hỏi khác nhau.
+        """
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self._idf]
+        if not terms or not self.docs:
+            return []
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in terms:
+            idf = self._idf[term]
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_id] / (self._avgdl or 1))
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        reference = sum(self._idf[term] for term in terms) or 1.0
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+        results = []
+        for doc_id, score in top:
+            text, metadata = self.docs[doc_id]
+            score = min(1.0, score / reference)
+            metadata = dict(metadata)
+            metadata["lexical_score"] = round(score, 4)
+            results.append((Document(page_content=text, metadata=metadata), score))
+        return results
+
+    def query_terms(self, query: str) -> List[str]:
+        return [term for term in dict.fromkeys(tokenize(query)) if term in self._idf]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "version": self.VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "docs": [{"text": text, "metadata": metadata} for text, metadata in self.docs],
+            "postings": self.postings,
+        }
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+
+        if payload.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported lexical index version in {path}")
+
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.docs = [(doc["text"], doc["metadata"]) for doc in payload["docs"]]
+        index.postings = defaultdict(list, {
+            term: [tuple(entry) for entry in posting] for term, posting in payload["postings"].items()
+        })
+        index.doc_lens = [0] * len(index.docs)
+        for posting in index.postings.values():
+            for doc_id, tf in posting:
+                index.doc_lens[doc_id] += tf
+        return index.finalize()
+
+def index_path(collection_name: str) -> str:
+    return os.path.join(settings.LEXICAL_INDEX_DIR, f"{collection_name}.json.gz")
+
+def load_lexical_index(collection_name: str) -> Optional[BM25Index]:
+    path = index_path(collection_name)
+    if not os.path.exists(path):
+        print(f"⚠️  Chưa có lexical index cho {collection_name} ({path}) -> chỉ dùng vector search")
+        return None
+    return BM25Index.load(path)
+
+def is_confident(index: BM25Index, query: str, hits: List[Tuple[Document, float]]) -> bool:
+    """
+    Match từ khoá đủ chắc chắn để bỏ qua luôn bước embedding:
+    đủ số từ khoá có trong index, điểm top-1 cao và bỏ xa top-2.
+    """
+    if not hits or len(index.query_terms(query)) < settings.LEXICAL_MIN_QUERY_TERMS:
+        return False
+
+    top = hits[0][1]
+    second = hits[1][1] if len(hits) > 1 else 0.0
+    return top >= settings.LEXICAL_CONFIDENT_SCORE and top >= second * settings.LEXICAL_CONFIDENT_RATIO
+
+def fuse_rrf(ranked_lists: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """
+    Reciprocal Rank Fusion: gộp nhiều danh sách đã xếp hạng (vector, BM25) chỉ dựa trên thứ hạng,
+    nên không cần đưa 2 loại score về cùng thang đo.
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    docs: Dict[str, Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = " ".join(doc.page_content.split())
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+
+    order = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in order]
+
+def build_from_chroma(collection_name: str):
+    """Build lại lexical index từ chunk đã có trong Chroma (không cần đọc lại PDF, không embed)."""
+    from langchain_chroma import Chroma
+
+    store = Chroma(persist_directory=settings.CHROMA_DB_DIR, collection_name=collection_name)
+    data = store.get(include=["documents", "metadatas"])
+    documents = [
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(data["documents"], data["metadatas"])
+    ]
+    BM25Index.build(documents).save(index_path(collection_name))
+    print(f"✅ Lexical index {collection_name}: {len(documents)} chunks -> {index_path(collection_name)}")
+
+if __name__ == "__main__":
+    from src.ingest import FILES_TO_PROCESS
+
+    for name in FILES_TO_PROCESS.values():
+        build_from_chroma(name)
@@ -1,10 +1,47 @@
+from contextlib import aclosing, asynccontextmanager
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from src.rag import get_answer
 from fastapi.middleware.cors import CORSMiddleware
+from src.config.env import settings
+from src.grading_models import SectionItem
+from src.startup import NotReadyError, warmup
+import asyncio
+import json
 
-app = FastAPI(title="Lingora AI Service 🤖")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up chạy nền: server nhận /healthz ngay, /readyz trả 200 khi mọi thứ đã sẵn sàng
+    warmup_task = asyncio.create_task(warmup.run()) if settings.WARMUP_ENABLED else None
+
+    # Worker chạy job chấm bài nền (job còn dở từ lần chạy trước được nhận lại).
+    # src.jobs kéo theo src.clients (openai, langchain) -> import trong thread, không chặn lúc khởi động
+    async def start_jobs():
+        jobs = await warmup.import_module("jobs")
+        await jobs.job_queue.start()
+        return jobs.job_queue
+
+    jobs_task = asyncio.create_task(start_jobs())
+    yield
+    if jobs_task.done() and not jobs_task.cancelled() and jobs_task.exception() is None:
+        await jobs_task.result().stop()
+    else:
+        jobs_task.cancel()
+        await asyncio.gather(jobs_task, return_exceptions=True)
+
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+
+async def load_module(name: str):
+    """src.<name> cho handler: không import trên event loop; warm-up chưa import xong -> 503."""
+    try:
+        return await warmup.load(name)
+    except NotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+app = FastAPI(title="Lingora AI Service 🤖", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Cho phép mọi nguồn (Frontend) gọi vào. Khi ra production nên đổi thành ["https://your-frontend.com"]
@@ -27,8 +64,19 @@ class ChatRequest(BaseModel):
 def read_root():
     return {"message": "Lingora AI Service is Running! 🚀"}
 
+@app.get("/healthz")
+def healthz_endpoint():
+    """Liveness: process còn sống và event loop còn phản hồi (không kiểm tra phụ thuộc)."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz_endpoint():
+    """Readiness: 200 khi warm-up xong và mọi thành phần bắt buộc (import, vector index...) sẵn sàng, ngược lại 503."""
+    report = warmup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
 @app.post("/chat")
-def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest):
     """
     API nhận câu hỏi và trả về câu trả lời từ AI.
     Ví dụ body:
@@ -41,7 +89,8 @@ def chat_endpoint(request: ChatRequest):
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
     # Gọi hàm logic bên file rag.py
-    answer = get_answer(
+    rag = await load_module("rag")
+    answer = await rag.get_answer(
         question=request.question,
         type=request.type,
         session_id=request.session_id or "default",
@@ -49,13 +98,68 @@ def chat_endpoint(request: ChatRequest):
     )
     
     return {"answer": answer}
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Giống /chat nhưng trả về Server-Sent Events:
+    - event: token -> data: {"content": "..."} (mỗi token ngay khi LLM sinh ra)
+    - event: done  -> data: {"answer": "..."} (câu trả lời đầy đủ)
+    """
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    rag = await load_module("rag")
+
+    async def event_source():
+        # aclosing: client ngắt kết nối -> đóng generator ngay để nhả slot upstream, không chờ GC
+        events = rag.stream_answer(
+            question=request.question,
+            type=request.type,
+            session_id=request.session_id or "default",
+            history=request.history,
+        )
+        async with aclosing(events):
+            async for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Tắt buffering của nginx để token tới client ngay
+        },
+    )
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    rag = await load_module("rag")
+    return {
+        "semantic_answer_cache": rag.answer_cache.stats(),
+        "embedding_cache": rag.embedding_model.stats(),
+        "result_cache": rag.result_cache.stats(),
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text format: latency từng stage, token LLM, cache hit, lỗi, retry upstream."""
+    from src.metrics import render_metrics
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/clients/stats")
+async def client_stats_endpoint():
+    """Trạng thái circuit breaker, số retry, retry budget của từng upstream."""
+    clients = await load_module("clients")
+    return clients.client_stats()
+
 class TitleRequest(BaseModel):
     question: str
 
 @app.post("/generate-title")
-def title_endpoint(request: TitleRequest):
-    from src.rag import generate_chat_title
-    title = generate_chat_title(request.question)
+async def title_endpoint(request: TitleRequest):
+    rag = await load_module("rag")
+    title = await rag.generate_chat_title(request.question)
     return {"title": title}
 
 class GradeWritingRequest(BaseModel):
@@ -67,36 +171,111 @@ class GradeSpeakingRequest(BaseModel):
     audio_url: str
 
 @app.post("/score/writing")
-def score_writing_endpoint(request: GradeWritingRequest):
-    from src.grading import grade_writing
-    result = grade_writing(request.question, request.answer)
+async def score_writing_endpoint(request: GradeWritingRequest):
+    grading = await load_module("grading")
+    result = await grading.grade_writing(request.question, request.answer)
     return result
 
 @app.post("/score/speaking")
-def score_speaking_endpoint(request: GradeSpeakingRequest):
-    from src.grading import transcribe_audio, grade_speaking
-    
-    # 1. Transcribe the audio
-    transcript = transcribe_audio(request.audio_url)
-    if not transcript:
-        raise HTTPException(status_code=400, detail="Failed to transcribe audio")
-        
-    # 2. Grade the transcript
-    result = grade_speaking(request.question, transcript)
-    
-    # 3. Return combined result
+async def score_speaking_endpoint(request: GradeSpeakingRequest):
+    grading = await load_module("grading")
+
+    # Transcribe + chấm trong cùng request (có thể mất > 15s, nên dùng /score/speaking/jobs)
+    try:
+        return await grading.score_speaking(request.question, request.audio_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Error scoring speaking: {e}")
+        raise HTTPException(status_code=502, detail="AI grading failed, please retry")
+
+class GradeSectionRequest(BaseModel):
+    items: List[SectionItem]
+
+@app.post("/score/section")
+async def score_section_endpoint(request: GradeSectionRequest):
+    """
+    Chấm tất cả câu writing/speaking của 1 section trong 1 request.
+    items: [{"id", "type": "writing" | "speaking", "question", "answer" | "audio_url"}]
+    Trả về {"results": [...], "errors": [...]}: câu lỗi nằm trong "errors", các câu khác vẫn có điểm.
+    """
+    if len(request.items) > settings.GRADING_SECTION_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.GRADING_SECTION_MAX_ITEMS} items per section")
+
+    grading = await load_module("grading")
+    return await grading.grade_section(request.items)
+
+class SpeakingJobRequest(GradeSpeakingRequest):
+    callback_url: Optional[str] = None
+
+@app.post("/score/speaking/jobs", status_code=202)
+async def submit_speaking_job_endpoint(request: SpeakingJobRequest):
+    """
+    Nhận bài speaking, trả job_id ngay; worker nền transcribe + chấm.
+    Lấy kết quả bằng GET /jobs/{job_id}, hoặc nhận POST về callback_url khi job xong / lỗi.
+    """
+    jobs = await load_module("jobs")
+    try:
+        job = await jobs.job_queue.submit(
+            "speaking",
+            {"question": request.question, "audio_url": request.audio_url},
+            callback_url=request.callback_url,
+        )
+    except jobs.JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/stats")
+async def job_stats_endpoint():
+    jobs = await load_module("jobs")
+    return await jobs.job_queue.stats()
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    """status: queued | running | done | failed. "result" giống response của /score/speaking."""
+    jobs = await load_module("jobs")
+    job = await jobs.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
     return {
-        "score": result.score,
-        "feedback": result.feedback,
-        "corrected_version": result.corrected_version,
-        "transcript": transcript
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "callback_status": job["callback_status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
     }
 
 class ModerationRequest(BaseModel):
     text: str
 
 @app.post("/moderate")
-def moderate_endpoint(request: ModerationRequest):
-    from src.moderation import moderate_content
-    result = moderate_content(request.text)
-    return result
\ No newline at end of file
+async def moderate_endpoint(request: ModerationRequest):
+    moderation = await load_module("moderation")
+    result = await moderation.moderate_content(request.text)
+    return result
+
+class BatchModerationRequest(BaseModel):
+    texts: List[str]
+
+@app.get("/moderate/stats")
+async def moderate_stats_endpoint():
+    """Số text được xử lý ở từng tầng (lọc cục bộ vs LLM)."""
+    moderation = await load_module("moderation")
+    return moderation.moderation_stats()
+
+@app.post("/moderate/batch")
+async def moderate_batch_endpoint(request: BatchModerationRequest):
+    """
+    Moderate nhiều text trong 1 request (vd: bài post + comment).
+    Trả về {"results": [...]} theo đúng thứ tự của "texts".
+    """
+    if len(request.texts) > settings.MODERATION_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MODERATION_BATCH_MAX_ITEMS} texts per batch")
+
+    moderation = await load_module("moderation")
+    results = await moderation.moderate_batch(request.texts)
+    return {"results": results}
@@ -0,0 +1,241 @@
+import contextvars
+import json
+import random
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from src.config.env import settings
+
+# Bucket (giây) cho latency: từ tra cache (ms) tới Agent nhiều bước (chục giây)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_format_labels(key)} {value:g}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List[float]] = {}  # key -> [count từng bucket..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip((*self.buckets, "+Inf"), series[:-1]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else f"{bound:g}"
+                    yield f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative:g}"
+                yield f"{self.name}_sum{_format_labels(key)} {series[-1]:.6f}"
+                yield f"{self.name}_count{_format_labels(key)} {cumulative:g}"
+
+stage_duration = Histogram("lingora_stage_duration_seconds", "Latency of each pipeline stage")
+stage_errors = Counter("lingora_stage_errors_total", "Errors raised inside each pipeline stage")
+llm_duration = Histogram("lingora_llm_request_duration_seconds", "Latency of LLM calls by model")
+llm_tokens = Counter("lingora_llm_tokens_total", "Prompt/completion tokens reported by the LLM")
+llm_errors = Counter("lingora_llm_errors_total", "Failed LLM calls by model")
+
+# Số liệu lấy lúc scrape từ các module có sẵn stats() (cache, moderation...)
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+def register_collector(collector: Callable[[], Iterable[str]]):
+    _collectors.append(collector)
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in (stage_duration, stage_errors, llm_duration, llm_tokens, llm_errors):
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    return "\n".join(lines) + "\n"
+
+def counter_lines(name: str, help: str, values: Dict[Tuple[Tuple[str, str], ...], float]) -> Iterable[str]:
+    """Dựng 1 counter từ số liệu có sẵn (vd: hits/misses trong stats() của cache)."""
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} counter"
+    for labels, value in values.items():
+        yield f"{name}{_format_labels(labels)} {value:g}"
+
+# --- Trace có lấy mẫu: thay cho verbose=True / print(result) của Agent ---
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+
+    def add_span(self, stage: str, started: float, seconds: float, error: Optional[str] = None, **attributes):
+        span = {"stage": stage, "start_ms": round((started - self.started) * 1000, 1), "ms": round(seconds * 1000, 1)}
+        if error:
+            span["error"] = error
+        span.update(attributes)
+        self.spans.append(span)
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("lingora_trace", default=None)
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Lấy mẫu TRACE_SAMPLE_RATE request; request được chọn in 1 dòng JSON gồm mọi stage bên trong."""
+    if random.random() >= settings.TRACE_SAMPLE_RATE:
+        yield None
+        return
+
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        print("🔎 trace " + json.dumps({
+            "trace_id": current.trace_id,
+            "name": current.name,
+            "ms": round((time.perf_counter() - current.started) * 1000, 1),
+            **current.attributes,
+            "spans": current.spans,
+        }, ensure_ascii=False, default=str))
+
+@contextmanager
+def track(stage: str, **attributes):
+    """
+    Đo 1 stage: latency vào histogram, lỗi vào counter, và thành 1 span nếu request đang được trace.
+    Ví dụ: with track("vector_retrieval", collection="grammar"): ...
+    (Dùng được cả trong hàm async vì chỉ đo thời gian, không await.)
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        stage_duration.observe(seconds, stage=stage)
+        if error:
+            stage_errors.inc(stage=stage, error=error)
+        current = _current_trace.get()
+        if current is not None:
+            current.add_span(stage, started, seconds, error, **attributes)
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Gắn vào ChatOpenAI / tools (src/clients.py, src/rag.py):
+    đo latency + token của mỗi lần gọi LLM, và latency của mỗi lần Agent gọi tool.
+    """
+
+    run_inline = True  # chỉ ghi số liệu, chạy thẳng trên event loop thay vì đẩy sang thread
+
+    def __init__(self):
+        self._runs: Dict[Any, Tuple[float, str]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, invocation_params=None, **kwargs):
+        model = (invocation_params or {}).get("model") or (invocation_params or {}).get("model_name") or "unknown"
+        self._runs[run_id] = (time.perf_counter(), model)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, model = self._runs.pop(run_id, (None, "unknown"))
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        llm_duration.observe(seconds, model=model)
+
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if prompt_tokens:
+            llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+        if completion_tokens:
+            llm_tokens.inc(completion_tokens, model=model, type="completion")
+
+        current = _current_trace.get()
+        if current is not None:
+            current.add_span("llm", started, seconds, model=model,
+                             prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started, model = self._runs.pop(run_id, (None, "unknown"))
+        llm_errors.inc(model=model, error=type(error).__name__)
+        current = _current_trace.get()
+        if started is not None and current is not None:
+            current.add_span("llm", started, time.perf_counter() - started, type(error).__name__, model=model)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._runs[run_id] = (time.perf_counter(), (serialized or {}).get("name") or kwargs.get("name") or "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish_tool(run_id, None)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish_tool(run_id, type(error).__name__)
+
+    def _finish_tool(self, run_id, error: Optional[str]):
+        started, name = self._runs.pop(run_id, (None, "tool"))
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        stage_duration.observe(seconds, stage=f"tool:{name}")
+        if error:
+            stage_errors.inc(stage=f"tool:{name}", error=error)
+        current = _current_trace.get()
+        if current is not None:
+            current.add_span(f"tool:{name}", started, seconds, error)
+
+def _token_usage(response) -> Tuple[int, int]:
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+    # Streaming / bản mới: usage nằm trên message (usage_metadata)
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += int(metadata.get("input_tokens") or 0)
+            completion_tokens += int(metadata.get("output_tokens") or 0)
+    return prompt_tokens, completion_tokens
+
+metrics_callback = MetricsCallbackHandler()
@@ -0,0 +1,60 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Tuple
+from pypdf import PdfReader
+from langchain_core.documents import Document
+
+def _extract_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str, str]]:
+    """Chạy trong process con: mỗi task tự mở PDF và chỉ đọc các trang [start, end)."""
+    reader = PdfReader(file_path)
+    pages = []
+    for page_number in range(start, end):
+        # Giống PyPDFLoader (mode="page") để hash chunk không đổi so với các lần ingest trước
+        text = reader.pages[page_number].extract_text(extraction_mode="plain").strip()
+        pages.append((page_number, text, reader.page_labels[page_number]))
+    return pages
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+async def aiter_pdf_pages(file_path: str, max_workers: int, pages_per_task: int) -> AsyncIterator[Document]:
+    """
+    Đọc PDF song song trên nhiều process, trả từng trang theo đúng thứ tự ngay khi có.
+    Chỉ giữ tối đa 2 * max_workers task trong hàng đợi -> bộ nhớ không phụ thuộc độ dày cuốn sách.
+    """
+    total_pages = len(PdfReader(file_path).pages)
+    max_workers = max(1, min(max_workers or default_workers(), total_pages or 1))
+    pages_per_task = max(1, pages_per_task)
+    ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+
+    loop = asyncio.get_running_loop()
+    # spawn: process con không thừa hưởng thread của Chroma / event loop như khi fork
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        window = 2 * max_workers
+        futures = [loop.run_in_executor(pool, _extract_page_range, file_path, *page_range) for page_range in ranges[:window]]
+        next_range = len(futures)
+
+        try:
+            for i in range(len(ranges)):
+                pages = await futures[i]
+                futures[i] = None  # nhả kết quả đã dùng
+                if next_range < len(ranges):
+                    futures.append(loop.run_in_executor(pool, _extract_page_range, file_path, *ranges[next_range]))
+                    next_range += 1
+
+                for page_number, text, page_label in pages:
+                    yield Document(
+                        page_content=text,
+                        metadata={
+                            "source": file_path,
+                            "total_pages": total_pages,
+                            "page": page_number,
+                            "page_label": page_label,
+                        },
+                    )
+        finally:
+            for future in futures:
+                if future is not None:
+                    future.cancel()
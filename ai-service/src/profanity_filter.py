@@ -0,0 +1,172 @@
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Chửi thề / xúc phạm rõ ràng -> chặn luôn, không cần hỏi LLM
+SEVERE_TERMS = [
+    # Tiếng Việt (gồm danh sách BAD_WORDS bên Express: src/utils/moderation.ts)
+    "đmm", "đm", "dmm", "vcl", "vkl", "đéo", "óc chó", "ngu lol", "ngu lồn",
+    "lồn", "vãi lồn", "địt", "đụ", "đĩ", "cặc", "buồi", "đcm", "dcm", "dcmm", "clm", "cmm",
+    "chết đi", "giết mày",
+    # English
+    "fuck", "fucking", "fucker", "motherfucker", "fck", "fuk", "fack", "fock", "fcuk", "phuck", "shit", "shitty", "bullshit", "bitch", "cunt", "asshole",
+    "dickhead", "nigger", "nigga", "faggot", "kys", "kill yourself",
+]
+
+# Tuỳ ngữ cảnh ("con chó" = con vật, "điên" = quá trời...) -> để LLM quyết định.
+# Gồm cả từ không dấu trùng với từ bình thường: "ngu" ("đi ngủ" gõ không dấu), "cc" (cc email), "vl"...
+MILD_TERMS = ["ngu", "cc", "vl", "dm", "chó", "cút", "khùng", "điên", "damn", "stupid", "idiot", "retard"]
+
+# Text chỉ gồm các từ này (+ số, dấu câu, emoji) mới được coi là an toàn mà không cần hỏi LLM.
+# Lexicon chỉ chứng minh được text KHÔNG an toàn ("go die", "kill u" không chứa từ chửi nào).
+SAFE_WORDS = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "thx", "ok", "okay", "yes", "yeah", "no", "bye",
+    "good", "morning", "afternoon", "evening", "night", "please", "sorry",
+    "xin", "chào", "chao", "cảm", "cám", "ơn", "cam", "on", "dạ", "vâng", "ừ", "uh", "ạ", "nhé",
+    "có", "không", "tạm", "biệt", "bạn", "em", "anh", "chị", "thầy", "cô",
+}
+
+LEET_MAP = str.maketrans({
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t",
+    "@": "a", "$": "s", "!": "i", "|": "l",
+})
+
+_SEPARATOR_INSIDE_WORD = re.compile(r"(?<=\w)[.\-_*'`~@$!|]+(?=\w)")
+_REPEATED_CHAR = re.compile(r"(.)\1{2,}")
+_LEET_TOKEN = re.compile(r"[\w.\-_*'`~@$!|]+")
+_WORD = re.compile(r"\w+")
+
+def _fold_leet(token: str) -> str:
+    # Chỉ đổi trong cụm có chữ cái, để "ngày 15" không thành "ngày is"; số ở đầu giữ nguyên ("15h", "2nd").
+    # "!" / "|" ở đầu, ký hiệu ở cuối là dấu câu ("fuck!" không thành "fucki")
+    if not any(char.isalpha() for char in token):
+        return token
+    body = token.rstrip("@$!|.-_*'`~")
+    head = len(body) - len(body.lstrip("!|0123456789"))
+    return body[:head] + body[head:].translate(LEET_MAP) + token[len(body):]
+
+def normalize(text: str) -> str:
+    """
+    Chuẩn hoá giữ nguyên dấu tiếng Việt: chữ thường, leetspeak (f0ck -> fock, f@ck -> fack, $hit -> shit),
+    bỏ ký tự chen giữa chữ (n.g.u -> ngu), ký tự lặp >= 3 lần (nguuuu -> ngu), gộp khoảng trắng.
+    """
+    text = unicodedata.normalize("NFC", text).casefold()
+    # Đổi leet trước khi bỏ ký tự chen giữa chữ, không thì "sh!t" mất "!" thành "sht"
+    text = _LEET_TOKEN.sub(lambda m: _fold_leet(m.group(0)), text)
+    text = _SEPARATOR_INSIDE_WORD.sub("", text)
+    text = _REPEATED_CHAR.sub(r"\1", text)
+    return " ".join(text.split())
+
+def strip_diacritics(text: str) -> str:
+    """Bỏ dấu từng ký tự (giữ nguyên độ dài chuỗi để vị trí match 2 bản trùng nhau): "đéo" -> "deo"."""
+    return "".join("d" if char == "đ" else unicodedata.normalize("NFD", char)[0] for char in text)
+
+class AhoCorasick:
+    """Matcher nhiều pattern cùng lúc, 1 lần quét O(độ dài text + số match)."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]  # (độ dài pattern, value)
+
+        for pattern, value in patterns:
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._out[node].append((len(pattern), value))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0) if node else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def finditer(self, text: str):
+        """Trả về (start, end, value) cho mọi pattern xuất hiện trong text."""
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._out[node]:
+                yield i - length + 1, i + 1, value
+
+def _is_word_boundary(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not before.isalnum() and not after.isalnum()
+
+@dataclass
+class PrefilterDecision:
+    verdict: str  # "unsafe" | "safe" | "ambiguous"
+    detected_word: str = ""
+
+class ProfanityFilter:
+    """
+    Tầng lọc cục bộ trước LLM:
+    - Bản giữ dấu: khớp đúng từ chửi (có dấu hoặc không dấu) -> "unsafe" nếu là từ nặng, "ambiguous" nếu nhẹ.
+    - Bản bỏ dấu: chỉ dùng cho từ có dấu bị gõ không dấu ("deo" có thể là "đéo" hoặc "đeo") -> "ambiguous".
+      Từ gõ có dấu khác đi ("ngủ", "chó" -> "cho") không bao giờ bị coi là từ chửi.
+    - Không khớp gì, rất ngắn và chỉ gồm từ trong allowlist (chào hỏi, cảm ơn, số, emoji) -> "safe".
+      Còn lại -> "ambiguous" (để LLM quyết định).
+    """
+
+    def __init__(self, severe_terms: List[str], mild_terms: List[str], fast_safe_max_words: int, fast_safe_max_chars: int,
+                 safe_words: Iterable[str] = SAFE_WORDS):
+        self.fast_safe_max_words = fast_safe_max_words
+        self.fast_safe_max_chars = fast_safe_max_chars
+        self.safe_words = {normalize(word) for word in safe_words}
+
+        exact, loose = {}, {}
+        for severity, terms in (("mild", mild_terms), ("severe", severe_terms)):
+            for term in terms:
+                folded = normalize(term)
+                exact[folded] = (severity, term)
+                stripped = strip_diacritics(folded)
+                # Bản không dấu chỉ cho từ nặng và đủ dài ("cho" = chó không dấu thì quá phổ biến)
+                if severity == "severe" and stripped != folded and len(stripped.replace(" ", "")) >= 3:
+                    loose.setdefault(stripped, ("mild", term))
+        self._exact = AhoCorasick(exact.items())
+        self._loose = AhoCorasick(loose.items())
+
+    def _matches(self, matcher: AhoCorasick, text: str):
+        for start, end, value in matcher.finditer(text):
+            if _is_word_boundary(text, start, end):
+                yield start, end, value
+
+    def check(self, text: str) -> PrefilterDecision:
+        folded = normalize(text)
+        ambiguous: Optional[str] = None
+
+        for _, _, (severity, term) in self._matches(self._exact, folded):
+            if severity == "severe":
+                return PrefilterDecision("unsafe", term)
+            ambiguous = ambiguous or term
+
+        stripped = strip_diacritics(folded)
+        for start, end, (_, term) in self._matches(self._loose, stripped):
+            # Chỉ tính khi người dùng gõ không dấu; gõ có dấu khác (vd "đeo") là từ khác hẳn
+            if folded[start:end] == stripped[start:end]:
+                ambiguous = ambiguous or term
+
+        if ambiguous:
+            return PrefilterDecision("ambiguous", ambiguous)
+        # Đo độ dài trên text gốc: "xxxxxxxx..." bị gộp ký tự lặp nhưng vẫn là text dài
+        raw = text.strip()
+        if raw and len(raw) <= self.fast_safe_max_chars and len(raw.split()) <= self.fast_safe_max_words:
+            words = [word for word in _WORD.findall(folded) if not word.isdigit()]
+            if all(word in self.safe_words for word in words):
+                return PrefilterDecision("safe")
+        return PrefilterDecision("ambiguous")
@@ -1,61 +1,83 @@
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_chroma import Chroma
-from langchain_tavily import TavilySearch
 from langchain_core.tools import tool
 from langchain_classic.agents import create_openai_tools_agent, AgentExecutor
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.documents import Document
 from langchain_core.globals import set_llm_cache
-from langchain_community.cache import InMemoryCache
+from langchain_core.caches import InMemoryCache
 from src.config.env import settings
-from typing import Any, Iterable, Optional, Sequence
-import os
+from src.clients import get_chat_model, get_embeddings, tavily_search
+from src.metrics import counter_lines, metrics_callback, register_collector, trace, track
+from src.concurrency import stream_in_slot, upstream_slot
+from src.semantic_cache import answer_cache
+from src.result_cache import make_key, result_cache
+from src.history_store import create_history_store
+from src.embedding_cache import CachedEmbeddings, DiskEmbeddingStore
+from src.router import QueryRouter
+from src.retrieval import search_collections
+from src.vector_index import load_vector_index
+from src.context import RAG_SYSTEM_PROMPT, build_user_turn, context_assembler
+from src.lexical_index import load_lexical_index, is_confident, fuse_rrf
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
 
 # --- 1. CẤU HÌNH CƠ BẢN ---
-# Setup Tavily Key
-os.environ["TAVILY_API_KEY"] = settings.TAVILY_API_KEY
-
-set_llm_cache(InMemoryCache())
-
-# Setup Embeddings
-embedding_model = OpenAIEmbeddings(
-    openai_api_key=settings.OPENAI_API_KEY,
-    model="text-embedding-3-small" 
+# Giới hạn kích thước để cache không phình vô hạn (semantic cache nằm ở src/semantic_cache.py)
+set_llm_cache(InMemoryCache(maxsize=settings.LLM_CACHE_MAX_ENTRIES))
+
+# Setup Embeddings (bọc cache: câu hỏi lặp lại không phải gọi OpenAI lần nữa)
+embedding_model = CachedEmbeddings(
+    get_embeddings(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS),
+    model_name=settings.EMBEDDING_MODEL_ID,
+    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+    disk_store=DiskEmbeddingStore(settings.EMBEDDING_CACHE_DB_PATH) if settings.EMBEDDING_CACHE_DISK_ENABLED else None,
 )
 
-# NEW: create Chroma stores & retrievers once and reuse
-grammar_vector_store = Chroma(
-    persist_directory=settings.CHROMA_DB_DIR,
-    embedding_function=embedding_model,
-    collection_name="grammar_collection",
-)
-grammar_retriever = grammar_vector_store.as_retriever(search_kwargs={"k": 4})
+COLLECTIONS = {"grammar": "grammar_collection", "vocab": "vocab_collection"}
+
+def _open_vector_store(collection_name: str):
+    """Index mmap export lúc ingest (src/vector_index.py); chưa có / VECTOR_BACKEND=chroma -> ChromaDB."""
+    if settings.VECTOR_BACKEND == "mmap":
+        index = load_vector_index(collection_name)
+        if index is not None:
+            print(f"🗂️  {collection_name}: vector index mmap ({index.count} chunks, {index.dimensions} chiều)")
+            return index
+    return Chroma(
+        persist_directory=settings.CHROMA_DB_DIR,
+        embedding_function=embedding_model,
+        collection_name=collection_name,
+    )
 
-vocab_vector_store = Chroma(
-    persist_directory=settings.CHROMA_DB_DIR,
-    embedding_function=embedding_model,
-    collection_name="vocab_collection",
+# Mở 1 lần và dùng lại cho mọi request (search bằng vector có sẵn, cả retrieval đồng thời ở src/retrieval.py)
+book_stores = {name: _open_vector_store(collection_name) for name, collection_name in COLLECTIONS.items()}
+
+# BM25 build lúc ingest (src/lexical_index.py); thiếu file thì chỉ dùng vector search
+lexical_indexes = {}
+if settings.LEXICAL_ENABLED:
+    for name, collection_name in COLLECTIONS.items():
+        index = load_lexical_index(collection_name)
+        if index is not None:
+            lexical_indexes[name] = index
+
+# Header/footer lặp lại trên nhiều trang sách -> bỏ khỏi context (học từ chunk trong BM25 index)
+context_assembler.learn_boilerplate(doc for index in lexical_indexes.values() for doc in index.docs)
+
+# Router cục bộ cho câu hỏi không có type (tránh phải gọi Agent 2 lần LLM)
+query_router = QueryRouter(
+    embeddings=embedding_model,
+    collection_stores=book_stores,
+    min_score=settings.ROUTER_MIN_SCORE,
+    min_margin=settings.ROUTER_MIN_MARGIN,
 )
-vocab_retriever = vocab_vector_store.as_retriever(search_kwargs={"k": 4})
 
-# Setup LLM (OpenAI)
-llm = ChatOpenAI(
-    model="gpt-4.1-nano",
-    openai_api_key=settings.OPENAI_API_KEY,
-    temperature=0 # Để Agent ra quyết định chính xác, nên để temp thấp
-)
+# Setup LLM (OpenAI) - client lấy từ registry (src/clients.py): pool kết nối, rate limit, retry dùng chung
+llm = get_chat_model("gpt-4.1-nano", temperature=0) # Để Agent ra quyết định chính xác, nên để temp thấp
 
 # --- 2. BỘ NHỚ (MEMORY) ---
-# Vẫn dùng cách lưu dictionary đơn giản của bạn, nhưng tí nữa sẽ convert
-CHAT_HISTORY = {}
-
-def get_chat_history(session_id):
-    return CHAT_HISTORY.get(session_id, [])
-
-def save_chat_history(session_id, question, answer):
-    if session_id not in CHAT_HISTORY: CHAT_HISTORY[session_id] = []
-    CHAT_HISTORY[session_id].append((question, answer))
-    if len(CHAT_HISTORY[session_id]) > 10: CHAT_HISTORY[session_id].pop(0)
+# Backend chọn qua HISTORY_BACKEND (memory: LRU + TTL, sqlite: dùng chung giữa các worker)
+history_store = create_history_store()
 
 def build_langchain_history(history_payload: Optional[Iterable[Any]], session_id: str):
     lc_history = []
@@ -81,60 +103,162 @@ def build_langchain_history(history_payload: Optional[Iterable[Any]], session_id
                 lc_history.append(AIMessage(content=content))
 
     else:
-        raw_history = get_chat_history(session_id)
+        raw_history = history_store.get(session_id)
         for q, a in raw_history:
             lc_history.append(HumanMessage(content=q))
             lc_history.append(AIMessage(content=a))
 
     return lc_history[-6:]
 
-# --- 3. ĐỊNH NGHĨA CÔNG CỤ (TOOLS) ---
+# --- 3. RETRIEVAL (BM25 + VECTOR) ---
+LexicalResult = Tuple[List[Tuple[Document, float]], bool]
+
+def _lexical_search(name: str, question: str, k: int) -> LexicalResult:
+    """Trả về (hits BM25, có đủ chắc chắn để bỏ qua embedding hay không)."""
+    index = lexical_indexes.get(name)
+    if index is None:
+        return [], False
+    with track("lexical_search", collection=name):
+        hits = index.search(question, k)
+    return hits, is_confident(index, question, hits)
+
+async def _retrieve_collection_docs(
+    name: str,
+    question: str,
+    query_vector: Optional[List[float]] = None,
+    lexical: Optional[LexicalResult] = None,
+) -> List[Document]:
+    """lexical: kết quả BM25 đã tính ở bước lập kế hoạch (k >= RETRIEVAL_K) -> không search lại."""
+    k = settings.RETRIEVAL_K
+
+    lexical_hits, confident = lexical if lexical is not None else _lexical_search(name, question, k)
+    lexical_docs = [doc for doc, _ in lexical_hits[:k]]
+    if confident and query_vector is None:
+        # Tra đúng thuật ngữ (idiom, phrasal verb, tên thì...) -> không cần gọi OpenAI embedding
+        return lexical_docs
+
+    if query_vector is None:
+        query_vector = await _embed_query(question)
+    # Đã có embedding (từ bước semantic cache / router) -> search thẳng bằng vector, không embed lại
+    with track("vector_retrieval", collection=name):
+        docs = await book_stores[name].asimilarity_search_by_vector(query_vector, k=k)
+
+    return fuse_rrf([docs, lexical_docs], k) if lexical_docs else docs
+
+def _assemble(docs: List[Document]) -> str:
+    """Chunk đã xếp hạng -> khối context gọn (bỏ phần trùng overlap, header/footer, cắt theo CONTEXT_MAX_TOKENS)."""
+    with track("context_assembly"):
+        return context_assembler.assemble(docs).text
+
+# --- 4. ĐỊNH NGHĨA CÔNG CỤ (TOOLS) ---
 # Agent sẽ nhìn vào docstring ("""...""") để biết khi nào dùng tool nào.
 
 @tool
-def lookup_grammar_book(query: str):
+async def lookup_grammar_book(query: str):
     """
     Dùng công cụ này để tra cứu kiến thức về Ngữ pháp Tiếng Anh (Grammar), 
     cấu trúc câu (Sentence Structure), các thì (Tenses) trong sách giáo khoa.
     """
     print(f"📘 [Tool] Đang tra sách Ngữ pháp: {query}")
     try:
-        # dùng retriever tái sử dụng, không tạo lại Chroma mỗi lần
-        docs = grammar_retriever.invoke(query)
-        return "\n\n".join([doc.page_content for doc in docs])
+        # dùng vector store tái sử dụng, không mở lại index mỗi lần
+        docs = await _retrieve_collection_docs("grammar", query)
+        return _assemble(docs)
     except Exception as e:
         print(f"❌ Lỗi khi tra sách Ngữ pháp: {e}")
         return "Sách giáo khoa không đề cập chi tiết. Hãy sử dụng kiến thức chuyên môn của bạn để giải thích đầy đủ cho học viên."
 
 @tool
-def lookup_vocab_book(query: str):
+async def lookup_vocab_book(query: str):
     """
     Dùng công cụ này để tra cứu Từ vựng (Vocabulary), định nghĩa từ (Definition),
     thành ngữ (Idioms) hoặc cụm từ trong sách giáo khoa.
     """
     print(f"📗 [Tool] Đang tra sách Từ vựng: {query}")
     try:
-        docs = vocab_retriever.invoke(query)
-        return "\n\n".join([doc.page_content for doc in docs])
+        docs = await _retrieve_collection_docs("vocab", query)
+        return _assemble(docs)
     except Exception as e:
         print(f"❌ Lỗi khi tra sách Từ vựng: {e}")
         return "Sách giáo khoa không đề cập chi tiết. Hãy sử dụng kiến thức chuyên môn của bạn để giải thích đầy đủ cho học viên."
 
+async def _search_books(
+    query: str,
+    query_vector: Optional[List[float]] = None,
+    lexical: Optional[Dict[str, LexicalResult]] = None,
+) -> str:
+    """
+    Embed câu hỏi 1 lần rồi search đồng thời cả sách Ngữ pháp lẫn Từ vựng, gộp thành 1 khối context.
+    Nếu BM25 đã match chắc chắn thì bỏ qua luôn bước embedding.
+    """
+    k = settings.MULTI_RETRIEVAL_K
+    if lexical is None:
+        lexical = {name: _lexical_search(name, query, k) for name in book_stores}
+    lexical = {name: (hits[:k], ok) for name, (hits, ok) in lexical.items()}
+    confident = [name for name, (hits, ok) in lexical.items() if ok]
+    if confident and query_vector is None:
+        return _assemble(fuse_rrf([[doc for doc, _ in lexical[name][0]] for name in confident], k))
+
+    if query_vector is None:
+        query_vector = await _embed_query(query)
+    with track("vector_retrieval", collection="books"):
+        docs = await search_collections(
+            book_stores,
+            query_vector,
+            k=k,
+            fetch_k=settings.MULTI_RETRIEVAL_FETCH_K,
+            score_threshold=settings.MULTI_RETRIEVAL_SCORE_THRESHOLD,
+            lambda_mult=settings.MULTI_RETRIEVAL_MMR_LAMBDA,
+        )
+    lexical_lists = [[doc for doc, _ in hits] for hits, _ in lexical.values() if hits]
+    if lexical_lists:
+        docs = fuse_rrf([docs, *lexical_lists], k)
+    return _assemble(docs)
+
+@tool
+async def lookup_books(query: str):
+    """
+    Dùng công cụ này khi câu hỏi liên quan tới CẢ Ngữ pháp lẫn Từ vựng, hoặc khi không chắc nên tra sách nào.
+    Tra đồng thời sách Ngữ pháp và sách Từ vựng trong 1 lần.
+    """
+    print(f"📚 [Tool] Đang tra cả 2 sách: {query}")
+    try:
+        return await _search_books(query)
+    except Exception as e:
+        print(f"❌ Lỗi khi tra sách: {e}")
+        return "Sách giáo khoa không đề cập chi tiết. Hãy sử dụng kiến thức chuyên môn của bạn để giải thích đầy đủ cho học viên."
+
 # Tool Search Google (Tavily)
-search_web_tool = TavilySearch(
-    max_results=3,
-    description="Dùng công cụ này để tìm kiếm thông tin KHÔNG có trong sách giáo khoa, kiến thức xã hội, hoặc các từ lóng (slang) mới nhất."
-)
+async def _tavily_search(query: str) -> dict:
+    async with upstream_slot("tavily"):
+        try:
+            with track("web_search"):
+                return await tavily_search(query, max_results=3)
+        except Exception as e:
+            # Giống TavilySearch: trả lỗi cho Agent thay vì làm hỏng cả câu trả lời
+            return {"error": str(e)}
+
+@tool
+async def search_web(query: str):
+    """
+    Dùng công cụ này để tìm kiếm thông tin KHÔNG có trong sách giáo khoa, kiến thức xã hội, hoặc các từ lóng (slang) mới nhất.
+    """
+    print(f"🌐 [Tool] Đang tìm trên web: {query}")
+    # Tavily qua pool kết nối dùng chung, có giới hạn concurrency
+    return await _tavily_search(query)
 
 # Gom tất cả tools lại
-tools = [lookup_grammar_book, lookup_vocab_book, search_web_tool]
+tools = [lookup_books, lookup_grammar_book, lookup_vocab_book, search_web]
+for lingora_tool in tools:
+    lingora_tool.callbacks = [metrics_callback]  # đo latency từng lần Agent gọi tool (/metrics)
 
-# --- 4. TẠO AGENT ---
+# --- 5. TẠO AGENT ---
 def create_lingora_agent():
     # Prompt System cho Agent
     system_prompt = """
     Bạn là LingoraBot - Trợ lý ảo dạy Tiếng Anh.
-    Bạn có 3 công cụ: Sách Ngữ Pháp, Sách Từ Vựng, Google Search.
+    Bạn có 4 công cụ: Tra cả 2 sách, Sách Ngữ Pháp, Sách Từ Vựng, Google Search.
+    Nếu câu hỏi liên quan cả ngữ pháp lẫn từ vựng, hãy dùng công cụ tra cả 2 sách (chỉ 1 lần gọi).
 
     NHIỆM VỤ DUY NHẤT:
     - Xử lý và trả lời câu hỏi MỚI NHẤT của người dùng (nằm trong biến input).
@@ -163,7 +287,7 @@ def create_lingora_agent():
     agent_executor = AgentExecutor(
         agent=agent, 
         tools=tools, 
-        verbose=True, # Bật True để nhìn thấy suy nghĩ của Agent trên terminal
+        # Không bật verbose: các bước của Agent nằm trong trace lấy mẫu (TRACE_SAMPLE_RATE, src/metrics.py)
         handle_parsing_errors=True
     )
     return agent_executor
@@ -171,31 +295,167 @@ def create_lingora_agent():
 # Khởi tạo 1 lần dùng chung
 lingora_agent = create_lingora_agent()
 
-# --- 5. HÀM CHÍNH (ĐƯỢC GỌI TỪ API) ---
-def _simple_rag_answer(question: str, retrieved_text: str) -> str:
+# --- 6. HÀM CHÍNH (ĐƯỢC GỌI TỪ API) ---
+FALLBACK_ANSWER = "Xin lỗi, hệ thống đang gặp chút trục trặc khi suy nghĩ. Bạn hỏi lại thử xem?"
+
+def _build_simple_rag_messages(question: str, retrieved_text: str, chat_history=None):
+    """
+    [system cố định, *lịch sử, tài liệu + câu hỏi]: phần đầu giống hệt nhau giữa các request (và giữa các lượt
+    của cùng 1 session) nên được prompt caching của OpenAI; phần thay đổi luôn nằm cuối.
+    Có lịch sử (câu hỏi nối tiếp) -> đưa kèm để LLM hiểu "nó", "cái đó"... là gì.
+    """
+    return [
+        SystemMessage(content=RAG_SYSTEM_PROMPT),
+        *(chat_history or []),
+        HumanMessage(content=build_user_turn(question, retrieved_text)),
+    ]
+
+async def _simple_rag_answer(question: str, retrieved_text: str, chat_history=None) -> str:
     """
     Gọi LLM 1 lần với context đã retrieve sẵn – nhanh hơn Agent + Tools.
     """
-    prompt = f"""
-    Bạn là LingoraBot - Trợ lý ảo dạy Tiếng Anh.
+    messages = _build_simple_rag_messages(question, retrieved_text, chat_history)
+    async with upstream_slot("openai_chat"):
+        resp = await llm.ainvoke(messages)
+    return getattr(resp, "content", str(resp))
 
-    Đây là tài liệu tham khảo (có thể là trích từ sách hoặc tài liệu liên quan):
+async def _stream_simple_rag_answer(question: str, retrieved_text: str, chat_history=None) -> AsyncIterator[str]:
+    """
+    Giống _simple_rag_answer nhưng trả từng token ngay khi LLM sinh ra.
+    """
+    messages = _build_simple_rag_messages(question, retrieved_text, chat_history)
+    async with aclosing(stream_in_slot("openai_chat", llm.astream(messages))) as chunks:
+        async for chunk in chunks:
+            text = _output_to_text(chunk.content)
+            if text:
+                yield text
+
+def _get_fast_path(type: Optional[str]) -> Optional[str]:
+    """
+    Trả về tên route ("grammar" / "vocab" / "books") nếu type cho phép đi fast-path, ngược lại None.
+    """
+    normalized_type = (type or "").lower().strip()
 
-    ----------
-    {retrieved_text}
-    ----------
+    if normalized_type in {"grammar", "nguphap"}:
+        return "grammar"
 
-    Nhiệm vụ:
-    - Trả lời CÂU HỎI của học viên bên dưới một cách ngắn gọn, dễ hiểu.
-    - Nếu tài liệu không đủ, dùng kiến thức của bạn để giải thích, nhưng KHÔNG nói rằng tài liệu thiếu.
+    if normalized_type in {"vocab", "vocabulary", "tuvung"}:
+        return "vocab"
 
-    CÂU HỎI: {question}
+    if normalized_type in {"books", "book", "sach"}:
+        return "books"
+
+    return None
+
+
+async def _search_web_context(question: str) -> str:
+    result = await _tavily_search(question)
+
+    if isinstance(result, dict):
+        return _assemble([
+            Document(page_content=item.get("content", ""), metadata={"source": item.get("url")})
+            for item in result.get("results", [])
+        ])
+    return str(result)
+
+async def _build_context(
+    route: Optional[str],
+    question: str,
+    query_vector: Optional[List[float]] = None,
+    lexical: Optional[Dict[str, LexicalResult]] = None,
+) -> str:
+    if route in book_stores:
+        return _assemble(await _retrieve_collection_docs(route, question, query_vector, (lexical or {}).get(route)))
+    if route == "books":
+        return await _search_books(question, query_vector, lexical)
+    if route == "web":
+        return await _search_web_context(question)
+    # general (chào hỏi, hỏi chung chung): không cần tài liệu
+    return ""
+
+async def _embed_query(question: str) -> List[float]:
+    async with upstream_slot("openai_embedding"):
+        with track("embed_query"):
+            return await embedding_model.aembed_query(question)
+
+@dataclass
+class _AnswerPlan:
+    route: Optional[str]  # None -> Agent
+    namespace: str  # namespace trong semantic cache
+    cacheable: bool
+    cached_answer: Optional[str] = None
+    query_vector: Optional[List[float]] = None
+    lexical: Optional[Dict[str, LexicalResult]] = None  # hits BM25 của từng sách, dùng lại lúc retrieval
+
+async def _plan_answer(question: str, type: Optional[str], lc_history) -> _AnswerPlan:
     """
-    resp = llm.invoke(prompt)
-    return getattr(resp, "content", str(resp))
+    Quyết định cách trả lời trước khi gọi LLM:
+    1. Semantic cache (chỉ khi không có lịch sử chat, vì câu hỏi nối tiếp phụ thuộc ngữ cảnh).
+    2. type do client gửi lên -> fast-path.
+    3. Không có type, BM25 match chắc chắn trong sách (LEXICAL_ROUTING_ENABLED) -> fast-path sách đó,
+       không cần router; chưa embed (có lịch sử chat) thì retrieval cũng bỏ qua luôn embedding.
+    4. Còn lại -> router cục bộ; chỉ câu hỏi mơ hồ mới phải đi Agent.
+    """
+    route = _get_fast_path(type)
+    plan = _AnswerPlan(
+        route=route,
+        namespace=route or "agent",
+        cacheable=settings.SEMANTIC_CACHE_ENABLED and not lc_history,
+    )
 
+    if plan.cacheable:
+        try:
+            plan.query_vector = await _embed_query(question)
+        except Exception as e:
+            # Embedding lỗi -> bỏ qua semantic cache, vẫn trả lời bình thường
+            print(f"⚠️  Không embed được câu hỏi, bỏ qua semantic cache: {e}")
+            plan.cacheable = False
+        else:
+            plan.cached_answer = answer_cache.lookup(plan.namespace, plan.query_vector)
+            if plan.cached_answer is not None:
+                return plan
+
+    if route is None and settings.LEXICAL_ROUTING_ENABLED:
+        # k đủ cho cả 2 kiểu retrieval -> fast-path dùng lại hits, không chạy BM25 lần 2
+        k = max(settings.RETRIEVAL_K, settings.MULTI_RETRIEVAL_K)
+        plan.lexical = {name: _lexical_search(name, question, k) for name in book_stores}
+        lexical_routes = [name for name, (_, confident) in plan.lexical.items() if confident]
+        if lexical_routes:
+            plan.route = lexical_routes[0] if len(lexical_routes) == 1 else "books"
+            print(f"🔤 Lexical match: {', '.join(lexical_routes)}")
+            return plan
+
+    if route is None and settings.ROUTER_ENABLED:
+        try:
+            if plan.query_vector is None:
+                plan.query_vector = await _embed_query(question)
+            decision = await query_router.route(plan.query_vector)
+        except Exception as e:
+            # Router là tối ưu hoá: lỗi embedding / centroid thì để Agent tự chọn tool như trước
+            print(f"⚠️  Router lỗi, chuyển cho Agent: {e}")
+            plan.route = None
+        else:
+            print(f"🧭 Router: {decision.route or 'agent'} (score={decision.score:.3f}, margin={decision.margin:.3f})")
+            plan.route = decision.route
+
+    return plan
+
+def _output_to_text(raw_output) -> str:
+    if isinstance(raw_output, str):
+        return raw_output
+
+    if isinstance(raw_output, list):
+        text = ""
+        for part in raw_output:
+            if isinstance(part, str):
+                text += part
+            elif isinstance(part, dict) and "text" in part:
+                text += part["text"]
+        return text
 
-def get_answer(
+    return str(raw_output)
+
+async def get_answer(
     question: str,
     type: str = None,
     session_id: str = "default",
@@ -205,61 +465,125 @@ def get_answer(
 
     print(f"🤖 Agent đang suy nghĩ cho session: {session_id}...; có history: {len(lc_history)}")
 
-    # --- FAST PATHS: không dùng Agent đầy đủ khi không cần ---
     try:
-        normalized_type = (type or "").lower().strip()
-
-        if normalized_type in {"grammar", "nguphap"}:
-            print("⚡ Fast-path: grammar RAG")
-            docs = grammar_retriever.invoke(question)
-            context = "\n\n".join(doc.page_content for doc in docs)
-            answer = _simple_rag_answer(question, context)
-            if history is None:
-                save_chat_history(session_id, question, answer)
-            return answer
-
-        if normalized_type in {"vocab", "vocabulary", "tuvung"}:
-            print("⚡ Fast-path: vocab RAG")
-            docs = vocab_retriever.invoke(question)
-            context = "\n\n".join(doc.page_content for doc in docs)
-            answer = _simple_rag_answer(question, context)
-            if history is None:
-                save_chat_history(session_id, question, answer)
-            return answer
-
-        # --- FALLBACK: dùng Agent đầy đủ như hiện tại ---
-        print(f"question: {question}")
-        result = lingora_agent.invoke(
-            {
-                "input": question,
-                "chat_history": lc_history,
-            }
-        )
-        print(f"result: {result}")
-        raw_output = result["output"]
-        final_response = ""
-
-        if isinstance(raw_output, str):
-            final_response = raw_output
-        elif isinstance(raw_output, list):
-            for part in raw_output:
-                if isinstance(part, str):
-                    final_response += part
-                elif isinstance(part, dict) and "text" in part:
-                    final_response += part["text"]
-        else:
-            final_response = str(raw_output)
+        with trace("chat", session_id=session_id, type=type, history=len(lc_history)) as current_trace:
+            with track("plan"):
+                plan = await _plan_answer(question, type, lc_history)
+
+            if plan.cached_answer is not None:
+                print(f"💾 Semantic cache hit: {plan.namespace}")
+                final_response = plan.cached_answer
+
+            # --- FAST PATHS: không dùng Agent đầy đủ khi không cần ---
+            elif plan.route:
+                print(f"⚡ Fast-path: {plan.route}")
+                with track("fast_path", route=plan.route):
+                    context = await _build_context(plan.route, question, plan.query_vector, plan.lexical)
+                    final_response = await _simple_rag_answer(question, context, lc_history)
+
+            # --- FALLBACK: dùng Agent đầy đủ như hiện tại ---
+            else:
+                async with upstream_slot("agent"):
+                    with track("agent"):
+                        result = await lingora_agent.ainvoke(
+                            {
+                                "input": question,
+                                "chat_history": lc_history,
+                            }
+                        )
+                final_response = _output_to_text(result["output"])
+
+            if current_trace is not None:
+                current_trace.attributes["path"] = "cache" if plan.cached_answer is not None else (plan.route or "agent")
+
+        if plan.cached_answer is None and plan.cacheable and final_response:
+            answer_cache.store(plan.namespace, plan.query_vector, final_response)
 
         if history is None:
-            save_chat_history(session_id, question, final_response)
+            history_store.append(session_id, question, final_response)
 
         return final_response
 
     except Exception as e:
         print(f"❌ Agent Error: {e}")
-        return "Xin lỗi, hệ thống đang gặp chút trục trặc khi suy nghĩ. Bạn hỏi lại thử xem?"
+        return FALLBACK_ANSWER
 
-def generate_chat_title(question: str):
+async def stream_answer(
+    question: str,
+    type: str = None,
+    session_id: str = "default",
+    history: Optional[Sequence[dict]] = None,
+) -> AsyncIterator[dict]:
+    """
+    Phiên bản streaming của get_answer.
+    Yield {"event": "token", "data": {"content": ...}} cho từng token,
+    cuối cùng yield {"event": "done", "data": {"answer": <câu trả lời đầy đủ>}}.
+    """
+    lc_history = build_langchain_history(history, session_id)
+
+    print(f"🤖 Agent đang suy nghĩ (stream) cho session: {session_id}...; có history: {len(lc_history)}")
+
+    parts = []
+    final_response = None
+    try:
+        with trace("chat_stream", session_id=session_id, type=type, history=len(lc_history)) as current_trace:
+            with track("plan"):
+                plan = await _plan_answer(question, type, lc_history)
+
+            if plan.cached_answer is not None:
+                print(f"💾 Semantic cache hit (stream): {plan.namespace}")
+                final_response = plan.cached_answer
+                yield {"event": "token", "data": {"content": final_response}}
+            elif plan.route:
+                print(f"⚡ Fast-path (stream): {plan.route}")
+                with track("fast_path", route=plan.route):
+                    context = await _build_context(plan.route, question, plan.query_vector, plan.lexical)
+                    async with aclosing(_stream_simple_rag_answer(question, context, lc_history)) as tokens:
+                        async for token in tokens:
+                            parts.append(token)
+                            yield {"event": "token", "data": {"content": token}}
+            else:
+                # Agent: chỉ stream token của câu trả lời; các bước gọi tool không có content
+                events = lingora_agent.astream_events(
+                    {
+                        "input": question,
+                        "chat_history": lc_history,
+                    },
+                    version="v2",
+                )
+                with track("agent"):
+                    async with aclosing(stream_in_slot("agent", events)) as events:
+                        async for event in events:
+                            kind = event["event"]
+                            if kind == "on_chat_model_stream":
+                                token = _output_to_text(event["data"]["chunk"].content)
+                                if token:
+                                    parts.append(token)
+                                    yield {"event": "token", "data": {"content": token}}
+                            elif kind == "on_chain_end" and event["name"] == lingora_agent.get_name():
+                                output = event["data"].get("output") or {}
+                                if "output" in output:
+                                    final_response = _output_to_text(output["output"])
+
+            if current_trace is not None:
+                current_trace.attributes["path"] = "cache" if plan.cached_answer is not None else (plan.route or "agent")
+
+        if final_response is None:
+            final_response = "".join(parts)
+
+        if plan.cached_answer is None and plan.cacheable and final_response:
+            answer_cache.store(plan.namespace, plan.query_vector, final_response)
+
+        if history is None:
+            history_store.append(session_id, question, final_response)
+
+    except Exception as e:
+        print(f"❌ Agent Error (stream): {e}")
+        final_response = FALLBACK_ANSWER
+
+    yield {"event": "done", "data": {"answer": final_response}}
+
+async def generate_chat_title(question: str):
     prompt = f"""
     Nhiệm vụ: Tóm tắt câu hỏi sau thành một TIÊU ĐỀ ngắn gọn, súc tích (dưới 6 từ).
     Yêu cầu:
@@ -272,12 +596,31 @@ def generate_chat_title(question: str):
     
     Tiêu đề:
     """
+    cache_key = make_key("generate-title", llm.model_name, {"question": question})
+    cached = result_cache.get("generate-title", cache_key)
+    if cached is not None:
+        return cached["title"]
+
     try:
         # Gọi LLM (dùng biến llm đã khai báo ở trên)
-        title = llm.invoke(prompt).content
+        async with upstream_slot("openai_chat"):
+            title = (await llm.ainvoke(prompt)).content
         
         # Làm sạch chuỗi (bỏ ngoặc kép, khoảng trắng thừa)
-        return title.strip().replace('"', '').replace("'", "")
+        title = title.strip().replace('"', '').replace("'", "")
+        result_cache.set(cache_key, {"title": title})
+        return title
     except Exception:
         # Fallback nếu AI lỗi: Cắt chuỗi thủ công
-        return question[:50] + "..."
\ No newline at end of file
+        return question[:50] + "..."
+
+def _collect_metrics():
+    semantic, embeddings = answer_cache.stats(), embedding_model.stats()
+    yield from counter_lines("lingora_cache_requests_total", "Cache lookups by cache and result", {
+        (("cache", "semantic_answer"), ("result", "hit")): semantic["hits"],
+        (("cache", "semantic_answer"), ("result", "miss")): semantic["misses"],
+        (("cache", "embedding"), ("result", "hit")): embeddings["memory_hits"] + embeddings["disk_hits"],
+        (("cache", "embedding"), ("result", "miss")): embeddings["misses"],
+    })
+
+register_collector(_collect_metrics)
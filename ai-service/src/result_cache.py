@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Optional
+from src.config.env import settings
+from src.lru_cache import LRUCache
+from src.metrics import counter_lines, register_collector
+
+def normalize_input(text: str, casefold: bool = False) -> str:
+    """NFC + gộp khoảng trắng. Chỉ casefold khi hoa/thường không ảnh hưởng kết quả (vd: moderation)."""
+    text = " ".join(unicodedata.normalize("NFC", text).split())
+    return text.casefold() if casefold else text
+
+def make_key(endpoint: str, model: str, inputs: Dict[str, str], casefold: bool = False) -> str:
+    payload = json.dumps(
+        [endpoint, model, {name: normalize_input(value or "", casefold) for name, value in sorted(inputs.items())}],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class DiskResultStore:
+    """Lưu kết quả (JSON) xuống SQLite kèm hạn dùng, để sống sót qua restart / dùng chung giữa các worker."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL) WITHOUT ROWID"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM results WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float]):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+
+class ResultCache:
+    """
+    Cache kết quả của các endpoint "gần như tất định" (moderate, generate-title, score/writing):
+    key = sha256(endpoint + model + input đã chuẩn hoá), value = dict JSON.
+    Tầng 1 là LRU trong process (micro giây), tầng 2 là SQLite tuỳ chọn.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float], disk_store: Optional[DiskResultStore] = None):
+        self.memory = LRUCache(max_entries, ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.disk_store = disk_store
+        self._lock = threading.Lock()
+        self._hits: Counter = Counter()
+        self._misses: Counter = Counter()
+        self.disk_hits = 0
+
+    def get(self, endpoint: str, key: str) -> Optional[Any]:
+        if not settings.RESULT_CACHE_ENABLED:
+            return None
+
+        value = self.memory.get(key)
+        if value is None and self.disk_store is not None:
+            value = self.disk_store.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+
+        with self._lock:
+            (self._hits if value is not None else self._misses)[endpoint] += 1
+        return value
+
+    def set(self, key: str, value: Any):
+        if not settings.RESULT_CACHE_ENABLED:
+            return
+        self.memory.set(key, value)
+        if self.disk_store is not None:
+            self.disk_store.set(key, value, self.ttl_seconds)
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        with self._lock:
+            endpoints = {}
+            for endpoint in sorted(set(self._hits) | set(self._misses)):
+                hits, misses = self._hits[endpoint], self._misses[endpoint]
+                endpoints[endpoint] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                }
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            return {
+                "entries": memory["entries"],
+                "max_entries": memory["max_entries"],
+                "evictions": memory["evictions"],
+                "hits": hits,
+                "misses": misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                "disk_enabled": self.disk_store is not None,
+                "endpoints": endpoints,
+            }
+
+result_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.RESULT_CACHE_TTL_SECONDS,
+    disk_store=DiskResultStore(settings.RESULT_CACHE_DB_PATH) if settings.RESULT_CACHE_DISK_ENABLED else None,
+)
+
+def _collect_metrics():
+    endpoints = result_cache.stats()["endpoints"]
+    yield from counter_lines("lingora_result_cache_requests_total", "Result cache lookups by endpoint", {
+        (("endpoint", endpoint), ("result", result)): stats[key]
+        for endpoint, stats in endpoints.items() for result, key in (("hit", "hits"), ("miss", "misses"))
+    })
+
+register_collector(_collect_metrics)
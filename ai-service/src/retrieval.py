@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.embedding_cache import normalize_text
+from src.vector_index import MmapVectorIndex, normalize
+
+Hit = Tuple[Document, float, np.ndarray]  # (document, cosine score, embedding đã chuẩn hoá)
+
+def _query_collection(name: str, store, query: np.ndarray, n: int) -> List[Hit]:
+    """
+    Search 1 collection bằng vector có sẵn, lấy kèm embedding của từng chunk để còn chạy MMR.
+    Score là cosine tự tính, nên không phụ thuộc distance metric của collection.
+    """
+    if isinstance(store, MmapVectorIndex):
+        hits = store.query(query, n)
+        for doc, score, _ in hits:
+            doc.metadata["collection"] = name
+            doc.metadata["score"] = round(score, 4)
+        return hits
+
+    result = store._collection.query(
+        query_embeddings=[query.tolist()],
+        n_results=n,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    documents = result["documents"][0]
+    if not documents:
+        return []
+
+    metadatas = result["metadatas"][0] or [None] * len(documents)
+    embeddings = normalize(result["embeddings"][0])
+    scores = embeddings @ query
+
+    hits = []
+    for text, metadata, embedding, score in zip(documents, metadatas, embeddings, scores):
+        metadata = dict(metadata or {})
+        metadata["collection"] = name
+        metadata["score"] = round(float(score), 4)
+        hits.append((Document(page_content=text, metadata=metadata), float(score), embedding))
+    return hits
+
+def _dedupe(hits: List[Hit]) -> List[Hit]:
+    # Cùng 1 đoạn có thể nằm ở cả 2 sách (hoặc bị nạp trùng) -> giữ bản có score cao nhất
+    best: Dict[str, Hit] = {}
+    for hit in hits:
+        key = hashlib.sha1(normalize_text(hit[0].page_content).encode("utf-8")).hexdigest()
+        if key not in best or hit[1] > best[key][1]:
+            best[key] = hit
+    return list(best.values())
+
+def mmr_select(query: np.ndarray, hits: List[Hit], k: int, lambda_mult: float) -> List[Hit]:
+    """
+    Maximal Marginal Relevance: lần lượt chọn chunk vừa liên quan tới câu hỏi,
+    vừa ít trùng ý với các chunk đã chọn.
+    """
+    if len(hits) <= 1 or k <= 0:
+        return hits[:k]
+
+    embeddings = np.vstack([hit[2] for hit in hits])
+    relevance = embeddings @ query
+    similarity = embeddings @ embeddings.T
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(hits)):
+        redundancy = similarity[:, selected].max(axis=1)
+        mmr_scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        mmr_scores[selected] = -np.inf
+        selected.append(int(np.argmax(mmr_scores)))
+
+    return [hits[i] for i in selected]
+
+async def search_collections(
+    stores: Dict[str, object],
+    query_vector: Sequence[float],
+    k: int,
+    fetch_k: int,
+    score_threshold: float,
+    lambda_mult: float,
+) -> List[Document]:
+    """
+    Search song song nhiều collection với CÙNG 1 query vector (chỉ embed 1 lần),
+    gộp theo score, lọc theo ngưỡng, bỏ trùng và đa dạng hoá bằng MMR.
+    """
+    query = normalize(query_vector)
+
+    results = await asyncio.gather(
+        *(asyncio.to_thread(_query_collection, name, store, query, fetch_k) for name, store in stores.items())
+    )
+
+    hits = [hit for collection_hits in results for hit in collection_hits if hit[1] >= score_threshold]
+    hits = sorted(_dedupe(hits), key=lambda hit: hit[1], reverse=True)
+    return [hit[0] for hit in mmr_select(query, hits, k, lambda_mult)]
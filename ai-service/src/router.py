@@ -0,0 +1,148 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.vector_index import MmapVectorIndex, normalize
+
+# Câu mẫu cho từng nhánh. Embedding của chúng được cache nên chỉ tốn 1 lần gọi OpenAI.
+ROUTE_EXEMPLARS: Dict[str, List[str]] = {
+    "grammar": [
+        "Thì hiện tại đơn dùng khi nào?",
+        "Cấu trúc câu bị động là gì?",
+        "Phân biệt thì quá khứ đơn và hiện tại hoàn thành",
+        "Câu điều kiện loại 2 dùng như thế nào?",
+        "Khi nào dùng mạo từ a, an, the?",
+        "Mệnh đề quan hệ which và that khác nhau thế nào?",
+        "How do I use the present perfect continuous?",
+        "What is the difference between will and going to?",
+    ],
+    "vocab": [
+        "Từ 'ubiquitous' nghĩa là gì?",
+        "Thành ngữ 'break the ice' có nghĩa là gì?",
+        "Cụm động từ 'give up' nghĩa là gì?",
+        "Từ đồng nghĩa với 'happy' là gì?",
+        "Các từ vựng chủ đề du lịch",
+        "Phân biệt 'make' và 'do' trong collocation",
+        "What does the idiom 'piece of cake' mean?",
+        "Give me some synonyms for 'important'",
+    ],
+    "web": [
+        "Từ lóng mới nhất của giới trẻ Mỹ hiện nay là gì?",
+        "Tin tức mới nhất về kỳ thi IELTS năm nay",
+        "Lịch thi TOEIC tháng này",
+        "Slang 'rizz' trên TikTok nghĩa là gì?",
+        "Học phí IELTS ở trung tâm nào rẻ nhất hiện nay?",
+    ],
+    "general": [
+        "Xin chào",
+        "Bạn là ai?",
+        "Cảm ơn bạn nhiều",
+        "Bạn có khỏe không?",
+        "Làm sao để học tiếng Anh hiệu quả?",
+        "Cho mình lời khuyên để tự tin nói tiếng Anh",
+    ],
+}
+
+@dataclass
+class RouteDecision:
+    route: Optional[str]  # None = không chắc chắn -> để Agent xử lý
+    score: float
+    margin: float
+    scores: Dict[str, float] = field(default_factory=dict)
+
+class QueryRouter:
+    """
+    Phân loại câu hỏi chưa có type thành grammar / vocab / web / general chỉ bằng phép nhân vector
+    với các prototype: embedding của câu mẫu + centroid của từng collection (index mmap hoặc Chroma).
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        collection_stores: Dict[str, object],
+        min_score: float,
+        min_margin: float,
+        exemplars: Dict[str, List[str]] = ROUTE_EXEMPLARS,
+        combined_route: Optional[str] = "books",
+    ):
+        self.embeddings = embeddings
+        self.collection_stores = collection_stores
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.exemplars = exemplars
+        # Khi 2 route đứng đầu đều là collection sách và sát nút nhau -> tra cả 2 cùng lúc
+        self.combined_route = combined_route
+
+        self._routes: List[str] = []
+        self._prototypes: Optional[np.ndarray] = None  # (n_prototypes, dim), đã chuẩn hoá
+        self._owners: Optional[np.ndarray] = None  # index route của từng prototype
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _collection_centroid(store) -> Optional[np.ndarray]:
+        if isinstance(store, MmapVectorIndex):
+            return store.centroid()  # vector trong index mmap đã chuẩn hoá sẵn
+        data = store.get(include=["embeddings"])
+        vectors = data.get("embeddings")
+        if vectors is None or len(vectors) == 0:
+            return None
+        vectors = normalize(vectors)
+        return vectors.mean(axis=0)
+
+    async def ensure_ready(self):
+        if self._prototypes is not None:
+            return
+
+        async with self._lock:
+            if self._prototypes is not None:
+                return
+
+            routes = list(self.exemplars)
+            texts = [text for route in routes for text in self.exemplars[route]]
+            owners = [i for i, route in enumerate(routes) for _ in self.exemplars[route]]
+            vectors = [np.asarray(v, dtype=np.float32) for v in await self.embeddings.aembed_documents(texts)]
+
+            for name, store in self.collection_stores.items():
+                if name not in routes:
+                    continue
+                centroid = await asyncio.to_thread(self._collection_centroid, store)
+                if centroid is not None:
+                    vectors.append(centroid)
+                    owners.append(routes.index(name))
+
+            self._routes = routes
+            self._owners = np.asarray(owners)
+            self._prototypes = normalize(np.vstack(vectors))
+
+    async def route(self, query_vector: Sequence[float]) -> RouteDecision:
+        await self.ensure_ready()
+
+        query = normalize(query_vector)
+        similarities = self._prototypes @ query
+
+        # Điểm của 1 route = prototype giống nhất thuộc route đó
+        scores = np.full(len(self._routes), -1.0, dtype=np.float32)
+        np.maximum.at(scores, self._owners, similarities)
+
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        confident = best >= self.min_score and margin >= self.min_margin
+
+        route = self._routes[order[0]] if confident else None
+        if (
+            route is None
+            and self.combined_route
+            and best >= self.min_score
+            and len(order) > 1
+            and {self._routes[order[0]], self._routes[order[1]]} <= set(self.collection_stores)
+        ):
+            route = self.combined_route
+
+        return RouteDecision(
+            route=route,
+            score=best,
+            margin=margin,
+            scores={name: round(float(scores[i]), 4) for i, name in enumerate(self._routes)},
+        )
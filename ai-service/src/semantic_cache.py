@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+import numpy as np
+from src.config.env import settings
+from src.vector_index import normalize
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời theo ngữ nghĩa: 2 câu hỏi cùng namespace (type) có embedding
+    cosine >= threshold thì dùng lại câu trả lời, bỏ qua cả retrieval lẫn LLM.
+
+    Vector được giữ trong 1 ma trận cấp phát sẵn (max_entries x dim), lookup là
+    1 phép nhân ma trận - vector. Có TTL và loại bỏ theo LRU khi đầy.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+
+        self._matrix: Optional[np.ndarray] = None  # cấp phát khi biết số chiều
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._namespaces: list = [None] * self.max_entries
+        self._answers: list = [None] * self.max_entries
+        self._lru: "OrderedDict[int, None]" = OrderedDict()  # slot -> None, cũ nhất ở đầu
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, namespace: str, vector: Sequence[float]) -> Optional[str]:
+        with self._lock:
+            if self._matrix is None or not self._lru:
+                self.misses += 1
+                return None
+
+            query = normalize(vector)
+            if query.shape[0] != self._matrix.shape[1]:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            candidates = self._valid & (self._expires_at > now)
+            candidates &= np.fromiter(
+                (ns == namespace for ns in self._namespaces), dtype=bool, count=self.max_entries
+            )
+            if not candidates.any():
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ query
+            scores[~candidates] = -1.0
+            slot = int(np.argmax(scores))
+
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._lru.move_to_end(slot)
+            self.hits += 1
+            return self._answers[slot]
+
+    def store(self, namespace: str, vector: Sequence[float], answer: str):
+        with self._lock:
+            query = normalize(vector)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+            elif query.shape[0] != self._matrix.shape[1]:
+                return
+
+            slot = self._free_slot()
+            self._matrix[slot] = query
+            self._valid[slot] = True
+            self._expires_at[slot] = time.time() + self.ttl_seconds
+            self._namespaces[slot] = namespace
+            self._answers[slot] = answer
+            self._lru[slot] = None
+
+    def _free_slot(self) -> int:
+        free = np.flatnonzero(~self._valid)
+        if free.size:
+            return int(free[0])
+
+        # Hết chỗ: dọn các entry đã hết hạn trước, sau đó mới bỏ entry ít dùng nhất
+        expired = np.flatnonzero(self._valid & (self._expires_at <= time.time()))
+        for slot in expired:
+            self._release(int(slot))
+        if expired.size:
+            return int(expired[0])
+
+        slot, _ = self._lru.popitem(last=False)
+        self._release(slot)
+        self.evictions += 1
+        return slot
+
+    def _release(self, slot: int):
+        self._valid[slot] = False
+        self._namespaces[slot] = None
+        self._answers[slot] = None
+        self._lru.pop(slot, None)
+
+    def clear(self):
+        with self._lock:
+            for slot in list(self._lru):
+                self._release(slot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "threshold": self.threshold,
+            }
+
+answer_cache = SemanticAnswerCache(
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+)
@@ -0,0 +1,209 @@
+import asyncio
+import importlib
+import time
+from dataclasses import dataclass, field
+from types import ModuleType
+from typing import Awaitable, Callable, Dict, Optional
+from src.config.env import settings
+
+# Module nặng import trong warm-up (langchain, openai, chroma...). Không bao giờ import trên thread của event loop:
+# đang có thread khác import dở thì `import` trên event loop phải chờ import lock -> mọi endpoint (cả /healthz) đứng theo.
+WARMUP_MODULES = ["rag", "grading", "moderation"]
+
+class NotReadyError(Exception):
+    """Module nặng còn đang được warm-up import -> request handler trả 503."""
+
+@dataclass
+class Component:
+    name: str
+    required: bool  # required = chưa xong thì /readyz trả 503
+    status: str = "pending"  # pending | ready | failed
+    seconds: Optional[float] = None
+    detail: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "required": self.required,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            **({"detail": self.detail} if self.detail else {}),
+            **({"error": self.error} if self.error else {}),
+        }
+
+class Warmup:
+    """
+    Khởi động service theo 2 bước, có đo thời gian từng thành phần:
+    1. Import các module nặng (rag, grading, moderation...) lần lượt trong thread, không chặn event loop
+       -> /healthz trả lời được ngay khi process vừa lên.
+    2. Chạy song song: mở vector index (mmap / Chroma), dựng router, mở sẵn kết nối tới OpenAI/Tavily...
+    /readyz chỉ trả 200 khi warm-up đã chạy xong và mọi thành phần bắt buộc đã sẵn sàng
+    (WARMUP_ENABLED=false -> không có gì được nạp trước -> luôn 503).
+    """
+
+    def __init__(self):
+        self.components: Dict[str, Component] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._imports: Dict[str, "asyncio.Future[ModuleType]"] = {}
+
+    def _component(self, name: str, required: bool) -> Component:
+        component = self.components.get(name)
+        if component is None:
+            component = Component(name, required)
+            self.components[name] = component
+        return component
+
+    async def _timed(self, name: str, required: bool, step: Callable[[], Awaitable[Optional[dict]]]):
+        component = self._component(name, required)
+        started = time.perf_counter()
+        try:
+            detail = await asyncio.wait_for(step(), settings.WARMUP_TIMEOUT_SECONDS)
+            component.status = "ready"
+            component.detail = detail or {}
+        except Exception as e:
+            component.status = "failed"
+            component.error = str(e) or type(e).__name__
+        component.seconds = time.perf_counter() - started
+        icon = "✅" if component.status == "ready" else ("❌" if required else "⚠️ ")
+        print(f"{icon} [warmup] {name}: {component.status} ({component.seconds:.2f}s)"
+              + (f" - {component.error}" if component.error else ""))
+
+    async def _import(self, module: str) -> ModuleType:
+        component = self._component(f"import:{module}", required=True)
+        started = time.perf_counter()
+        try:
+            loaded = await asyncio.to_thread(importlib.import_module, f"src.{module}")
+            component.status = "ready"
+            return loaded
+        except Exception as e:
+            component.status = "failed"
+            component.error = str(e) or type(e).__name__
+            raise
+        finally:
+            component.seconds = time.perf_counter() - started
+            print(f"{'✅' if component.status == 'ready' else '❌'} [warmup] import {module}: {component.seconds:.2f}s"
+                  + (f" - {component.error}" if component.error else ""))
+
+    async def import_module(self, module: str) -> ModuleType:
+        """Import src.<module> trong thread, 1 lần duy nhất (caller đồng thời chờ chung) và chờ tới khi xong."""
+        future = self._imports.get(module)
+        if future is None:
+            future = asyncio.ensure_future(self._import(module))
+            self._imports[module] = future
+        return await asyncio.shield(future)
+
+    async def load(self, module: str) -> ModuleType:
+        """
+        Module nặng cho request handler: import xong rồi -> trả về ngay; warm-up đang import -> NotReadyError (503)
+        thay vì chờ; chưa ai import (WARMUP_ENABLED=false) -> import trong thread rồi trả về.
+        """
+        future = self._imports.get(module)
+        if future is not None and not future.done():
+            raise NotReadyError(f"src.{module} is still loading (warm-up in progress)")
+        if future is not None and future.exception() is not None:
+            raise NotReadyError(f"src.{module} failed to load: {self.components[f'import:{module}'].error}")
+        return await self.import_module(module)
+
+    async def run(self):
+        for module in WARMUP_MODULES:
+            self._component(f"import:{module}", required=True)
+        for name, required, _ in WARMUP_STEPS:
+            self._component(name, required)
+
+        # Import tuần tự: import song song dễ đụng import lock của các module dùng chung.
+        # Đặt chỗ trước cho mọi module -> request tới giữa chừng nhận 503, không tự import song song
+        loop = asyncio.get_running_loop()
+        for module in WARMUP_MODULES:
+            self._imports[module] = loop.create_future()
+        for module in WARMUP_MODULES:
+            future = self._imports[module]
+            try:
+                future.set_result(await self._import(module))
+            except Exception as e:
+                future.set_exception(e)
+                future.exception()  # lỗi đã ghi vào component, không để asyncio log "never retrieved"
+        if self.components["import:rag"].status == "ready":
+            await asyncio.gather(*(self._timed(name, required, step) for name, required, step in WARMUP_STEPS))
+        else:
+            for name, _, _ in WARMUP_STEPS:
+                self.components[name].status = "failed"
+                self.components[name].error = "src.rag failed to import"
+
+        self.finished_at = time.time()
+        print(f"🔥 Warm-up xong sau {self.finished_at - self.started_at:.2f}s, ready={self.ready}")
+
+    @property
+    def ready(self) -> bool:
+        if self.finished_at is None:
+            return False  # đang warm-up, hoặc WARMUP_ENABLED=false (chưa nạp gì)
+        return all(component.status == "ready" for component in self.components.values() if component.required)
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "warming_up": self.finished_at is None and settings.WARMUP_ENABLED,
+            "warmup_enabled": settings.WARMUP_ENABLED,
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "components": {name: component.to_dict() for name, component in self.components.items()},
+        }
+
+async def _warm_vectors() -> dict:
+    """
+    Index mmap: đọc qua 1 lượt để OS nạp file vào page cache (worker khác dùng chung, không tốn thêm RAM).
+    Chroma: đọc 1 vector rồi query lại bằng chính nó -> nạp HNSW index vào RAM trước request đầu tiên.
+    """
+    from src.rag import book_stores
+    from src.vector_index import MmapVectorIndex
+
+    def load() -> dict:
+        report = {}
+        for name, store in book_stores.items():
+            if isinstance(store, MmapVectorIndex):
+                if not store.count:
+                    raise RuntimeError(f"Vector index '{name}' is empty (run `python -m src.ingest`)")
+                report[name] = {"backend": "mmap", **store.warm()}
+                continue
+            count = store._collection.count()
+            if not count:
+                raise RuntimeError(f"Collection '{name}' is empty (run `python -m src.ingest`)")
+            sample = store._collection.peek(1)
+            store._collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1)
+            report[name] = {"backend": "chroma", "count": count}
+        return report
+
+    return await asyncio.to_thread(load)
+
+async def _warm_lexical() -> dict:
+    from src.rag import lexical_indexes
+    return {"indexes": sorted(lexical_indexes)}
+
+async def _warm_router() -> dict:
+    from src.rag import query_router
+    await query_router.ensure_ready()
+    return {}
+
+async def _warm_openai() -> dict:
+    # Mở sẵn kết nối TLS keep-alive trong pool dùng chung (GET /models không tốn quota)
+    from src.clients import openai_http
+    response = await openai_http.get(
+        f"{settings.OPENAI_BASE_URL}/models",
+        headers={"Authorization": f"Bearer {settings.OPENAI_API_KEY}"},
+    )
+    return {"status_code": response.status_code}
+
+async def _warm_tavily() -> dict:
+    from src.clients import tavily_http
+    response = await tavily_http.get("/")
+    return {"status_code": response.status_code}
+
+# (tên, bắt buộc cho readiness?, hàm). Kết nối ra ngoài lỗi thì vẫn phục vụ được (request sau tự kết nối lại)
+WARMUP_STEPS = [
+    ("vectors", True, _warm_vectors),
+    ("lexical_index", False, _warm_lexical),
+    ("router", False, _warm_router),
+    ("openai_connection", False, _warm_openai),
+    ("tavily_connection", False, _warm_tavily),
+]
+
+warmup = Warmup()
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from src.config.env import settings
+
+VERSION = 3
+EXPORT_BATCH_SIZE = 1000
+SCAN_BLOCK_ROWS = 256  # quét bản nén theo khối nhỏ: bản float32 tạm của mỗi khối nằm gọn trong cache CPU
+COMPACT_DTYPES = ("float32", "float16", "int8")
+
+def index_dir(collection_name: str) -> str:
+    return os.path.join(settings.VECTOR_INDEX_DIR, collection_name)
+
+def normalize(matrix) -> np.ndarray:
+    """Chuẩn hoá L2 theo chiều cuối (1 vector hoặc ma trận nhiều dòng) về float32; vector 0 giữ nguyên."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Vector float32 đã chuẩn hoá -> (bản nén, scale từng dòng).
+    int8: mỗi dòng nhân với 127 / max|x| rồi làm tròn, score xấp xỉ = (codes @ query) * scale.
+    """
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unsupported compact dtype '{dtype}' (expected one of {', '.join(COMPACT_DTYPES)})")
+
+class MmapVectorIndex:
+    """
+    Index vector chỉ-đọc cho 1 collection, export từ Chroma lúc ingest:
+    - vectors.npy: float32 (N, dim) đã chuẩn hoá, np.load(mmap_mode="r")
+    - texts.bin + offsets.npy: nội dung chunk (UTF-8 nối liền) và vị trí bắt đầu của từng chunk
+    - meta.json: id, metadata từng chunk + thông tin export (model, số chiều, dtype...)
+    - vectors.<dtype>.npy (+ scales.npy với int8): bản nén float16/int8 để quét lượt đầu; chỉ top
+      k * rescore_factor ứng viên mới đọc tới vector float32 để tính lại score chính xác, nên phần
+      phải nằm trong RAM chỉ còn 1/2 (float16) hoặc 1/4 (int8).
+    File được mmap nên mọi worker uvicorn trên cùng máy dùng chung 1 bản trong page cache của OS,
+    không copy vào heap của từng process như Chroma. Top-k = 1 phép nhân ma trận - vector (exact search).
+    """
+
+    def __init__(self, name: str, path: str, rescore_factor: int = 4):
+        self.name = name
+        self.path = path
+        self.rescore_factor = max(1, rescore_factor)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != VERSION:
+            raise ValueError(f"Unsupported vector index version in {path}")
+
+        self.embedding_model: str = meta["embedding_model"]
+        self.ids: List[str] = meta["ids"]
+        self.metadatas: List[dict] = meta["metadatas"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._texts = np.memmap(os.path.join(path, "texts.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] else np.zeros(0, dtype=np.uint8)  # np.memmap không mở được file rỗng
+
+        self.dtype: str = meta.get("dtype", "float32")
+        self.compact: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        if self.dtype != "float32":
+            self.compact = np.load(os.path.join(path, f"vectors.{self.dtype}.npy"), mmap_mode="r")
+            if self.dtype == "int8":
+                self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")
+            if self.compact.shape != self.vectors.shape:
+                raise ValueError(f"Vector index {path} is inconsistent (re-run `python -m src.vector_index`)")
+
+        if not (len(self.ids) == len(self.metadatas) == len(self.vectors) == len(self.offsets) - 1):
+            raise ValueError(f"Vector index {path} is inconsistent (re-run `python -m src.vector_index`)")
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        """Tổng dung lượng trên đĩa (vector float32 + bản nén + nội dung chunk)."""
+        total = self.vectors.nbytes + self.offsets.nbytes + self._texts.nbytes
+        if self.compact is not None:
+            total += self.compact.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return int(total)
+
+    @property
+    def scan_nbytes(self) -> int:
+        """Số byte vector mọi query đều phải quét (phần cần nằm trong page cache để search nhanh)."""
+        if self.compact is None:
+            return int(self.vectors.nbytes)
+        return int(self.compact.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def text(self, i: int) -> str:
+        return bytes(self._texts[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def document(self, i: int) -> Document:
+        return Document(page_content=self.text(i), metadata=dict(self.metadatas[i] or {}))
+
+    def _scan(self, matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if matrix.dtype == np.float32:
+            return matrix @ query
+        # numpy không có đường nhanh cho float16 / int8 @ float32 -> đổi từng khối sang float32
+        scores = np.empty(self.count, dtype=np.float32)
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            block = matrix[start:start + SCAN_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        return scores
+
+    def search(self, query: np.ndarray, k: int, rescore_factor: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """query đã chuẩn hoá -> (chỉ số, cosine score) của top-k, score giảm dần."""
+        if not self.count or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if query.shape[-1] != self.dimensions:
+            raise ValueError(f"Query has {query.shape[-1]} dimensions, index '{self.name}' has {self.dimensions}")
+        query = query.astype(np.float32, copy=False)
+        k = min(k, self.count)
+
+        if self.compact is None:
+            candidates = np.arange(self.count)
+            scores = self._scan(self.vectors, query)
+        else:
+            # Lượt 1: quét bản nén lấy k * factor ứng viên; lượt 2: score chính xác bằng vector float32
+            n = min(self.count, k * (rescore_factor or self.rescore_factor))
+            approximate = self._scan(self.compact, query)
+            if self.scales is not None:
+                approximate *= self.scales
+            candidates = np.sort(np.argpartition(-approximate, n - 1)[:n])  # đọc float32 theo thứ tự trên đĩa
+            scores = self.vectors[candidates] @ query
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, **kwargs) -> List[Document]:
+        # Cùng chữ ký với Chroma.similarity_search_by_vector -> rag.py dùng được cả 2 backend
+        query = normalize(embedding)
+        indices, _ = self.search(query, k)
+        return [self.document(int(i)) for i in indices]
+
+    async def asimilarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, **kwargs) -> List[Document]:
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k)
+
+    def query(self, query: np.ndarray, n: int) -> List[Tuple[Document, float, np.ndarray]]:
+        """Top-n kèm score và embedding của từng chunk (src/retrieval.py dùng để chạy MMR)."""
+        indices, scores = self.search(query, n)
+        return [(self.document(int(i)), float(score), np.asarray(self.vectors[i])) for i, score in zip(indices, scores)]
+
+    def centroid(self) -> Optional[np.ndarray]:
+        if not self.count:
+            return None
+        if self.compact is None:
+            return np.asarray(self.vectors.mean(axis=0, dtype=np.float64), dtype=np.float32)
+        # Tính từ bản nén (sai số không đáng kể với centroid) -> không kéo cả file float32 vào page cache
+        total = np.zeros(self.dimensions, dtype=np.float64)
+        for start in range(0, self.count, SCAN_BLOCK_ROWS):
+            block = self.compact[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:start + len(block), None]
+            total += block.sum(axis=0)
+        return (total / self.count).astype(np.float32)
+
+    def warm(self):
+        """Đọc qua phần vector mà query nào cũng quét 1 lần để OS nạp vào page cache trước request đầu tiên."""
+        scanned = self.vectors if self.compact is None else self.compact
+        checksum = float(np.add.reduce(scanned, axis=0, dtype=np.float64).sum())
+        return {"count": self.count, "dimensions": self.dimensions, "dtype": self.dtype, "bytes": self.nbytes,
+                "scan_bytes": self.scan_nbytes, "checksum": round(checksum, 3)}
+
+def load_vector_index(collection_name: str) -> Optional[MmapVectorIndex]:
+    path = index_dir(collection_name)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        print(f"⚠️  Chưa có vector index cho {collection_name} ({path}) -> dùng ChromaDB")
+        return None
+    try:
+        index = MmapVectorIndex(collection_name, path, rescore_factor=settings.VECTOR_RESCORE_FACTOR)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️  Không mở được vector index {collection_name}: {e} -> dùng ChromaDB")
+        return None
+    if index.embedding_model != settings.EMBEDDING_MODEL_ID:
+        print(f"⚠️  Vector index {collection_name} dùng model {index.embedding_model} "
+              f"(hiện tại {settings.EMBEDDING_MODEL_ID}) -> dùng ChromaDB")
+        return None
+    return index
+
+def iter_collection(collection, include: Sequence[str] = ("embeddings", "documents", "metadatas"),
+                    batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """Đọc collection Chroma theo từng trang (limit/offset) -> RAM chỉ giữ 1 trang mỗi lúc."""
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        yield collection.get(include=list(include), limit=batch_size, offset=offset)
+
+def write_index(path: str, collection_name: str, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[dict],
+                matrix: np.ndarray, embedding_model: str, dtype: str):
+    """Ghi 1 index mmap vào `path` (thư mục mới). Dùng cho export lúc ingest và benchmarks/vector_compression.py."""
+    if dtype not in COMPACT_DTYPES:
+        raise ValueError(f"Unsupported VECTOR_INDEX_DTYPE '{dtype}' (expected one of {', '.join(COMPACT_DTYPES)})")
+    os.makedirs(path)
+
+    offsets = [0]
+    with open(os.path.join(path, "texts.bin"), "wb") as f:
+        for text in texts:
+            data = (text or "").encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+    matrix = normalize(matrix) if len(matrix) else np.zeros((0, 0), dtype=np.float32)
+    np.save(os.path.join(path, "vectors.npy"), matrix)
+    np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    if dtype != "float32":
+        compact, scales = quantize(matrix, dtype)
+        np.save(os.path.join(path, f"vectors.{dtype}.npy"), compact)
+        if scales is not None:
+            np.save(os.path.join(path, "scales.npy"), scales)
+
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": VERSION,
+            "collection": collection_name,
+            "embedding_model": embedding_model,
+            "dtype": dtype,
+            "dimensions": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            "count": len(ids),
+            "exported_at": time.time(),
+            "ids": list(ids),
+            "metadatas": list(metadatas),
+        }, f, ensure_ascii=False)
+
+def read_collection(collection_name: str) -> Tuple[List[str], List[str], List[dict], np.ndarray]:
+    """Đọc hết 1 collection Chroma -> (ids, texts, metadatas, ma trận float32 gốc)."""
+    from langchain_chroma import Chroma
+
+    store = Chroma(persist_directory=settings.CHROMA_DB_DIR, collection_name=collection_name)
+    ids: List[str] = []
+    texts: List[str] = []
+    metadatas: List[dict] = []
+    vectors: List[np.ndarray] = []
+    for batch in iter_collection(store._collection):
+        ids.extend(batch["ids"])
+        texts.extend(batch["documents"])
+        metadatas.extend(metadata or {} for metadata in batch["metadatas"])
+        vectors.extend(np.asarray(embedding, dtype=np.float32) for embedding in batch["embeddings"])
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, texts, metadatas, matrix
+
+def export_collection(collection_name: str, embedding_model: str = None, dtype: str = None) -> str:
+    """
+    Chroma -> thư mục index mmap. Ghi vào thư mục tạm rồi đổi tên, nên worker đang chạy
+    (đã mmap file cũ) không đọc phải file ghi dở.
+    """
+    dtype = dtype or settings.VECTOR_INDEX_DTYPE
+    started = time.perf_counter()
+    ids, texts, metadatas, matrix = read_collection(collection_name)
+
+    target = index_dir(collection_name)
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    write_index(tmp_dir, collection_name, ids, texts, metadatas, matrix,
+                embedding_model or settings.EMBEDDING_MODEL_ID, dtype)
+
+    old_dir = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    size = sum(os.path.getsize(os.path.join(target, name)) for name in os.listdir(target))
+    print(f"✅ Vector index {collection_name} ({dtype}): {len(ids)} chunks, {size / 1024 / 1024:.1f} MB "
+          f"({time.perf_counter() - started:.1f}s) -> {target}")
+    return target
+
+def is_up_to_date(collection_name: str, count: int) -> bool:
+    """Index mmap khớp với collection (cùng số chunk, embedding model, dtype) -> không cần export lại."""
+    try:
+        with open(os.path.join(index_dir(collection_name), "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (
+        meta.get("version") == VERSION
+        and meta.get("count") == count
+        and meta.get("embedding_model") == settings.EMBEDDING_MODEL_ID
+        and meta.get("dtype", "float32") == settings.VECTOR_INDEX_DTYPE
+    )
+
+if __name__ == "__main__":
+    from src.ingest import FILES_TO_PROCESS
+
+    for name in FILES_TO_PROCESS.values():
+        export_collection(name)
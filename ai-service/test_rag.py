@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 import time
@@ -37,7 +38,7 @@ def main():
             start_time = time.time()
             
             # --- GỌI HÀM LOGIC ---
-            answer = get_answer(question)
+            answer = asyncio.run(get_answer(question))
             # ---------------------
             
             end_time = time.time()
@@ -0,0 +1,71 @@
+import unittest
+import httpx
+from src.clients import PolicyTransport, SyncPolicyTransport, UpstreamPolicy
+from src.config.env import settings
+
+class PolicyTransportTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._saved = (settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY, settings.UPSTREAM_MAX_RETRIES)
+        settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY, settings.UPSTREAM_MAX_RETRIES = 0.0, 0.0, 2
+        self.policy = UpstreamPolicy("test", (600, 0), {})
+        self.calls = 0
+
+    def tearDown(self):
+        settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY, settings.UPSTREAM_MAX_RETRIES = self._saved
+
+    def client(self, handler) -> httpx.AsyncClient:
+        def counted(request: httpx.Request) -> httpx.Response:
+            self.calls += 1
+            return handler(request)
+        return httpx.AsyncClient(transport=PolicyTransport(self.policy, httpx.MockTransport(counted)))
+
+    async def post(self, handler):
+        async with self.client(handler) as client:
+            return await client.post("http://upstream.test/v1/chat/completions", json={"model": "m", "messages": []})
+
+    async def test_read_timeout_is_not_resent(self):
+        def handler(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+        with self.assertRaises(httpx.ReadTimeout):
+            await self.post(handler)
+        self.assertEqual(self.calls, 1)
+
+    async def test_remote_protocol_error_is_not_resent(self):
+        def handler(request):
+            raise httpx.RemoteProtocolError("peer closed connection", request=request)
+        with self.assertRaises(httpx.RemoteProtocolError):
+            await self.post(handler)
+        self.assertEqual(self.calls, 1)
+
+    async def test_connect_error_is_retried(self):
+        def handler(request):
+            if self.calls == 1:
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200, json={})
+        response = await self.post(handler)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 2)
+
+    async def test_every_attempt_is_admitted_by_rate_limiter(self):
+        def handler(request):
+            return httpx.Response(429 if self.calls == 1 else 200, json={})
+        response = await self.post(handler)
+        self.assertEqual(response.status_code, 200)
+        # 2 lần gửi -> bucket RPM bị trừ 2 request
+        self.assertAlmostEqual(self.policy.limiters["m"].levels[0], 598, delta=0.5)
+
+class SyncPolicyTransportTest(unittest.TestCase):
+    def test_read_timeout_is_not_resent(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        client = httpx.Client(transport=SyncPolicyTransport(UpstreamPolicy("test", (0, 0), {}), httpx.MockTransport(handler)))
+        with self.assertRaises(httpx.ReadTimeout):
+            client.post("http://upstream.test/v1/audio/transcriptions", content=b"x")
+        self.assertEqual(len(calls), 1)
+
+if __name__ == "__main__":
+    unittest.main()
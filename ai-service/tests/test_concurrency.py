@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from src.concurrency import get_semaphore, stream_in_slot
+
+async def tokens(count: int, delay: float = 0.0):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        yield i
+
+async def failing():
+    yield 1
+    raise RuntimeError("upstream failed")
+
+class StreamInSlotTest(unittest.IsolatedAsyncioTestCase):
+    def free_slots(self) -> int:
+        return get_semaphore("openai_chat")._value
+
+    async def test_yields_all_items(self):
+        self.assertEqual([i async for i in stream_in_slot("openai_chat", tokens(5))], [0, 1, 2, 3, 4])
+
+    async def test_slot_released_before_slow_consumer_finishes(self):
+        free = self.free_slots()
+        stream = stream_in_slot("openai_chat", tokens(3))
+        self.assertEqual(await stream.__anext__(), 0)
+        await asyncio.sleep(0.01)  # upstream đã sinh xong, client chưa đọc hết
+        self.assertEqual(self.free_slots(), free)
+        self.assertEqual([i async for i in stream], [1, 2])
+
+    async def test_aclose_releases_slot(self):
+        free = self.free_slots()
+        stream = stream_in_slot("openai_chat", tokens(1000, delay=0.01))
+        self.assertEqual(await stream.__anext__(), 0)
+        self.assertEqual(self.free_slots(), free - 1)
+        await stream.aclose()
+        await asyncio.sleep(0)
+        self.assertEqual(self.free_slots(), free)
+
+    async def test_cancelled_consumer_releases_slot(self):
+        free = self.free_slots()
+
+        async def consume():
+            async for _ in stream_in_slot("openai_chat", tokens(1000, delay=0.01)):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.03)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        self.assertEqual(self.free_slots(), free)
+
+    async def test_upstream_error_is_raised(self):
+        received = []
+        with self.assertRaises(RuntimeError):
+            async for item in stream_in_slot("openai_chat", failing()):
+                received.append(item)
+        self.assertEqual(received, [1])
+
+if __name__ == "__main__":
+    unittest.main()
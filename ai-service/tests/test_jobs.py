@@ -0,0 +1,64 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import httpx
+from src import jobs
+from src.jobs import JobQueue, SQLiteJobStore
+
+class FailingCallbacks:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def post(self, url, json=None, timeout=None):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        raise httpx.ConnectError("callback down")
+
+class JobQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = SQLiteJobStore(os.path.join(self.tmp.name, "jobs.sqlite3"))
+
+        async def echo(payload: dict) -> dict:
+            return payload
+
+        self.queue = JobQueue(self.store, handlers={"echo": echo}, workers=1, max_pending=10)
+        await self.queue.start()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        self.tmp.cleanup()
+
+    async def wait_done(self, job_id: str, timeout: float = 2.0) -> dict:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = await self.queue.get(job_id)
+            if job["status"] == "done":
+                return job
+            await asyncio.sleep(0.01)
+        self.fail(f"job {job_id} not done")
+
+    async def test_slow_callback_does_not_hold_worker(self):
+        with mock.patch.object(jobs, "outbound_http", FailingCallbacks(delay=5)):
+            first = await self.queue.submit("echo", {"n": 1}, callback_url="http://callback.invalid")
+            second = await self.queue.submit("echo", {"n": 2})
+            await self.wait_done(first["id"])
+            job = await self.wait_done(second["id"])
+            self.assertEqual(job["result"], {"n": 2})
+            self.assertEqual((await self.queue.stats())["callbacks_in_flight"], 1)
+
+    async def test_no_sleep_after_last_callback_attempt(self):
+        callbacks = FailingCallbacks()
+        with mock.patch.object(jobs, "outbound_http", callbacks), \
+             mock.patch.object(jobs.settings, "JOB_CALLBACK_MAX_ATTEMPTS", 2), \
+             mock.patch.object(jobs.asyncio, "sleep", mock.AsyncMock()) as sleep:
+            job = self.store.create("echo", {}, callback_url="http://callback.invalid")
+            await self.queue._notify(job)
+        self.assertEqual(callbacks.calls, 2)
+        sleep.assert_awaited_once_with(1)
+        self.assertEqual(self.store.get(job["id"])["callback_status"], "failed")
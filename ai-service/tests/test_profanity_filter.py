@@ -0,0 +1,55 @@
+import unittest
+from src.profanity_filter import MILD_TERMS, SEVERE_TERMS, ProfanityFilter, normalize
+
+class NormalizeTest(unittest.TestCase):
+    def test_symbol_leetspeak_is_folded(self):
+        self.assertEqual(normalize("sh!t"), "shit")
+        self.assertEqual(normalize("$hit"), "shit")
+        self.assertEqual(normalize("f@ck you"), "fack you")
+        self.assertEqual(normalize("s.h.!.t"), "shit")
+
+    def test_punctuation_and_numbers_are_kept(self):
+        self.assertEqual(normalize("hello!"), "hello!")
+        self.assertEqual(normalize("ngày 15"), "ngày 15")
+        self.assertEqual(normalize("học lúc 15h"), "học lúc 15h")
+
+    def test_separators_and_repeats(self):
+        self.assertEqual(normalize("n.g.u"), "ngu")
+        self.assertEqual(normalize("nguuuuu"), "ngu")
+
+class ProfanityFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.filter = ProfanityFilter(SEVERE_TERMS, MILD_TERMS, fast_safe_max_words=3, fast_safe_max_chars=30)
+
+    def verdict(self, text: str) -> str:
+        return self.filter.check(text).verdict
+
+    def test_symbol_leetspeak_is_not_safe(self):
+        for text in ("f@ck you", "sh!t", "$hit", "f0ck"):
+            self.assertEqual(self.verdict(text), "unsafe", text)
+
+    def test_short_text_without_lexicon_hit_goes_to_llm(self):
+        for text in ("go die", "kill u", "ngày 15 nhé"):
+            self.assertEqual(self.verdict(text), "ambiguous", text)
+
+    def test_allowlisted_short_text_is_safe(self):
+        for text in ("hello!", "cảm ơn ạ", "xin chào 😊", "👍", "123"):
+            self.assertEqual(self.verdict(text), "safe", text)
+
+    def test_unaccented_homographs_are_ambiguous(self):
+        # "di ngu" = "đi ngủ" gõ không dấu, "cc" = carbon copy
+        for text in ("di ngu", "cc me on email", "vl"):
+            self.assertEqual(self.verdict(text), "ambiguous", text)
+
+    def test_accented_words_are_not_profanity(self):
+        self.assertNotEqual(self.verdict("đi ngủ sớm nhé các bạn"), "unsafe")
+        self.assertEqual(self.filter.check("đi ngủ").detected_word, "")
+
+    def test_severe_terms(self):
+        self.assertEqual(self.verdict("đéo"), "unsafe")
+        self.assertEqual(self.verdict("fuck!"), "unsafe")
+        self.assertEqual(self.verdict("you are ngu lol"), "unsafe")
+        self.assertEqual(self.filter.check("deo kinh").verdict, "ambiguous")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import asyncio
+import unittest
+from src.startup import NotReadyError, Warmup
+
+class WarmupLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_module_being_warmed_up_is_not_ready(self):
+        warmup = Warmup()
+        warmup._imports["grading_models"] = asyncio.get_running_loop().create_future()  # warm-up đang import
+        with self.assertRaises(NotReadyError):
+            await warmup.load("grading_models")
+
+    async def test_load_without_warmup_imports_in_thread(self):
+        warmup = Warmup()
+        module = await warmup.load("grading_models")
+        self.assertTrue(hasattr(module, "SectionItem"))
+        self.assertEqual(warmup.components["import:grading_models"].status, "ready")
+
+    async def test_failed_import_is_not_ready(self):
+        warmup = Warmup()
+        with self.assertRaises(ModuleNotFoundError):
+            await warmup.import_module("does_not_exist")
+        with self.assertRaises(NotReadyError):
+            await warmup.load("does_not_exist")
+
+    def test_not_ready_until_warmup_has_run(self):
+        warmup = Warmup()
+        self.assertFalse(warmup.ready)
+        self.assertFalse(warmup.report()["ready"])
+
+if __name__ == "__main__":
+    unittest.main()